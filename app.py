@@ -1,6 +1,6 @@
 import streamlit as st
 from utils_ui import render_app_ui
-from email_parser import parse_eml_file
+from email_parser import parse_eml_file_cached
 from llm import build_email_prompt  # ✅ Add this import
 
 from dotenv import load_dotenv
@@ -14,6 +14,8 @@ if "app_reset" not in st.session_state:
 top_col1, top_col2 = st.columns([8, 1])
 with top_col2:
     if st.button("🔄 Refresh App"):
+        if "jobs" in st.session_state:
+            st.session_state.jobs.cancel_all()
         st.session_state.clear()
         st.session_state["app_reset"] = True
         st.rerun()
@@ -31,7 +33,8 @@ uploaded_file = st.file_uploader(
 
 if uploaded_file is not None:
     try:
-        st.session_state.email_data = parse_eml_file(uploaded_file)
+        # Reruns (every 0.3 s while jobs poll) hit the cache; only real parses record a stage.
+        st.session_state.email_data = parse_eml_file_cached(uploaded_file)
         st.success("✅ Email parsed successfully!")
 
         st.write("📤 From:", st.session_state.email_data.get("from_address"))
@@ -0,0 +1,276 @@
+import os
+import io
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, ALL_COMPLETED, FIRST_COMPLETED, wait
+from email.utils import parseaddr
+
+from cache import hash_key
+from chunked_extract import build_chunk_prompts, extract_chunks, needs_chunking
+from dedupe import VERIFY_MAX_CHANGED_LINES, DuplicateIndex, build_verification_prompt, changed_lines, fingerprint
+from email_parser import parse_eml_file
+from ingest import iter_messages, read_headers
+from llm import build_email_prompt, query_claude
+from prompt_builder import split_prompt_template
+from sender_templates import TemplateStore, layout_key, should_verify
+from telemetry import stage
+
+DEFAULT_WORKERS = int(os.getenv("BATCH_WORKERS", "8"))
+DEFAULT_REQUESTS_PER_MINUTE = float(os.getenv("BEDROCK_REQUESTS_PER_MINUTE", "100"))
+# What to do with a near-duplicate of an already extracted email:
+# "flag" records it and extracts normally, "reuse" copies the earlier extraction,
+# "verify" asks the model to update the earlier extraction from the changed lines only.
+NEAR_DUPLICATE_MODES = ("flag", "reuse", "verify")
+DEFAULT_NEAR_DUPLICATE_MODE = os.getenv("DEDUPE_NEAR_MODE", "flag")
+
+
+class TokenBucket:
+    """Thread-safe token bucket used to keep Bedrock calls under the account quota."""
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or max(1.0, self.rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait_for = (tokens - self.tokens) / self.rate
+            time.sleep(wait_for)
+
+
+def load_completed_ids(output_path):
+    completed = set()
+    if not os.path.exists(output_path):
+        return completed
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # partially written line from a crashed run
+            if record.get("status") == "ok":
+                completed.add(record["id"])
+    return completed
+
+
+def is_error_output(output):
+    return output.startswith(("[LLM Error", "[Unsupported model"))
+
+
+def process_email(email_id, raw_bytes, prompt_template, model_id, bucket, token_budget=None, compact=None,
+                  index=None, scope=None, near_mode=DEFAULT_NEAR_DUPLICATE_MODE, templates=None, chunked=True):
+    started = time.perf_counter()
+    record = {"id": email_id, "model_id": model_id}
+    try:
+        # Headers first: cheap, and they identify the email even if the body fails to parse.
+        headers = read_headers(raw_bytes)
+        record["subject"] = str(headers.get("Subject", ""))
+        record["from_address"] = parseaddr(str(headers.get("From", "")))[1]
+        with stage("parse", source="batch"):
+            email_data = parse_eml_file(io.BytesIO(raw_bytes))
+
+        match_kind, match, fp = None, None, None
+        if index is not None:
+            # Before building the prompt: fingerprinting does not trigger attachment extraction.
+            with stage("dedupe", source="batch") as fields:
+                fp = fingerprint(email_data)
+                match_kind, match = index.lookup(scope, fp)
+                fields["match"] = match_kind
+        if match_kind == "exact" or (match_kind == "near" and near_mode == "reuse"):
+            record["extracted_data"] = match["output"]
+            record["reused_from"] = match["email_id"]
+            record["status"] = "ok"
+            if match_kind == "near":
+                record["near_duplicate_of"] = match["email_id"]
+                record["distance"] = match["distance"]
+                index.add(scope, fp, email_id, match["output"])
+            record["elapsed_sec"] = round(time.perf_counter() - started, 3)
+            return record
+
+        diff = None
+        if match_kind == "near":
+            record["near_duplicate_of"] = match["email_id"]
+            record["distance"] = match["distance"]
+            if near_mode == "verify":
+                diff = changed_lines(match["lines"], fp.lines)
+                if len(diff) > VERIFY_MAX_CHANGED_LINES:
+                    diff = None  # too different to patch; extract from scratch
+
+        layout, rule_data = None, None
+        if diff is not None:
+            bucket.acquire()
+            result = query_claude(build_verification_prompt(match["output"], diff), model_id=model_id)
+            record["verified_from"] = match["email_id"]
+        elif chunked and needs_chunking(email_data, compact=compact):
+            # Long attachments: extract overlapping chunks concurrently and merge, instead of one
+            # huge call whose answer would be cut off at max_tokens.
+            chunk_prompts = build_chunk_prompts(email_data, prompt_template, compact=compact)
+            merged = extract_chunks(chunk_prompts, model_id=model_id, before_call=bucket.acquire)
+            record["chunks"] = merged["chunks"]
+            if merged["conflicts"]:
+                record["conflicts"] = merged["conflicts"]
+            if merged["errors"]:
+                record["chunk_errors"] = merged["errors"]
+            output = json.dumps(merged["data"]) if merged["data"] is not None else "[LLM Error: no chunk returned JSON]"
+            if merged["failed_chunks"] and merged["data"] is not None:
+                # Items of the failed chunks are missing: an error, so it is neither indexed nor skipped on resume.
+                record["partial_data"] = output
+                output = f"[LLM Error: {merged['failed_chunks']} of {merged['chunks']} chunks failed]"
+            result = {"extracted_data": output, "usage": merged["usage"]}
+        else:
+            email_prompt = build_email_prompt(email_data, token_budget=token_budget, compact=compact)
+            if templates is not None:
+                layout = layout_key(scope, email_data)
+                with stage("template", source="batch") as fields:
+                    rule_data = templates.extract(layout, email_prompt)
+                    fields["hit"] = rule_data is not None
+                if rule_data is not None:
+                    record["extracted_data"] = json.dumps(rule_data, indent=2)
+                    record["template"] = layout[:12]
+                    record["status"] = "ok"
+                    if not should_verify(email_id) and not templates.needs_check(layout):
+                        if index is not None:
+                            index.add(scope, fp, email_id, record["extracted_data"])
+                        record["elapsed_sec"] = round(time.perf_counter() - started, 3)
+                        return record
+            # The instructions before {email_data} are identical for every email: send them as a prompt-cache prefix.
+            prompt_prefix, prompt = split_prompt_template(prompt_template, email_prompt)
+            bucket.acquire()
+            result = query_claude(prompt, model_id=model_id, prefix=prompt_prefix)
+        output = result["extracted_data"]
+        record["extracted_data"] = output
+        record["usage"] = result.get("usage")
+        record["status"] = "error" if is_error_output(output) else "ok"
+        if record["status"] == "ok":
+            if index is not None:
+                index.add(scope, fp, email_id, output)
+            if rule_data is not None:
+                record["template_verified"] = templates.check(layout, rule_data, output)
+            elif layout is not None:
+                templates.add_example(layout, email_id, email_prompt, output)
+    except Exception as e:
+        record["status"] = "error"
+        record["error"] = f"{type(e).__name__}: {e}"
+    record["elapsed_sec"] = round(time.perf_counter() - started, 3)
+    return record
+
+
+def run_batch(source, prompt_template, output_path, model_id=None, workers=DEFAULT_WORKERS,
+              requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE, resume=True, token_budget=None, compact=None,
+              dedupe=True, near_mode=DEFAULT_NEAR_DUPLICATE_MODE, learn_templates=True, chunked=True):
+    model_id = model_id or os.getenv("BEDROCK_MODEL_ID")
+    completed = load_completed_ids(output_path) if resume else set()
+    bucket = TokenBucket(requests_per_minute, capacity=workers)
+    index = DuplicateIndex() if dedupe else None
+    templates = TemplateStore() if learn_templates else None
+    # Extractions are only reused between runs with the same prompt, model and prompt settings.
+    scope = hash_key("dedupe", prompt_template, model_id, token_budget, compact)
+    stats = {
+        "ok": 0, "error": 0, "skipped": 0, "reused": 0, "near_duplicates": 0, "templated": 0, "chunked": 0,
+        "input_tokens": 0, "cache_read_tokens": 0, "cache_write_tokens": 0,
+    }
+    started = time.perf_counter()
+
+    print(f"🚀 Batch run: source={source} workers={workers} rpm={requests_per_minute}")
+    if completed:
+        print(f"⏩ Resuming — {len(completed)} emails already done")
+
+    with open(output_path, "a" if resume else "w", encoding="utf-8") as out, \
+            ThreadPoolExecutor(max_workers=workers) as pool:
+        in_flight = set()
+
+        def drain(return_when):
+            nonlocal in_flight
+            done, in_flight = wait(in_flight, return_when=return_when)
+            for future in done:
+                record = future.result()
+                stats[record["status"]] += 1
+                stats["reused"] += "reused_from" in record
+                stats["near_duplicates"] += "near_duplicate_of" in record
+                stats["templated"] += "template" in record and "usage" not in record
+                stats["chunked"] += "chunks" in record
+                for key, count in (record.get("usage") or {}).items():
+                    if key in stats:
+                        stats[key] += count
+                out.write(json.dumps(record) + "\n")
+                out.flush()
+
+        for email_id, raw_bytes in iter_messages(source):
+            if email_id in completed:
+                stats["skipped"] += 1
+                continue
+            # Keep the queue bounded so huge mailboxes do not sit in memory.
+            if len(in_flight) >= workers * 2:
+                drain(FIRST_COMPLETED)
+            in_flight.add(pool.submit(
+                process_email, email_id, raw_bytes, prompt_template, model_id, bucket, token_budget, compact,
+                index, scope, near_mode, templates, chunked,
+            ))
+
+        if in_flight:
+            drain(ALL_COMPLETED)
+
+    elapsed = time.perf_counter() - started
+    processed = stats["ok"] + stats["error"]
+    stats["elapsed_sec"] = round(elapsed, 2)
+    stats["emails_per_minute"] = round(processed / elapsed * 60, 2) if elapsed > 0 else 0.0
+    print(f"✅ Batch finished: {stats}")
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run an extraction prompt over a folder, mbox or Maildir of emails.")
+    parser.add_argument("source", help="Folder of .eml files, Maildir directory or mbox file")
+    parser.add_argument("--prompt-file", required=True, help="Prompt template containing {email_data}")
+    parser.add_argument("--output", default="batch_results.jsonl", help="JSONL results file")
+    parser.add_argument("--model", default=None, help="Bedrock model ID (defaults to BEDROCK_MODEL_ID)")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument("--rpm", type=float, default=DEFAULT_REQUESTS_PER_MINUTE, help="Max model requests per minute")
+    parser.add_argument("--token-budget", type=int, default=None, help="Max estimated tokens for the email section")
+    parser.add_argument("--compact", action="store_true", default=None,
+                        help="Strip quoted replies, signatures, boilerplate and repeated lines")
+    parser.add_argument("--no-resume", action="store_true", help="Start over instead of skipping finished emails")
+    parser.add_argument("--no-dedupe", action="store_true", help="Extract every email, even exact duplicates")
+    parser.add_argument("--no-templates", action="store_true",
+                        help="Do not learn or use per-sender extraction templates")
+    parser.add_argument("--no-chunking", action="store_true",
+                        help="Send long attachments in one call instead of chunked map-reduce extraction")
+    parser.add_argument("--near-duplicates", choices=NEAR_DUPLICATE_MODES, default=DEFAULT_NEAR_DUPLICATE_MODE,
+                        help="flag: extract and record the match; reuse: copy the earlier extraction; "
+                             "verify: update the earlier extraction from the changed lines")
+    args = parser.parse_args(argv)
+
+    with open(args.prompt_file, "r", encoding="utf-8") as f:
+        prompt_template = f.read()
+
+    stats = run_batch(
+        args.source,
+        prompt_template,
+        args.output,
+        model_id=args.model,
+        workers=args.workers,
+        requests_per_minute=args.rpm,
+        resume=not args.no_resume,
+        token_budget=args.token_budget,
+        compact=args.compact,
+        dedupe=not args.no_dedupe,
+        near_mode=args.near_duplicates,
+        learn_templates=not args.no_templates,
+        chunked=not args.no_chunking,
+    )
+    return 0 if stats["error"] == 0 else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
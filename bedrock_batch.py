@@ -0,0 +1,275 @@
+"""Offline Bedrock batch inference: export a corpus to JSONL shards, import the results.
+
+    python bedrock_batch.py export ./archive --prompt-file prompt.txt --out ./batch-export
+    # upload batch-export/*.jsonl to S3 and run a model invocation job over them
+    python bedrock_batch.py import ./batch-export ./job-output --output results.jsonl
+
+Request bodies come from the same build_request_body used by query_claude, and results
+are written in the same record format as batch.py, so both feed the same downstream tools.
+"""
+import io
+import os
+import json
+import time
+import string
+import hashlib
+import argparse
+from email.utils import parseaddr
+
+from batch import load_completed_ids
+from email_parser import parse_eml_file
+from ingest import iter_messages, read_headers
+from json_extract import extract_json
+from llm import build_email_prompt, build_request_body, estimate_cost, parse_response_text, parse_usage, resolve_model_id
+from prompt_builder import split_prompt_template
+
+# Service limits for one input file; lower them if the account quotas are smaller.
+BATCH_MAX_RECORDS_PER_FILE = int(os.getenv("BEDROCK_BATCH_MAX_RECORDS", "50000"))
+BATCH_MAX_FILE_BYTES = int(float(os.getenv("BEDROCK_BATCH_MAX_FILE_MB", "1024")) * 1024 * 1024)
+BATCH_MIN_RECORDS_PER_JOB = int(os.getenv("BEDROCK_BATCH_MIN_RECORDS", "100"))
+# Batch inference is billed at a discount to on-demand pricing.
+BATCH_PRICE_FACTOR = float(os.getenv("BEDROCK_BATCH_PRICE_FACTOR", "0.5"))
+
+# The batch-inference input format documents recordId as an 11-character alphanumeric string.
+RECORD_ID_LENGTH = 11
+RECORD_ID_ALPHABET = string.digits + string.ascii_letters
+
+EXPORT_META = "export.json"
+MANIFEST = "manifest.jsonl"
+
+
+def record_id(email_id, salt=0):
+    """Stable across re-exports, so results can always be joined back to their email.
+
+    The first 11 base-62 digits of a SHA-256 (~65 bits); ``salt`` derives another ID when
+    two emails in one export collide.
+    """
+    key = str(email_id) if not salt else f"{email_id}#{salt}"
+    number = int.from_bytes(hashlib.sha256(key.encode("utf-8")).digest(), "big")
+    chars = []
+    for _ in range(RECORD_ID_LENGTH):
+        number, digit = divmod(number, len(RECORD_ID_ALPHABET))
+        chars.append(RECORD_ID_ALPHABET[digit])
+    return "".join(chars)
+
+
+class ShardWriter:
+    """Writes JSONL lines into numbered shards, rolling over before either limit is exceeded."""
+
+    def __init__(self, directory, max_records=BATCH_MAX_RECORDS_PER_FILE, max_bytes=BATCH_MAX_FILE_BYTES):
+        self.directory = directory
+        self.max_records = max_records
+        self.max_bytes = max_bytes
+        self.shards = []
+        self.file = None
+        self.records = 0
+        self.bytes = 0
+
+    def _roll(self):
+        self.close()
+        name = f"batch-input-{len(self.shards):05d}.jsonl"
+        self.file = open(os.path.join(self.directory, name), "wb")
+        self.shards.append({"file": name, "records": 0, "bytes": 0})
+        self.records = self.bytes = 0
+
+    def write(self, obj):
+        line = (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8")
+        if len(line) > self.max_bytes:
+            raise ValueError(f"record of {len(line)} bytes exceeds the {self.max_bytes}-byte file limit")
+        if self.file is None or self.records >= self.max_records or self.bytes + len(line) > self.max_bytes:
+            self._roll()
+        self.file.write(line)
+        self.records += 1
+        self.bytes += len(line)
+        self.shards[-1].update(records=self.records, bytes=self.bytes)
+        return self.shards[-1]["file"]
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def export_batch(source, prompt_template, out_dir, model_id=None, token_budget=None, compact=None,
+                 max_records=BATCH_MAX_RECORDS_PER_FILE, max_bytes=BATCH_MAX_FILE_BYTES):
+    """Turn a folder, mbox or Maildir into Bedrock batch-inference input shards plus a manifest."""
+    model_id, _ = resolve_model_id(model_id)
+    if build_request_body("", model_id) is None:
+        raise ValueError(f"Unsupported model for batch export: {model_id}")
+    os.makedirs(out_dir, exist_ok=True)
+    stats = {"exported": 0, "error": 0}
+    started = time.perf_counter()
+    writer = ShardWriter(out_dir, max_records=max_records, max_bytes=max_bytes)
+    seen = {}
+
+    print(f"📤 Batch export: source={source} model={model_id}")
+    with open(os.path.join(out_dir, MANIFEST), "w", encoding="utf-8") as manifest:
+        for email_id, raw_bytes in iter_messages(source):
+            rid, salt = record_id(email_id), 0
+            while seen.get(rid, email_id) != email_id:
+                salt += 1
+                rid = record_id(email_id, salt)
+            if rid in seen:
+                continue
+            seen[rid] = email_id
+            entry = {"recordId": rid, "id": email_id}
+            try:
+                headers = read_headers(raw_bytes)
+                entry["subject"] = str(headers.get("Subject", ""))
+                entry["from_address"] = parseaddr(str(headers.get("From", "")))[1]
+                email_data = parse_eml_file(io.BytesIO(raw_bytes))
+                email_prompt = build_email_prompt(email_data, token_budget=token_budget, compact=compact)
+                # Batch jobs get no benefit from prompt-cache checkpoints: send the prompt whole.
+                prefix, prompt = split_prompt_template(prompt_template, email_prompt)
+                body = build_request_body(prefix + prompt, model_id)
+                entry["shard"] = writer.write({"recordId": rid, "modelInput": body})
+                stats["exported"] += 1
+            except Exception as e:
+                entry["error"] = f"{type(e).__name__}: {e}"
+                stats["error"] += 1
+            manifest.write(json.dumps(entry) + "\n")
+    writer.close()
+
+    for shard in writer.shards:
+        if shard["records"] < BATCH_MIN_RECORDS_PER_JOB:
+            print(f"⚠️ {shard['file']} has {shard['records']} records; batch jobs need at least {BATCH_MIN_RECORDS_PER_JOB}")
+    meta = {
+        "model_id": model_id,
+        "prompt_sha256": hashlib.sha256(prompt_template.encode("utf-8")).hexdigest(),
+        "token_budget": token_budget,
+        "compact": compact,
+        "shards": writer.shards,
+        "created": time.time(),
+    }
+    with open(os.path.join(out_dir, EXPORT_META), "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+
+    stats["shards"] = len(writer.shards)
+    stats["elapsed_sec"] = round(time.perf_counter() - started, 2)
+    print(f"✅ Batch export finished: {stats}")
+    return stats
+
+
+def load_manifest(export_dir):
+    """recordId -> manifest entry for every exported email."""
+    entries = {}
+    with open(os.path.join(export_dir, MANIFEST), "r", encoding="utf-8") as f:
+        for line in f:
+            entry = json.loads(line)
+            if "error" not in entry:
+                entries[entry["recordId"]] = entry
+    return entries
+
+
+def iter_output_records(results_dir):
+    """Stream records from every ``*.jsonl.out`` file the batch job wrote, in a stable order."""
+    paths = []
+    for root, _, files in os.walk(results_dir):
+        paths.extend(os.path.join(root, name) for name in files if name.endswith(".jsonl.out"))
+    for path in sorted(paths):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def result_record(entry, output, model_id):
+    """One batch.py-style result record from a batch-inference output line."""
+    record = {
+        "id": entry["id"],
+        "model_id": model_id,
+        "subject": entry.get("subject", ""),
+        "from_address": entry.get("from_address", ""),
+        "record_id": entry["recordId"],
+    }
+    if output.get("error") or "modelOutput" not in output:
+        error = output.get("error") or {"errorMessage": "missing modelOutput"}
+        record["status"] = "error"
+        record["error"] = f"{error.get('errorCode', '')} {error.get('errorMessage', '')}".strip()
+        return record
+
+    text = parse_response_text(model_id, output["modelOutput"])
+    record["usage"] = parse_usage(model_id, output["modelOutput"])
+    data = extract_json(text)
+    if data is None:
+        record["status"] = "error"
+        record["error"] = "invalid_json"
+        record["extracted_data"] = text
+    else:
+        record["status"] = "ok"
+        record["extracted_data"] = json.dumps(data)
+    return record
+
+
+def import_batch(export_dir, results_dir, output_path, resume=True):
+    """Join batch-inference outputs back to their emails and append results to ``output_path``."""
+    with open(os.path.join(export_dir, EXPORT_META), "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    model_id = meta["model_id"]
+    manifest = load_manifest(export_dir)
+    completed = load_completed_ids(output_path) if resume else set()
+    stats = {"ok": 0, "error": 0, "skipped": 0, "unknown": 0, "input_tokens": 0, "output_tokens": 0}
+    seen = set()
+
+    print(f"📥 Batch import: {len(manifest)} exported records, results from {results_dir}")
+    with open(output_path, "a" if resume else "w", encoding="utf-8") as out:
+        for output in iter_output_records(results_dir):
+            entry = manifest.get(output.get("recordId"))
+            if entry is None:
+                stats["unknown"] += 1
+                continue
+            seen.add(entry["recordId"])
+            if entry["id"] in completed:
+                stats["skipped"] += 1
+                continue
+            record = result_record(entry, output, model_id)
+            stats[record["status"]] += 1
+            for key in ("input_tokens", "output_tokens"):
+                stats[key] += (record.get("usage") or {}).get(key, 0)
+            out.write(json.dumps(record) + "\n")
+            out.flush()
+
+    stats["missing"] = len(manifest) - len(seen)
+    stats["est_cost_usd"] = round(estimate_cost(model_id, stats) * BATCH_PRICE_FACTOR, 4)
+    if stats["missing"]:
+        print(f"⚠️ {stats['missing']} exported records have no output yet")
+    print(f"✅ Batch import finished: {stats}")
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export = commands.add_parser("export", help="Write batch-inference input shards for a corpus")
+    export.add_argument("source", help="Folder of .eml files, Maildir directory or mbox file")
+    export.add_argument("--prompt-file", required=True, help="Prompt template containing {email_data}")
+    export.add_argument("--out", required=True, help="Directory for the shards, manifest and export.json")
+    export.add_argument("--model", default=None, help="Bedrock model ID (defaults to BEDROCK_MODEL_ID)")
+    export.add_argument("--token-budget", type=int, default=None, help="Max estimated tokens for the email section")
+    export.add_argument("--compact", action="store_true", default=None,
+                        help="Strip quoted replies, signatures, boilerplate and repeated lines")
+    export.add_argument("--max-records", type=int, default=BATCH_MAX_RECORDS_PER_FILE, help="Records per shard")
+    export.add_argument("--max-file-mb", type=float, default=BATCH_MAX_FILE_BYTES / 1024 / 1024, help="Shard size limit")
+
+    imp = commands.add_parser("import", help="Join batch-inference output back to emails")
+    imp.add_argument("export_dir", help="Directory written by the export command")
+    imp.add_argument("results_dir", help="Directory holding the job's *.jsonl.out files (searched recursively)")
+    imp.add_argument("--output", default="batch_results.jsonl", help="JSONL results file")
+    imp.add_argument("--no-resume", action="store_true", help="Overwrite instead of skipping imported emails")
+    args = parser.parse_args(argv)
+
+    if args.command == "export":
+        with open(args.prompt_file, "r", encoding="utf-8") as f:
+            prompt_template = f.read()
+        stats = export_batch(
+            args.source, prompt_template, args.out, model_id=args.model, token_budget=args.token_budget,
+            compact=args.compact, max_records=args.max_records, max_bytes=int(args.max_file_mb * 1024 * 1024),
+        )
+    else:
+        stats = import_batch(args.export_dir, args.results_dir, args.output, resume=not args.no_resume)
+    return 0 if stats["error"] == 0 else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
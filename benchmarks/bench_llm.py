@@ -0,0 +1,150 @@
+"""Throughput / tail-latency benchmark for the model-call path, run against fake_bedrock.
+
+Starts the fake endpoint in-process, points llm.py at it and drives query_claude,
+query_claude_stream or aquery_claude at several concurrency levels.
+
+    python benchmarks/bench_llm.py --calls 200 --concurrency 1 8 32 --throttle-rate 0.05
+    python benchmarks/bench_llm.py --path stream --model meta.llama3-3-70b-instruct-v1:0
+    python benchmarks/bench_llm.py --model anthropic.claude-3-5-haiku-20241022-v1:0 --shared-prefix 12000
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_bedrock import FakeBedrockConfig, start_server  # noqa: E402
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def run_level(path, model_id, calls, concurrency, prompt_size, shared_prefix="", counters=None):
+    """One concurrency level. ``counters`` are the fake server's; retries are counted from its
+    request log, so retries botocore makes inside one app-level attempt are included."""
+    import llm
+    import telemetry
+
+    telemetry.clear_recent_events()
+    requests_before = counters["requests"] if counters is not None else None
+    # Unique prompts so nothing is served from the response cache.
+    prompts = [f"[{concurrency}-{i}] " + "x" * prompt_size for i in range(calls)]
+    latencies = []
+    ttfts = []
+    errors = 0
+
+    def one(prompt):
+        started = time.perf_counter()
+        if path == "stream":
+            stats = {}
+            text = "".join(llm.query_claude_stream(prompt, model_id=model_id, use_cache=False, stats=stats,
+                                                   prefix=shared_prefix))
+            if stats.get("ttft_sec") is not None:
+                ttfts.append(stats["ttft_sec"])
+        else:
+            text = llm.query_claude(prompt, model_id=model_id, use_cache=False, prefix=shared_prefix)["extracted_data"]
+        return time.perf_counter() - started, text.startswith("[LLM Error")
+
+    started = time.perf_counter()
+    if path == "async":
+        async def drive():
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def guarded(prompt):
+                async with semaphore:
+                    t0 = time.perf_counter()
+                    result = await llm.aquery_claude(prompt, model_id=model_id, use_cache=False, prefix=shared_prefix)
+                    return time.perf_counter() - t0, result["extracted_data"].startswith("[LLM Error")
+            return await asyncio.gather(*(guarded(p) for p in prompts))
+        results = asyncio.run(drive())
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(one, prompts))
+    elapsed = time.perf_counter() - started
+
+    for latency, failed in results:
+        latencies.append(latency)
+        errors += failed
+    events = telemetry.recent_events("model_call")
+    app_retries = sum(e.get("attempts", 1) - 1 for e in events)
+    # Every call ends with exactly one request that succeeded or gave up; the rest were retries.
+    retries = counters["requests"] - requests_before - calls if counters is not None else app_retries
+    return {
+        "path": path,
+        "concurrency": concurrency,
+        "calls": calls,
+        "calls_per_sec": round(calls / elapsed, 2),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "ttft_p50_ms": round(percentile(ttfts, 50) * 1000, 1) if ttfts else None,
+        "errors": errors,
+        "retries": retries,
+        # Retries the app never saw, made by botocore (see BEDROCK_BOTOCORE_MAX_ATTEMPTS).
+        "botocore_retries": retries - app_retries,
+        "input_tokens": sum(e.get("input_tokens") or 0 for e in events),
+        "cache_read_tokens": sum(e.get("cache_read_tokens") or 0 for e in events),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--path", choices=["sync", "stream", "async"], default="sync")
+    parser.add_argument("--model", default="anthropic.claude-3-haiku-20240307-v1:0")
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--prompt-size", type=int, default=4000, help="Characters per prompt")
+    parser.add_argument("--shared-prefix", type=int, default=0,
+                        help="Characters of instructions shared by every call (sent as a prompt-cache prefix)")
+    parser.add_argument("--latency-ms", type=float, default=200.0)
+    parser.add_argument("--latency-sigma", type=float, default=0.3)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", dest="json_path", default=None, help="Also write results to this file")
+    args = parser.parse_args(argv)
+
+    config = FakeBedrockConfig(
+        latency_ms=args.latency_ms, latency_sigma=args.latency_sigma, throttle_rate=args.throttle_rate,
+        error_rate=args.error_rate, mode="canned", seed=args.seed,
+    )
+    server, url = start_server(config)
+
+    # Must be set before llm creates its client.
+    os.environ["BEDROCK_ENDPOINT_URL"] = url
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "fake")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "fake")
+    os.environ.setdefault("TRACE_DISABLED", "1")
+    os.environ.setdefault("LOG_LEVEL", "ERROR")
+    os.environ.setdefault("BEDROCK_MODEL_CONCURRENCY", str(max(args.concurrency)))
+
+    shared_prefix = "Instructions: " + "y" * args.shared_prefix + "\n" if args.shared_prefix else ""
+    results = []
+    print(f"{'path':<7}{'conc':>6}{'calls/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'ttft':>8}{'retries':>9}"
+          f"{'boto':>6}{'errors':>8}{'in tok':>10}{'cache rd':>10}")
+    for concurrency in args.concurrency:
+        row = run_level(args.path, args.model, args.calls, concurrency, args.prompt_size, shared_prefix,
+                        server.config.counters)
+        results.append(row)
+        print(f"{row['path']:<7}{row['concurrency']:>6}{row['calls_per_sec']:>10}{row['p50_ms']:>10}"
+              f"{row['p95_ms']:>10}{row['p99_ms']:>10}{str(row['ttft_p50_ms'] or '-'):>8}"
+              f"{row['retries']:>9}{row['botocore_retries']:>6}{row['errors']:>8}{row['input_tokens']:>10}{row['cache_read_tokens']:>10}")
+    print(f"🧪 Server counters: {server.config.counters}")
+    server.shutdown()
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": results, "server": server.config.counters}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
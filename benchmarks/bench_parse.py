@@ -0,0 +1,208 @@
+"""Parsing benchmark: per-stage time, peak memory and throughput of both .eml parsers.
+
+Runs email_parser.parse_eml_file and parser.parse_eml_file over the deterministic corpus
+from synthetic_emails.py and fails (exit 1) when a case is slower or uses more memory
+than its entry in parse_baseline.json allows.
+
+    python benchmarks/bench_parse.py                          # check against the baseline
+    python benchmarks/bench_parse.py --update                 # record current results as the baseline
+    python benchmarks/bench_parse.py --scenario pdf --scenario mailbox --threshold 0.5
+"""
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import tracemalloc
+import importlib.util
+from contextlib import redirect_stdout
+
+# Single process and no OCR cache: measure the parser itself, in this process.
+os.environ.setdefault("EMAIL_PARSER_WORKERS", "1")
+os.environ.setdefault("OCR_CACHE_DISABLED", "1")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from synthetic_emails import SCENARIO_REQUIRES, SCENARIOS, generate, mbox_bytes  # noqa: E402
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "parse_baseline.json")
+
+PARSERS = ["email_parser", "parser"]
+STAGES = ["ingest", "mime", "html_to_text", "extraction"]
+# The mailbox case streams one large mbox of this scenario through ingest.iter_messages.
+MAILBOX_SCENARIO = "alternative"
+
+# Generous by default: best-of-N timings on shared CI machines still drift by a third.
+REGRESSION_THRESHOLD = 0.5
+# Differences smaller than this are timer noise, whatever the relative change.
+MIN_REGRESSION_MS = 2.0
+
+
+def load_parser(name):
+    if name == "email_parser":
+        from email_parser import parse_eml_file
+    else:
+        from parser import parse_eml_file
+    return parse_eml_file
+
+
+def missing_requirements(scenario):
+    return [m for m in SCENARIO_REQUIRES[scenario] if importlib.util.find_spec(m) is None]
+
+
+def parse_one(parse, raw, times):
+    started = time.perf_counter()
+    parsed = parse(io.BytesIO(raw))
+    mime_done = time.perf_counter()
+    parsed.text
+    text_done = time.perf_counter()
+    parsed.attachment_text_summary
+    parsed.embedded_image_text
+    done = time.perf_counter()
+    times["mime"] += mime_done - started
+    times["html_to_text"] += text_done - mime_done
+    times["extraction"] += done - text_done
+
+
+def run_emails(parse, emails):
+    times = dict.fromkeys(STAGES, 0.0)
+    for raw in emails:
+        parse_one(parse, raw, times)
+    return times
+
+
+def run_mailbox(parse, path):
+    from ingest import iter_messages
+
+    times = dict.fromkeys(STAGES, 0.0)
+    messages = iter_messages(path)
+    while True:
+        started = time.perf_counter()
+        item = next(messages, None)
+        times["ingest"] += time.perf_counter() - started
+        if item is None:
+            return times
+        parse_one(parse, item[1], times)
+
+
+def measure(run, repeat):
+    """Best-of-N time per stage, then one tracemalloc pass for peak memory."""
+    best = None
+    with redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            times = run()
+            best = times if best is None else {s: min(best[s], times[s]) for s in STAGES}
+        tracemalloc.start()
+        try:
+            run()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    result = {f"{s}_ms": round(best[s] * 1000, 2) for s in STAGES}
+    result["total_ms"] = round(sum(best.values()) * 1000, 2)
+    result["peak_kb"] = round(peak / 1024)
+    return result
+
+
+def regressions(result, baseline, threshold, min_ms=MIN_REGRESSION_MS):
+    problems = []
+    allowed = baseline["total_ms"] * (1 + threshold)
+    if result["total_ms"] > allowed and result["total_ms"] - baseline["total_ms"] > min_ms:
+        problems.append(f"time {result['total_ms']:.1f} ms > {allowed:.1f} ms")
+    allowed = baseline["peak_kb"] * (1 + threshold)
+    if result["peak_kb"] > allowed:
+        problems.append(f"memory {result['peak_kb']} KB > {allowed:.0f} KB")
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS) + ["mailbox"],
+                        help="Cases to run (repeatable; default: all)")
+    parser.add_argument("--parser", action="append", choices=PARSERS, help="Parsers to run (default: both)")
+    parser.add_argument("--count", type=int, default=5, help="Emails per scenario")
+    parser.add_argument("--mailbox-count", type=int, default=100, help="Emails in the mailbox case")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per case; the fastest is kept")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                        help="Allowed slowdown / memory growth over the baseline (0.5 = 50%%)")
+    parser.add_argument("--update", action="store_true", help="Write current results as the new baseline")
+    parser.add_argument("--json", dest="json_path", default=None, help="Also write results to this file")
+    args = parser.parse_args(argv)
+
+    baseline = {}
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    scenarios = args.scenario or sorted(SCENARIOS) + ["mailbox"]
+    parsers = args.parser or PARSERS
+    results = {}
+    failures = []
+
+    print(f"{'case':<28}{'ingest':>9}{'mime':>9}{'html':>9}{'extract':>9}{'total ms':>10}{'peak MB':>9}{'emails/s':>10}{'MB/s':>8}  status")
+    with tempfile.TemporaryDirectory() as tmp:
+        for scenario in scenarios:
+            corpus_scenario = MAILBOX_SCENARIO if scenario == "mailbox" else scenario
+            missing = missing_requirements(corpus_scenario)
+            if missing:
+                print(f"{scenario:<28}skipped (missing {', '.join(missing)})")
+                continue
+            if scenario == "mailbox":
+                count = args.mailbox_count
+                path = os.path.join(tmp, "mailbox.mbox")
+                with open(path, "wb") as f:
+                    size = f.write(mbox_bytes(generate(corpus_scenario, count, args.seed)))
+            else:
+                count = args.count
+                emails = [raw for _, raw in generate(scenario, count, args.seed)]
+                size = sum(len(raw) for raw in emails)
+
+            for name in parsers:
+                parse = load_parser(name)
+                if scenario == "mailbox":
+                    result = measure(lambda: run_mailbox(parse, path), args.repeat)
+                else:
+                    result = measure(lambda: run_emails(parse, emails), args.repeat)
+                seconds = max(result["total_ms"], 0.001) / 1000
+                result["emails_per_sec"] = round(count / seconds, 1)
+                result["mb_per_sec"] = round(size / 1024 / 1024 / seconds, 2)
+                case = f"{scenario}/{name}"
+                results[case] = result
+
+                status = "ok"
+                if case in baseline and not args.update:
+                    problems = regressions(result, baseline[case], args.threshold)
+                    if problems:
+                        status = "REGRESSION: " + "; ".join(problems)
+                        failures.append(case)
+                elif not args.update:
+                    status = "no baseline"
+                print(f"{case:<28}{result['ingest_ms']:>9.1f}{result['mime_ms']:>9.1f}{result['html_to_text_ms']:>9.1f}{result['extraction_ms']:>9.1f}"
+                      f"{result['total_ms']:>10.1f}{result['peak_kb'] / 1024:>9.1f}{result['emails_per_sec']:>10}"
+                      f"{result['mb_per_sec']:>8}  {status}")
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    if args.update:
+        # Merge so a partial run (--scenario/--parser) only replaces the cases it measured.
+        baseline.update(results)
+        with open(BASELINE_PATH, "w", encoding="utf-8") as f:
+            json.dump(dict(sorted(baseline.items())), f, indent=2)
+            f.write("\n")
+        print(f"📝 Baseline written to {BASELINE_PATH}")
+        return 0
+
+    if failures:
+        print(f"❌ Parsing regression in: {', '.join(failures)}")
+        return 1
+    print("✅ Parsing within baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
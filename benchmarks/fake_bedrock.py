@@ -0,0 +1,326 @@
+"""Local stand-in for the bedrock-runtime InvokeModel / InvokeModelWithResponseStream APIs.
+
+Speaks the same wire format boto3 expects (JSON bodies, AWS event-stream framing for
+streaming, x-amzn-ErrorType for errors) for both the Anthropic messages schema and the
+Llama `generation` schema, with configurable latency and throttling.
+
+    python benchmarks/fake_bedrock.py --port 8787 --latency-ms 400 --throttle-rate 0.05
+    export BEDROCK_ENDPOINT_URL=http://127.0.0.1:8787
+"""
+import os
+import re
+import json
+import time
+import base64
+import random
+import struct
+import zlib
+import argparse
+import threading
+from urllib.parse import unquote
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROUTE = re.compile(r"^/model/(?P<model_id>[^/]+)/(?P<action>invoke|invoke-with-response-stream)$")
+CHARS_PER_TOKEN = 4
+
+
+class FakeBedrockConfig:
+    def __init__(self, latency_ms=300.0, latency_sigma=0.3, first_token_ms=None, throttle_rate=0.0,
+                 error_rate=0.0, mode="echo", canned_text='{"status": "ok"}', stream_chunks=20, seed=None):
+        self.latency_ms = latency_ms            # median end-to-end latency
+        self.latency_sigma = latency_sigma      # lognormal shape; 0 = fixed latency
+        self.first_token_ms = first_token_ms    # streaming TTFT; defaults to 30% of latency
+        self.throttle_rate = throttle_rate      # fraction of requests answered with 429 ThrottlingException
+        self.error_rate = error_rate            # fraction answered with 500 InternalServerException
+        self.mode = mode                        # "echo" returns the prompt, "canned" returns canned_text
+        self.canned_text = canned_text
+        self.stream_chunks = stream_chunks
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counters = {"requests": 0, "throttled": 0, "errors": 0, "ok": 0}
+        self.prompt_cache = set()               # hashes of cache_control prefixes already written
+
+    def prompt_cache_tokens(self, body):
+        """(read, written) token counts for content blocks marked with cache_control."""
+        read = written = 0
+        prefix = ""
+        for message in body.get("messages", []):
+            content = message.get("content")
+            if isinstance(content, str):
+                prefix += content
+                continue
+            for block in content:
+                prefix += block.get("text", "")
+                if "cache_control" not in block:
+                    continue
+                tokens = len(prefix) // CHARS_PER_TOKEN
+                key = hash(prefix)
+                with self.lock:
+                    hit = key in self.prompt_cache
+                    self.prompt_cache.add(key)
+                if hit:
+                    read, written = tokens, 0
+                else:
+                    written = tokens - read
+        return read, written
+
+    def sample_latency(self):
+        with self.lock:
+            if self.latency_sigma <= 0:
+                return self.latency_ms / 1000
+            return self.random.lognormvariate(0, self.latency_sigma) * self.latency_ms / 1000
+
+    def roll(self):
+        """Decide the fate of one request: "throttled", "error" or "ok"."""
+        with self.lock:
+            self.counters["requests"] += 1
+            r = self.random.random()
+            if r < self.throttle_rate:
+                outcome = "throttled"
+            elif r < self.throttle_rate + self.error_rate:
+                outcome = "error"
+            else:
+                outcome = "ok"
+            self.counters[outcome if outcome != "error" else "errors"] += 1
+            return outcome
+
+
+def encode_event(payload, event_type="chunk"):
+    """Frame one message in the AWS event-stream binary format."""
+    headers = b""
+    for name, value in ((":event-type", event_type), (":content-type", "application/json"), (":message-type", "event")):
+        name_bytes, value_bytes = name.encode(), value.encode()
+        headers += struct.pack("!B", len(name_bytes)) + name_bytes + b"\x07" + struct.pack("!H", len(value_bytes)) + value_bytes
+    total_length = 12 + len(headers) + len(payload) + 4
+    prelude = struct.pack("!II", total_length, len(headers))
+    message = prelude + struct.pack("!I", zlib.crc32(prelude)) + headers + payload
+    return message + struct.pack("!I", zlib.crc32(message))
+
+
+def chunk_event(obj):
+    return encode_event(json.dumps({"bytes": base64.b64encode(json.dumps(obj).encode()).decode()}).encode())
+
+
+def prompt_from_body(model_id, body):
+    if "messages" in body:
+        parts = []
+        for message in body["messages"]:
+            content = message.get("content")
+            if isinstance(content, str):
+                parts.append(content)
+            else:
+                parts.extend(block.get("text", "") for block in content if isinstance(block, dict))
+        return "\n".join(parts)
+    prompt = body.get("prompt", "")
+    if prompt.startswith("[INST] ") and prompt.endswith(" [/INST]"):
+        prompt = prompt[len("[INST] "):-len(" [/INST]")]
+    return prompt
+
+
+def invoke_response(model_id, body, text, input_tokens, output_tokens, cache_read=0, cache_write=0):
+    """Non-streaming InvokeModel response body in the model family's schema."""
+    if "messages" not in body:
+        return {"generation": text, "prompt_token_count": input_tokens,
+                "generation_token_count": output_tokens, "stop_reason": "stop"}
+    response = {
+        "id": f"msg_fake_{random.getrandbits(32):08x}", "type": "message", "role": "assistant",
+        "model": model_id, "content": [{"type": "text", "text": text}],
+        "stop_reason": "end_turn", "stop_sequence": None,
+        "usage": {"input_tokens": input_tokens, "output_tokens": output_tokens,
+                  "cache_read_input_tokens": cache_read, "cache_creation_input_tokens": cache_write},
+    }
+    if body.get("tools"):
+        # Forced tool use: answer with a tool_use block carrying the canned JSON.
+        try:
+            tool_input = json.loads(text)
+        except ValueError:
+            tool_input = {"text": text}
+        response["content"] = [{"type": "tool_use", "id": "toolu_fake",
+                                "name": body["tools"][0]["name"], "input": tool_input}]
+        response["stop_reason"] = "tool_use"
+    return response
+
+
+def run_batch_job(input_dir, output_dir, model_id, config=None):
+    """Answer every ``*.jsonl`` batch-inference input file like a model invocation job would.
+
+    Writes ``<name>.jsonl.out`` files with ``modelInput``/``modelOutput`` (or ``error`` for
+    records that hit the configured error rate), so exports can be imported without AWS.
+    """
+    config = config or FakeBedrockConfig(mode="canned")
+    os.makedirs(output_dir, exist_ok=True)
+    for name in sorted(os.listdir(input_dir)):
+        if not name.endswith(".jsonl") or name == "manifest.jsonl":
+            continue
+        with open(os.path.join(input_dir, name), "r", encoding="utf-8") as src, \
+                open(os.path.join(output_dir, name + ".out"), "w", encoding="utf-8") as dst:
+            for line in src:
+                request = json.loads(line)
+                body = request["modelInput"]
+                result = {"recordId": request.get("recordId"), "modelInput": body}
+                if config.roll() != "ok":
+                    result["error"] = {"errorCode": 500, "errorMessage": "Internal server error"}
+                else:
+                    prompt = prompt_from_body(model_id, body)
+                    text = prompt if config.mode == "echo" else config.canned_text
+                    result["modelOutput"] = invoke_response(
+                        model_id, body, text, max(1, len(prompt) // CHARS_PER_TOKEN), max(1, len(text) // CHARS_PER_TOKEN)
+                    )
+                dst.write(json.dumps(result) + "\n")
+    return config.counters
+
+
+def make_handler(config):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send_json(self, status, obj, error_type=None):
+            data = json.dumps(obj).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            if error_type:
+                self.send_header("x-amzn-ErrorType", f"{error_type}:http://internal.amazon.com/coral/com.amazon.bedrock/")
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _write_chunk(self, data):
+            self.wfile.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+        def do_POST(self):
+            match = ROUTE.match(self.path.split("?")[0])
+            length = int(self.headers.get("Content-Length", 0))
+            raw = self.rfile.read(length)
+            if not match:
+                return self._send_json(404, {"message": "Unknown route"}, "ResourceNotFoundException")
+            model_id = unquote(match.group("model_id"))
+            try:
+                body = json.loads(raw)
+            except ValueError:
+                return self._send_json(400, {"message": "Malformed input request"}, "ValidationException")
+
+            outcome = config.roll()
+            if outcome == "throttled":
+                time.sleep(0.01)
+                return self._send_json(429, {"message": "Too many requests, please wait before trying again."},
+                                       "ThrottlingException")
+            if outcome == "error":
+                return self._send_json(500, {"message": "Internal server error"}, "InternalServerException")
+
+            prompt = prompt_from_body(model_id, body)
+            text = prompt if config.mode == "echo" else config.canned_text
+            is_llama = "messages" not in body
+            cache_read, cache_write = config.prompt_cache_tokens(body)
+            input_tokens = max(1, len(prompt) // CHARS_PER_TOKEN - cache_read - cache_write)
+            output_tokens = max(1, len(text) // CHARS_PER_TOKEN)
+            latency = config.sample_latency()
+
+            if match.group("action") == "invoke":
+                time.sleep(latency)
+                response = invoke_response(model_id, body, text, input_tokens, output_tokens, cache_read, cache_write)
+                return self._send_json(200, response)
+
+            self.send_response(200)
+            self.send_header("Content-Type", "application/vnd.amazon.eventstream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.send_header("x-amzn-bedrock-content-type", "application/json")
+            self.end_headers()
+
+            first_token = (config.first_token_ms / 1000) if config.first_token_ms is not None else latency * 0.3
+            step = max(1, len(text) // config.stream_chunks + 1)
+            pieces = [text[i:i + step] for i in range(0, len(text), step)] or [""]
+            per_chunk = max(0.0, latency - first_token) / len(pieces)
+            metrics = {"inputTokenCount": input_tokens, "outputTokenCount": output_tokens,
+                       "invocationLatency": int(latency * 1000), "firstByteLatency": int(first_token * 1000),
+                       "cacheReadInputTokenCount": cache_read, "cacheWriteInputTokenCount": cache_write}
+
+            time.sleep(first_token)
+            if not is_llama:
+                self._write_chunk(chunk_event({"type": "message_start", "message": {
+                    "id": "msg_fake", "type": "message", "role": "assistant", "model": model_id, "content": [],
+                    "usage": {"input_tokens": input_tokens, "output_tokens": 0,
+                              "cache_read_input_tokens": cache_read, "cache_creation_input_tokens": cache_write}}}))
+                self._write_chunk(chunk_event({"type": "content_block_start", "index": 0,
+                                               "content_block": {"type": "text", "text": ""}}))
+            for i, piece in enumerate(pieces):
+                if i:
+                    time.sleep(per_chunk)
+                if is_llama:
+                    last = i == len(pieces) - 1
+                    event = {"generation": piece, "prompt_token_count": input_tokens if i == 0 else None,
+                             "generation_token_count": i + 1, "stop_reason": "stop" if last else None}
+                    if last:
+                        event["amazon-bedrock-invocationMetrics"] = metrics
+                    self._write_chunk(chunk_event(event))
+                else:
+                    self._write_chunk(chunk_event({"type": "content_block_delta", "index": 0,
+                                                   "delta": {"type": "text_delta", "text": piece}}))
+            if not is_llama:
+                self._write_chunk(chunk_event({"type": "content_block_stop", "index": 0}))
+                self._write_chunk(chunk_event({"type": "message_delta", "delta": {"stop_reason": "end_turn"},
+                                               "usage": {"output_tokens": output_tokens}}))
+                self._write_chunk(chunk_event({"type": "message_stop",
+                                               "amazon-bedrock-invocationMetrics": metrics}))
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+
+    return Handler
+
+
+def start_server(config=None, host="127.0.0.1", port=0):
+    """Start the fake endpoint on a background thread; returns (server, endpoint_url)."""
+    config = config or FakeBedrockConfig()
+    server = ThreadingHTTPServer((host, port), make_handler(config))
+    server.daemon_threads = True
+    server.config = config
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8787)
+    parser.add_argument("--latency-ms", type=float, default=300.0, help="Median response latency")
+    parser.add_argument("--latency-sigma", type=float, default=0.3, help="Lognormal spread (0 = fixed)")
+    parser.add_argument("--first-token-ms", type=float, default=None)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--mode", choices=["echo", "canned"], default="echo")
+    parser.add_argument("--canned-text", default='{"status": "ok"}')
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--batch-job", nargs=2, metavar=("INPUT_DIR", "OUTPUT_DIR"),
+                        help="Instead of serving, answer batch-inference input files offline and exit")
+    parser.add_argument("--model", default=None, help="Model ID for --batch-job (defaults to export.json)")
+    args = parser.parse_args(argv)
+
+    config = FakeBedrockConfig(
+        latency_ms=args.latency_ms, latency_sigma=args.latency_sigma, first_token_ms=args.first_token_ms,
+        throttle_rate=args.throttle_rate, error_rate=args.error_rate, mode=args.mode,
+        canned_text=args.canned_text, seed=args.seed,
+    )
+    if args.batch_job:
+        input_dir, output_dir = args.batch_job
+        model_id = args.model
+        if model_id is None:
+            with open(os.path.join(input_dir, "export.json"), "r", encoding="utf-8") as f:
+                model_id = json.load(f)["model_id"]
+        counters = run_batch_job(input_dir, output_dir, model_id, config)
+        print(f"🧪 Fake batch job finished: {counters}")
+        return 0
+    server, url = start_server(config, host=args.host, port=args.port)
+    print(f"🧪 Fake bedrock-runtime listening on {url}  (export BEDROCK_ENDPOINT_URL={url})")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
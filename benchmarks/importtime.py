@@ -0,0 +1,98 @@
+"""Cold-start guard: measure `python -X importtime` for the app's core modules.
+
+Fails (exit 1) when a heavy dependency is imported eagerly or when the cumulative
+import time of a module exceeds its budget in importtime_budget.json.
+
+    python benchmarks/importtime.py            # check against budgets
+    python benchmarks/importtime.py --update   # record current timings as new budgets
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUDGET_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "importtime_budget.json")
+
+MODULES = ["llm", "email_parser", "parser", "extractors", "cache", "telemetry", "transport", "ingest", "batch"]
+
+# These must only be imported on first use, never as a side effect of importing MODULES.
+LAZY_MODULES = ["asyncio", "boto3", "botocore", "pytesseract", "PIL", "docx", "openpyxl", "PyPDF2", "bs4", "pdf2image", "bleach"]
+
+# Budgets are padded so noisy CI machines don't flap.
+HEADROOM = 3
+
+
+def measure(module, runs=5):
+    """Best-of-N cumulative import time (microseconds) and the set of modules pulled in."""
+    best = None
+    imported = set()
+    for _ in range(runs):
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            cwd=REPO_ROOT,
+            capture_output=True,
+            text=True,
+        )
+        if proc.returncode != 0:
+            raise RuntimeError(f"import {module} failed:\n{proc.stderr}")
+        cumulative = None
+        for line in proc.stderr.splitlines():
+            if not line.startswith("import time:") or "|" not in line:
+                continue
+            parts = [p.strip() for p in line[len("import time:"):].split("|")]
+            if not parts[0].isdigit():
+                continue  # header line
+            name = parts[2].strip()
+            imported.add(name.split(".")[0])
+            if name == module:
+                cumulative = int(parts[1])
+        if cumulative is not None and (best is None or cumulative < best):
+            best = cumulative
+    return best, imported
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--update", action="store_true", help="Write current timings as the new budget")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    budgets = {}
+    if os.path.exists(BUDGET_PATH):
+        with open(BUDGET_PATH, "r", encoding="utf-8") as f:
+            budgets = json.load(f)
+
+    failures = []
+    results = {}
+    for module in MODULES:
+        micros, imported = measure(module, runs=args.runs)
+        results[module] = micros
+        eager = sorted(set(LAZY_MODULES) & imported)
+        budget = budgets.get(module)
+        status = "ok"
+        if eager:
+            status = f"EAGER IMPORT: {', '.join(eager)}"
+            failures.append(module)
+        elif budget is not None and not args.update and micros > budget:
+            status = f"OVER BUDGET ({budget} us)"
+            failures.append(module)
+        print(f"{module:<14} {micros / 1000:8.1f} ms  {status}")
+
+    if args.update:
+        with open(BUDGET_PATH, "w", encoding="utf-8") as f:
+            json.dump({m: int(us * HEADROOM) for m, us in results.items()}, f, indent=2)
+            f.write("\n")
+        print(f"📝 Budgets written to {BUDGET_PATH}")
+        return 0
+
+    if failures:
+        print(f"❌ Import-time regression in: {', '.join(failures)}")
+        return 1
+    print("✅ Import times within budget")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
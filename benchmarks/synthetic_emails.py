@@ -0,0 +1,332 @@
+"""Deterministic synthetic .eml corpus for the parsing benchmarks.
+
+Everything (text, attachments, MIME boundaries) derives from the seed, so the same
+scenario always produces byte-identical emails. Attachments are built from scratch
+(minimal PDF, DOCX, XLSX and PNG writers), so generating needs no third-party packages.
+
+    python benchmarks/synthetic_emails.py --out ./corpus --scenario mixed --count 50
+    python benchmarks/synthetic_emails.py --mbox ./corpus.mbox --scenario plain --count 10000
+"""
+import io
+import os
+import zlib
+import random
+import struct
+import zipfile
+import argparse
+from email.message import EmailMessage
+from xml.sax.saxutils import escape
+
+WORDS = (
+    "invoice payment remittance amount vendor account balance due total credit memo order "
+    "reference number date net terms paid card statement period adjustment discount tax "
+    "shipping freight purchase receipt customer supplier approved pending scheduled transfer"
+).split()
+
+# Email shape per scenario; counts are per email.
+SCENARIOS = {
+    "plain": {"text_paragraphs": 8},
+    "html": {"html_paragraphs": 200},
+    "alternative": {"text_paragraphs": 20, "html_paragraphs": 120, "alternative": True},
+    "pdf": {"text_paragraphs": 4, "pdf": 2, "pdf_pages": 10},
+    "docx": {"text_paragraphs": 4, "docx": 2, "docx_paragraphs": 300},
+    "xlsx": {"text_paragraphs": 4, "xlsx": 2, "xlsx_rows": 400},
+    "inline_images": {"html_paragraphs": 30, "inline_images": 6},
+    "nested": {"text_paragraphs": 6, "html_paragraphs": 20, "alternative": True, "nesting": 8, "pdf": 1, "pdf_pages": 2},
+    "mixed": {
+        "text_paragraphs": 10, "html_paragraphs": 80, "alternative": True, "pdf": 1, "pdf_pages": 5,
+        "docx": 1, "docx_paragraphs": 100, "xlsx": 1, "xlsx_rows": 200, "inline_images": 2,
+    },
+}
+# Third-party modules each scenario's parse path needs; missing ones make the benchmark skip it.
+SCENARIO_REQUIRES = {
+    "plain": [],
+    "html": ["bs4", "html5lib"],
+    "alternative": ["bs4", "html5lib"],
+    "pdf": ["PyPDF2"],
+    "docx": ["docx"],
+    "xlsx": ["openpyxl"],
+    "inline_images": ["bs4", "html5lib", "PIL"],
+    "nested": ["bs4", "html5lib", "PyPDF2"],
+    "mixed": ["bs4", "html5lib", "PyPDF2", "docx", "openpyxl", "PIL"],
+}
+
+
+def sentence(rng, words=12):
+    text = " ".join(rng.choice(WORDS) for _ in range(words))
+    return text.capitalize() + f" #{rng.randint(1000, 99999)} for ${rng.randint(1, 99999)}.{rng.randint(0, 99):02d}."
+
+
+def make_pdf(rng, pages=1, lines_per_page=40):
+    """Minimal PDF 1.4 with one Helvetica text stream per page."""
+    objects = {1: b"<< /Type /Catalog /Pages 2 0 R >>", 3: b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"}
+    kids = []
+    for page in range(pages):
+        page_id, content_id = 4 + page * 2, 5 + page * 2
+        lines = []
+        for _ in range(lines_per_page):
+            text = sentence(rng, 8).replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+            lines.append(f"({text}) '")
+        stream = ("BT /F1 9 Tf 40 770 Td 11 TL\n" + "\n".join(lines) + "\nET").encode("latin-1")
+        objects[content_id] = b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream"
+        objects[page_id] = (
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents %d 0 R "
+            b"/Resources << /Font << /F1 3 0 R >> >> >>" % content_id
+        )
+        kids.append(b"%d 0 R" % page_id)
+    objects[2] = b"<< /Type /Pages /Kids [" + b" ".join(kids) + b"] /Count %d >>" % pages
+
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = {}
+    for number in sorted(objects):
+        offsets[number] = out.tell()
+        out.write(b"%d 0 obj\n" % number + objects[number] + b"\nendobj\n")
+    xref = out.tell()
+    count = max(objects) + 1
+    out.write(b"xref\n0 %d\n0000000000 65535 f \n" % count)
+    for number in range(1, count):
+        out.write(b"%010d 00000 n \n" % offsets[number])
+    out.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (count, xref))
+    return out.getvalue()
+
+
+def _zip(files):
+    out = io.BytesIO()
+    with zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as z:
+        for name, content in files.items():
+            # Fixed timestamps keep the archive byte-identical across runs.
+            z.writestr(zipfile.ZipInfo(name, date_time=(2024, 1, 1, 0, 0, 0)), content)
+    return out.getvalue()
+
+
+def make_docx(rng, paragraphs=50):
+    body = "".join(f"<w:p><w:r><w:t>{escape(sentence(rng))}</w:t></w:r></w:p>" for _ in range(paragraphs))
+    return _zip({
+        "[Content_Types].xml": (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/word/document.xml" '
+            'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+            '</Types>'
+        ),
+        "_rels/.rels": (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            '<Relationship Id="rId1" Target="word/document.xml" '
+            'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>'
+            '</Relationships>'
+        ),
+        "word/document.xml": (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+            f'<w:body>{body}</w:body></w:document>'
+        ),
+    })
+
+
+def make_xlsx(rng, rows=100, cols=6):
+    def column(index):
+        return chr(ord("A") + index)
+
+    sheet_rows = []
+    for r in range(1, rows + 1):
+        cells = []
+        for c in range(cols):
+            ref = f"{column(c)}{r}"
+            if c % 2:
+                cells.append(f'<c r="{ref}"><v>{rng.randint(1, 999999) / 100}</v></c>')
+            else:
+                cells.append(f'<c r="{ref}" t="inlineStr"><is><t>{rng.choice(WORDS)}-{rng.randint(1000, 9999)}</t></is></c>')
+        sheet_rows.append(f'<row r="{r}">{"".join(cells)}</row>')
+    main = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+    rel = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+    return _zip({
+        "[Content_Types].xml": (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/xl/workbook.xml" '
+            'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+            '<Override PartName="/xl/worksheets/sheet1.xml" '
+            'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+            '</Types>'
+        ),
+        "_rels/.rels": (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            f'<Relationship Id="rId1" Target="xl/workbook.xml" Type="{rel}/officeDocument"/>'
+            '</Relationships>'
+        ),
+        "xl/workbook.xml": (
+            f'<?xml version="1.0" encoding="UTF-8"?><workbook xmlns="{main}" xmlns:r="{rel}">'
+            '<sheets><sheet name="Remittance" sheetId="1" r:id="rId1"/></sheets></workbook>'
+        ),
+        "xl/_rels/workbook.xml.rels": (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            f'<Relationship Id="rId1" Target="worksheets/sheet1.xml" Type="{rel}/worksheet"/>'
+            '</Relationships>'
+        ),
+        "xl/worksheets/sheet1.xml": (
+            f'<?xml version="1.0" encoding="UTF-8"?><worksheet xmlns="{main}">'
+            f'<sheetData>{"".join(sheet_rows)}</sheetData></worksheet>'
+        ),
+    })
+
+
+def make_png(rng, width=320, height=120):
+    """Noisy grayscale PNG: large enough not to be skipped as decorative, incompressible like a photo."""
+    raw = b"".join(b"\x00" + bytes(rng.getrandbits(8) for _ in range(width)) for _ in range(height))
+
+    def chunk(kind, data):
+        return struct.pack("!I", len(data)) + kind + data + struct.pack("!I", zlib.crc32(kind + data))
+
+    header = struct.pack("!IIBBBBB", width, height, 8, 0, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(raw)) + chunk(b"IEND", b"")
+
+
+def make_html(rng, paragraphs=50, image_cids=()):
+    """Marketing/remittance-style HTML: styles, nested layout tables, paragraphs and an invoice table."""
+    parts = ["<html><head><style>td{padding:4px} .x{color:#333}</style></head><body>"]
+    parts.append('<table width="100%"><tr><td><div class="x"><div><div>')
+    for i in range(paragraphs):
+        parts.append(f"<p style=\"margin:0\">{escape(sentence(rng))} <a href=\"https://example.com/t?id={rng.getrandbits(64):x}\">link</a></p>")
+        if i % 10 == 9:
+            rows = "".join(
+                f"<tr><td>INV-{rng.randint(1000, 9999)}</td><td>{rng.randint(1, 9999)}.{rng.randint(0, 99):02d}</td></tr>"
+                for _ in range(10)
+            )
+            parts.append(f"<table border=\"1\"><tr><th>Invoice</th><th>Amount</th></tr>{rows}</table>")
+    for cid in image_cids:
+        parts.append(f'<img src="cid:{cid}" width="320" height="120">')
+    parts.append("</div></div></div></td></tr></table></body></html>")
+    return "\n".join(parts)
+
+
+ATTACHMENT_TYPES = {
+    "pdf": ("application", "pdf"),
+    "docx": ("application", "vnd.openxmlformats-officedocument.wordprocessingml.document"),
+    "xlsx": ("application", "vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+}
+
+
+def build_email(spec, seed):
+    """Raw bytes of one email shaped by ``spec`` (a SCENARIOS entry); ``seed`` fixes every byte."""
+    rng = random.Random(seed)
+    msg = EmailMessage()
+    msg["From"] = f"Notifications <notify{rng.randint(1, 50)}@payments.example.com>"
+    msg["To"] = "ap@customer.example.com"
+    msg["Subject"] = f"Remittance advice #{rng.randint(100000, 999999)}"
+    msg["Date"] = f"Tue, {rng.randint(1, 28)} Jan 2025 {rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:00 +0000"
+    msg["Message-ID"] = f"<synthetic-{rng.getrandbits(64):016x}@bench.example.com>"
+
+    text = "\n\n".join(sentence(rng, 20) for _ in range(spec.get("text_paragraphs", 0)))
+    cids = [f"img{i}.{rng.getrandbits(32):08x}@bench" for i in range(spec.get("inline_images", 0))]
+    html = make_html(rng, spec["html_paragraphs"], cids) if spec.get("html_paragraphs") else None
+    if html and spec.get("alternative"):
+        msg.set_content(text or "See the HTML version of this message.")
+        msg.add_alternative(html, subtype="html")
+        html_part = msg.get_payload()[-1]
+    elif html:
+        msg.set_content(html, subtype="html")
+        html_part = msg
+    else:
+        msg.set_content(text)
+        html_part = None
+
+    for i, cid in enumerate(cids):
+        (html_part if html_part is not None else msg).add_related(
+            make_png(rng), maintype="image", subtype="png", cid=f"<{cid}>", filename=f"image{i}.png",
+            disposition="inline",
+        )
+
+    for kind in ("pdf", "docx", "xlsx"):
+        for i in range(spec.get(kind, 0)):
+            if kind == "pdf":
+                payload = make_pdf(rng, spec.get("pdf_pages", 1))
+            elif kind == "docx":
+                payload = make_docx(rng, spec.get("docx_paragraphs", 50))
+            else:
+                payload = make_xlsx(rng, spec.get("xlsx_rows", 100))
+            maintype, subtype = ATTACHMENT_TYPES[kind]
+            msg.add_attachment(payload, maintype=maintype, subtype=subtype, filename=f"remittance_{i}.{kind}")
+
+    # Deep nesting: a forwarding chain, each level wrapping the previous one as message/rfc822.
+    for level in range(spec.get("nesting", 0)):
+        outer = EmailMessage()
+        for header in ("From", "To", "Date"):
+            outer[header] = msg[header]
+        outer["Subject"] = "Fwd: " + str(msg["Subject"])
+        outer.set_content(f"---------- Forwarded message ({level + 1}) ----------\n{sentence(rng)}")
+        outer.add_attachment(msg, disposition="inline")
+        msg = outer
+
+    tag = f"{rng.getrandbits(48):012x}"
+    for depth, part in enumerate(msg.walk()):
+        if part.get_content_maintype() == "multipart":
+            part.set_boundary(f"=_bench_{tag}_{depth}")
+    return msg.as_bytes()
+
+
+def generate(scenario, count, seed=0):
+    """Yield ``(name, raw_bytes)`` for ``count`` emails of one scenario."""
+    spec = SCENARIOS[scenario]
+    for i in range(count):
+        yield f"{scenario}-{i:05d}.eml", build_email(spec, f"{seed}:{scenario}:{i}")
+
+
+def write_corpus(out_dir, scenario, count, seed=0):
+    os.makedirs(out_dir, exist_ok=True)
+    total = 0
+    for name, raw in generate(scenario, count, seed):
+        with open(os.path.join(out_dir, name), "wb") as f:
+            f.write(raw)
+        total += len(raw)
+    return total
+
+
+def mbox_bytes(messages):
+    """mboxo-encode ``(name, raw_bytes)`` pairs with fixed envelope lines."""
+    out = io.BytesIO()
+    for _, raw in messages:
+        out.write(b"From bench@example.com Wed Jan  1 00:00:00 2025\n")
+        for line in raw.splitlines(keepends=True):
+            out.write(b">" + line if line.startswith(b"From ") else line)
+        if not raw.endswith(b"\n"):
+            out.write(b"\n")
+        out.write(b"\n")
+    return out.getvalue()
+
+
+def write_mbox(path, scenario, count, seed=0):
+    data = mbox_bytes(generate(scenario, count, seed))
+    with open(path, "wb") as f:
+        f.write(data)
+    return len(data)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--out", help="Directory to write .eml files into")
+    target.add_argument("--mbox", help="Write a single mbox file instead")
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), default="mixed")
+    parser.add_argument("--count", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    if args.out:
+        size = write_corpus(args.out, args.scenario, args.count, args.seed)
+        print(f"✅ Wrote {args.count} {args.scenario} emails ({size / 1024 / 1024:.1f} MB) to {args.out}")
+    else:
+        size = write_mbox(args.mbox, args.scenario, args.count, args.seed)
+        print(f"✅ Wrote {args.count} {args.scenario} emails ({size / 1024 / 1024:.1f} MB) to {args.mbox}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,185 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+CACHE_DIR = os.getenv("APP_CACHE_DIR", ".cache")
+
+
+def hash_key(*parts):
+    """Stable SHA-256 over JSON-serializable parts."""
+    raw = json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class MemoryCache:
+    """Small thread-safe in-process LRU, used as the hot tier in front of DiskCache."""
+
+    def __init__(self, max_entries=128):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return default
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+
+class DiskCache:
+    """SQLite-backed key/value cache with TTL and size-bounded LRU eviction.
+
+    Values are stored as JSON. Safe to share between threads.
+    """
+
+    def __init__(self, path, max_bytes=256 * 1024 * 1024, ttl_seconds=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL,"
+            " created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries(accessed)")
+
+    def get(self, key, default=None):
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute("SELECT value, created FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return default
+            value, created = row
+            if self.ttl_seconds is not None and now - created > self.ttl_seconds:
+                self.conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self.misses += 1
+                return default
+            self.conn.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+            self.hits += 1
+        return json.loads(value)
+
+    def set(self, key, value):
+        data = json.dumps(value)
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, data, len(data), now, now),
+            )
+            self._evict()
+
+    def _evict(self):
+        total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Drop least-recently-used entries until we are back under the limit.
+        for key, size in self.conn.execute("SELECT key, size FROM entries ORDER BY accessed").fetchall():
+            self.conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM entries")
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self.lock:
+            count, size = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        return {"entries": count, "bytes": size, "hits": self.hits, "misses": self.misses}
+
+
+_response_cache = None
+_cache_init_lock = threading.Lock()
+
+
+def response_cache_enabled():
+    return os.getenv("LLM_CACHE_DISABLED", "").lower() not in ("1", "true", "yes")
+
+
+def get_response_cache():
+    global _response_cache
+    with _cache_init_lock:
+        if _response_cache is None:
+            _response_cache = DiskCache(
+                os.getenv("LLM_CACHE_PATH", os.path.join(CACHE_DIR, "llm_responses.sqlite")),
+                max_bytes=int(float(os.getenv("LLM_CACHE_MAX_MB", "256")) * 1024 * 1024),
+                ttl_seconds=float(os.getenv("LLM_CACHE_TTL_SECONDS", str(7 * 24 * 3600))),
+            )
+        return _response_cache
+
+
+_parse_memory_cache = MemoryCache(max_entries=int(os.getenv("PARSE_CACHE_MEMORY_ENTRIES", "64")))
+_parse_disk_cache = None
+
+
+def parse_disk_cache_enabled():
+    return os.getenv("PARSE_CACHE_DISK", "1").lower() in ("1", "true", "yes")
+
+
+def get_parse_caches():
+    """Return (memory tier, disk tier or None) for parsed-email results."""
+    global _parse_disk_cache
+    with _cache_init_lock:
+        if _parse_disk_cache is None and parse_disk_cache_enabled():
+            _parse_disk_cache = DiskCache(
+                os.getenv("PARSE_CACHE_PATH", os.path.join(CACHE_DIR, "parsed_emails.sqlite")),
+                max_bytes=int(float(os.getenv("PARSE_CACHE_MAX_MB", "512")) * 1024 * 1024),
+            )
+        return _parse_memory_cache, _parse_disk_cache
+
+
+_ocr_cache = None
+
+
+def get_ocr_cache():
+    """Disk cache of OCR output keyed by image/page content hash; None when OCR_CACHE_DISABLED.
+
+    OCR runs in the extraction process pool, so each process opens its own connection.
+    """
+    global _ocr_cache
+    if os.getenv("OCR_CACHE_DISABLED", "").lower() in ("1", "true", "yes"):
+        return None
+    with _cache_init_lock:
+        if _ocr_cache is None or _ocr_cache[0] != os.getpid():
+            _ocr_cache = (os.getpid(), DiskCache(
+                os.getenv("OCR_CACHE_PATH", os.path.join(CACHE_DIR, "ocr.sqlite")),
+                max_bytes=int(float(os.getenv("OCR_CACHE_MAX_MB", "128")) * 1024 * 1024),
+            ))
+        return _ocr_cache[1]
@@ -0,0 +1,289 @@
+import os
+import json
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from json_extract import extract_json
+from llm import MAX_OUTPUT_TOKENS, query_claude, resolve_model_id
+from prompt_builder import (
+    ATTACHMENT_HEADER, CHARS_PER_TOKEN, DEFAULT_COMPACTION, compact_text, estimate_tokens, render_prompt, split_prompt_template,
+    truncate_to_tokens,
+)
+from schema_extract import coerce, validate
+from telemetry import logger, stage
+
+# Emails whose attachment + OCR text exceeds this are extracted chunk by chunk.
+CHUNK_THRESHOLD_TOKENS = int(os.getenv("CHUNKED_EXTRACT_THRESHOLD_TOKENS", "12000"))
+# Estimated JSON output tokens per token of chunk text: item lists come back about as long as
+# the rows they were read from, plus the keys. Chunks are sized so their answer fits MAX_OUTPUT_TOKENS.
+CHUNK_OUTPUT_RATIO = float(os.getenv("CHUNKED_EXTRACT_OUTPUT_RATIO", "1.5"))
+CHUNK_TOKENS = int(os.getenv("CHUNKED_EXTRACT_CHUNK_TOKENS", str(int(MAX_OUTPUT_TOKENS / CHUNK_OUTPUT_RATIO))))
+# A chunk whose answer still hits max_tokens is split in two and retried, down to this size.
+CHUNK_MIN_SPLIT_TOKENS = int(os.getenv("CHUNKED_EXTRACT_MIN_SPLIT_TOKENS", "200"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNKED_EXTRACT_OVERLAP_TOKENS", "300"))
+# Body text repeated in every chunk so root fields (payer, totals, dates) stay extractable.
+CHUNK_CONTEXT_TOKENS = int(os.getenv("CHUNKED_EXTRACT_CONTEXT_TOKENS", "1500"))
+CHUNK_MAX_WORKERS = int(os.getenv("CHUNKED_EXTRACT_WORKERS", "8"))
+# Fields identifying a list item (first one present wins); items without any are compared whole.
+ITEM_KEY_FIELDS = [
+    f.strip() for f in os.getenv(
+        "CHUNKED_EXTRACT_ITEM_KEYS", "invoice_number,invoice_id,document_number,reference_number,id"
+    ).split(",") if f.strip()
+]
+
+CHUNK_NOTE = (
+    "[Attachment content part {index} of {total}. The other parts are extracted separately: "
+    "list only the items that appear in this part, and use null for fields not shown here.]"
+)
+
+
+def long_content(email_data, compact=None):
+    """Attachment and OCR text: the part of an email that can outgrow a single call."""
+    compact = DEFAULT_COMPACTION if compact is None else compact
+    attachments = email_data.get("attachment_text_summary", "").strip()
+    ocr = email_data.get("embedded_image_text", "").strip()
+    if compact:
+        attachments, ocr = compact_text(attachments), compact_text(ocr)
+    return "\n\n".join(filter(None, [attachments, ocr and f"[Embedded image text]\n{ocr}"]))
+
+
+def needs_chunking(email_data, threshold=CHUNK_THRESHOLD_TOKENS, compact=None):
+    return estimate_tokens(long_content(email_data, compact)) > threshold
+
+
+CONTINUED = " (continued)"
+
+
+def attachment_header(line):
+    """The ``[filename]`` header a line starts (or continues, in a re-split chunk), else None."""
+    if line.endswith(CONTINUED):
+        line = line[:-len(CONTINUED)]
+    return line if ATTACHMENT_HEADER.match(line) else None
+
+
+def chunk_text(text, max_tokens=CHUNK_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS):
+    """Split on line boundaries into chunks of at most ``max_tokens``.
+
+    Each chunk repeats the last ``overlap_tokens`` of the previous one, so an item cut at a
+    boundary is complete in at least one chunk, and continues under its attachment's
+    ``[filename]`` header so the model knows where the lines come from.
+    """
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    lines = []
+    for line in text.splitlines():
+        while len(line) > max_chars:
+            lines.append(line[:max_chars])
+            line = line[max_chars:]
+        lines.append(line)
+
+    chunks = []
+    current, size, header = [], 0, None
+    for line in lines:
+        if current and size + len(line) + 1 > max_chars:
+            chunks.append("\n".join(current))
+            overlap, overlap_size = [], 0
+            for previous in reversed(current):
+                if overlap_size + len(previous) + 1 > overlap_tokens * CHARS_PER_TOKEN:
+                    break
+                overlap.insert(0, previous)
+                overlap_size += len(previous) + 1
+            current, size = [], 0
+            if header and not (overlap and attachment_header(overlap[0])):
+                current, size = [header + CONTINUED], len(header + CONTINUED) + 1
+            current += overlap
+            size += overlap_size
+        if attachment_header(line):
+            header = attachment_header(line)
+        current.append(line)
+        size += len(line) + 1
+    if any(line.strip() for line in current):
+        chunks.append("\n".join(current))
+    return chunks
+
+
+def build_chunk_prompts(email_data, prompt_template, compact=None, chunk_tokens=CHUNK_TOKENS,
+                        overlap_tokens=CHUNK_OVERLAP_TOKENS, context_tokens=CHUNK_CONTEXT_TOKENS):
+    """``[(prefix, prompt, split)]``, one per chunk; every chunk gets the metadata and (truncated) body.
+
+    ``split()`` returns the same for the chunk cut in two, or ``[]`` when it is too small
+    to split. Call from the thread that owns ``email_data``; the prompts can then be
+    sent (and split) from anywhere.
+    """
+    metadata = f"""=== EMAIL METADATA ===
+From: {email_data.get("from_address", "[missing]")}
+To: {email_data.get("to_address", "[missing]")}
+Subject: {email_data.get("subject", "")}
+Date: {email_data.get("date", "")}"""
+    compact = DEFAULT_COMPACTION if compact is None else compact
+    body = email_data.get("text", "").strip()
+    if compact:
+        body = compact_text(body, is_body=True)
+    body = truncate_to_tokens(body, context_tokens)
+    chunks = chunk_text(long_content(email_data, compact), chunk_tokens, overlap_tokens) or [""]
+
+    def render(chunk, index, total):
+        def split():
+            tokens = estimate_tokens(chunk)
+            if tokens < CHUNK_MIN_SPLIT_TOKENS:
+                return []
+            # Room for the overlap and continued header, so the second half is no bigger than the first.
+            overlap = min(overlap_tokens, tokens // 8)
+            halves = chunk_text(chunk, tokens // 2 + overlap + 10, overlap)
+            if len(halves) < 2:
+                return []
+            return [render(h, f"{index}.{j + 1}", total) for j, h in enumerate(halves)]
+
+        note = CHUNK_NOTE.format(index=index, total=total)
+        return (*split_prompt_template(prompt_template, render_prompt(metadata, body, [note + "\n" + chunk], "")), split)
+
+    return [render(chunk, i + 1, len(chunks)) for i, chunk in enumerate(chunks)]
+
+
+def item_key(item):
+    if isinstance(item, dict):
+        for field in ITEM_KEY_FIELDS:
+            value = item.get(field)
+            if value not in (None, ""):
+                return f"{field}={str(value).strip().lower()}"
+        item = {k: v for k, v in item.items() if v is not None}
+    return json.dumps(item, sort_keys=True)
+
+
+def _join(path, name):
+    return f"{path}.{name}" if path else name
+
+
+def merge_values(values, path, conflicts):
+    """Reconcile one field seen in several chunks.
+
+    Lists are concatenated and deduplicated by item key, dicts merge field by field, and
+    for scalars nulls lose to values; disagreeing values keep the most common one and are
+    reported in ``conflicts``.
+    """
+    present = [v for v in values if v is not None and v != ""]
+    if not present:
+        return values[0] if values else None
+    if all(isinstance(v, list) for v in present):
+        merged, positions = [], {}
+        for value in present:
+            for item in value:
+                key = item_key(item)
+                if key not in positions:
+                    positions[key] = len(merged)
+                    merged.append(item)
+                elif isinstance(item, dict) and isinstance(merged[positions[key]], dict):
+                    merged[positions[key]] = merge_values(
+                        [merged[positions[key]], item], f"{path}[{key}]", conflicts
+                    )
+        return merged
+    if all(isinstance(v, dict) for v in present):
+        keys = list(dict.fromkeys(k for v in present for k in v))
+        return {k: merge_values([v.get(k) for v in present if k in v], _join(path, k), conflicts) for k in keys}
+
+    counts = Counter(json.dumps(v, sort_keys=True) for v in present)
+    if len(counts) == 1:
+        return present[0]
+    chosen = counts.most_common(1)[0][0]
+    conflicts.append({"path": path, "values": [json.loads(v) for v in counts], "chosen": json.loads(chosen)})
+    return json.loads(chosen)
+
+
+def merge_partials(partials):
+    """Merge per-chunk JSON objects into one; returns ``(data, conflicts)``."""
+    conflicts = []
+    data = merge_values([p for p in partials if isinstance(p, dict)], "", conflicts)
+    return data or {}, conflicts
+
+
+def extract_chunks(chunk_prompts, model_id=None, use_cache=True, schema=None, max_workers=CHUNK_MAX_WORKERS,
+                   before_call=None):
+    """Extract every chunk concurrently and merge the partial results.
+
+    Returns ``{"data", "conflicts", "errors", "failed_chunks", "chunks", "usage", "elapsed_sec"}``.
+    ``errors`` lists chunks that failed or returned no JSON, plus schema violations of the
+    merged data. A chunk whose answer is cut off at max_tokens is split in two and retried.
+    ``before_call`` runs before each request (e.g. a rate limiter). Wall time is that of the
+    slowest chunk, and no single answer has to fit every item under the output-token limit.
+    """
+    model_id = resolve_model_id(model_id)[0]
+    started = time.perf_counter()
+
+    def call(chunk_prompt):
+        prefix, prompt, _ = chunk_prompt
+        if before_call is not None:
+            before_call()
+        return query_claude(prompt, model_id=model_id, use_cache=use_cache, schema=schema, prefix=prefix)
+
+    with stage("chunked_extract", model_id=model_id, chunks=len(chunk_prompts)) as event:
+        # (position, path, result); halves sort right after the chunk they replace.
+        runs = []
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+            pending = {
+                pool.submit(call, chunk_prompt): ((i,), f"chunk[{i}]", chunk_prompt)
+                for i, chunk_prompt in enumerate(chunk_prompts)
+            }
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    position, path, chunk_prompt = pending.pop(future)
+                    result = future.result()
+                    halves = chunk_prompt[2]() if result.get("stop_reason") == "max_tokens" else None
+                    if halves:
+                        # Back into the pool, so a split chunk costs one more round trip, not a serial chain.
+                        logger.info("✂️ %s hit max_tokens; retrying in %d parts", path, len(halves))
+                        for j, half in enumerate(halves):
+                            pending[pool.submit(call, half)] = (position + (j,), f"{path[:-1]}.{j + 1}]", half)
+                        # The cut-off answer is dropped, but its tokens were paid for.
+                        result = {"usage": result.get("usage"), "split": True}
+                    elif halves is not None:
+                        result = {**result, "extracted_data": "[LLM Error: answer cut off at max_tokens]"}
+                    runs.append((position, path, result))
+        runs = [(path, result) for _, path, result in sorted(runs, key=lambda run: run[0])]
+
+        usage = {}
+        partials, errors = [], []
+        splits = 0
+        for path, result in runs:
+            for key, count in (result.get("usage") or {}).items():
+                usage[key] = usage.get(key, 0) + count
+            if result.get("split"):
+                splits += 1
+                continue
+            output = result["extracted_data"]
+            if output.startswith(("[LLM Error", "[Unsupported model")):
+                errors.append({"path": path, "message": output})
+                continue
+            partial = extract_json(output)
+            if not isinstance(partial, dict):
+                errors.append({"path": path, "message": "no JSON object in model output"})
+                continue
+            partials.append(coerce(partial, schema) if schema else partial)
+        failed = len(errors)
+
+        data, conflicts = merge_partials(partials)
+        if schema is not None and partials:
+            errors.extend(validate(data, schema))
+        if conflicts:
+            logger.info("⚖️ %d conflicting field(s) across %d chunks", len(conflicts), len(runs) - splits)
+        event.update(usage)
+        event["conflicts"] = len(conflicts)
+        event["failed_chunks"] = failed
+        event["split_chunks"] = splits
+        if not partials:
+            event["status"] = "error"
+    return {
+        "data": data if partials else None,
+        "conflicts": conflicts,
+        "errors": errors,
+        "failed_chunks": failed,
+        "chunks": len(runs) - splits,
+        "usage": usage,
+        "elapsed_sec": round(time.perf_counter() - started, 3),
+    }
+
+
+def extract_chunked(email_data, prompt_template, model_id=None, use_cache=True, schema=None, compact=None):
+    """Map-reduce extraction for emails with very long attachments (see extract_chunks)."""
+    return extract_chunks(build_chunk_prompts(email_data, prompt_template, compact=compact),
+                          model_id=model_id, use_cache=use_cache, schema=schema)
@@ -0,0 +1,206 @@
+import os
+import re
+import json
+import zlib
+import sqlite3
+import difflib
+import hashlib
+import threading
+
+from cache import CACHE_DIR
+
+SIMHASH_BITS = 64
+SIMHASH_BANDS = 4  # 16-bit bands: any pair within 3 bits shares at least one band exactly
+NEAR_DUPLICATE_MAX_DISTANCE = int(os.getenv("DEDUPE_MAX_DISTANCE", "3"))
+DEDUPE_INDEX_PATH = os.getenv("DEDUPE_INDEX_PATH", os.path.join(CACHE_DIR, "dedupe.sqlite"))
+VERIFY_MAX_CHANGED_LINES = int(os.getenv("DEDUPE_VERIFY_MAX_CHANGED_LINES", "40"))
+
+URL_QUERY = re.compile(r"(https?://[^\s?#<>\"]+)[?#][^\s<>\"]*")
+# Long opaque mixes of letters and digits: tracking IDs, message IDs, unsubscribe tokens.
+TRACKING_TOKEN = re.compile(r"\b(?=[A-Za-z0-9_-]*\d)(?=[A-Za-z0-9_-]*[A-Za-z])[A-Za-z0-9_-]{32,}\b")
+TIMESTAMP = re.compile(
+    r"\b\d{4}-\d{2}-\d{2}[T ]\d{1,2}:\d{2}(:\d{2})?(\.\d+)?(Z|[+-]\d{2}:?\d{2})?\b"
+    r"|\b\d{1,2}:\d{2}(:\d{2})?\s*([AaPp][Mm])?\b"
+    r"|\b(Mon|Tue|Wed|Thu|Fri|Sat|Sun), \d{1,2} \w{3} \d{4}\b"
+)
+WORD = re.compile(r"\w+")
+
+
+def normalize_line(line):
+    line = URL_QUERY.sub(r"\1", line)
+    line = TRACKING_TOKEN.sub("<token>", line)
+    return " ".join(line.split())
+
+
+def comparable_lines(email_data):
+    """Header and body lines as the model would read them, minus whitespace and tracking noise."""
+    lines = [
+        f"From: {email_data.get('from_address', '')}",
+        f"To: {email_data.get('to_address', '')}",
+        f"Subject: {email_data.get('subject', '')}",
+        f"Date: {email_data.get('date', '')}",
+    ]
+    lines.extend(filter(None, (normalize_line(line) for line in email_data.get("text", "").splitlines())))
+    return lines
+
+
+def simhash(features):
+    weights = [0] * SIMHASH_BITS
+    for feature in features:
+        h = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "big")
+        for bit in range(SIMHASH_BITS):
+            weights[bit] += 1 if h >> bit & 1 else -1
+    return sum(1 << bit for bit, weight in enumerate(weights) if weight > 0)
+
+
+def simhash_features(lines):
+    """Word 3-shingles with timestamps masked; the Date header is left out entirely."""
+    words = []
+    for line in lines:
+        if line.startswith("Date: "):
+            continue
+        words.extend(WORD.findall(TIMESTAMP.sub(" ", line).lower()))
+    return [" ".join(words[i:i + 3]) for i in range(max(1, len(words) - 2))]
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+class Fingerprint:
+    __slots__ = ("exact", "simhash", "sender", "attachments", "lines")
+
+    def __init__(self, exact, simhash_value, sender, attachments, lines):
+        self.exact = exact
+        self.simhash = simhash_value
+        self.sender = sender
+        self.attachments = attachments
+        self.lines = lines
+
+
+def fingerprint(email_data):
+    """Fingerprint a parsed email without running attachment extraction.
+
+    ``exact`` covers headers (including Date), the normalized body and attachment payload
+    hashes, so an exact match is safe to reuse. ``simhash`` ignores timestamps and is only
+    compared between emails from the same sender with identical attachments.
+    """
+    lines = comparable_lines(email_data)
+    digests = getattr(email_data, "payload_digests", None)
+    if digests is None:
+        summary = email_data.get("attachment_text_summary", "") + email_data.get("embedded_image_text", "")
+        digests = [hashlib.sha256(summary.encode("utf-8")).hexdigest()] if summary else []
+    attachments = hashlib.sha256(json.dumps(sorted(digests)).encode("utf-8")).hexdigest()
+    exact = hashlib.sha256(json.dumps([lines, attachments]).encode("utf-8")).hexdigest()
+    return Fingerprint(exact, simhash(simhash_features(lines)), email_data.get("from_address", ""), attachments, lines)
+
+
+def changed_lines(old_lines, new_lines):
+    return [
+        line for line in difflib.unified_diff(old_lines, new_lines, lineterm="", n=0)
+        if line[:1] in "+-" and not line.startswith(("+++", "---"))
+    ]
+
+
+def build_verification_prompt(previous_output, diff):
+    """A short prompt updating a prior extraction from the lines that changed."""
+    return (
+        "An earlier email from the same sender, using the same template, was extracted as:\n"
+        f"{previous_output}\n\n"
+        "The new email differs from that one only in these lines (- old, + new):\n"
+        + "\n".join(diff)
+        + "\n\nReturn the extraction for the new email: the same JSON structure, with every value "
+        "affected by the changed lines updated. Return only the JSON."
+    )
+
+
+class DuplicateIndex:
+    """SQLite index of processed emails: exact fingerprints plus SimHash bands for near-duplicates.
+
+    ``scope`` separates entries by prompt/model/settings so an extraction is only reused for
+    the same request. Safe to share between threads.
+    """
+
+    def __init__(self, path=DEDUPE_INDEX_PATH, max_distance=NEAR_DUPLICATE_MAX_DISTANCE):
+        self.max_distance = max_distance
+        self.lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS emails ("
+            " scope TEXT NOT NULL, exact TEXT NOT NULL, simhash TEXT NOT NULL, sender TEXT NOT NULL,"
+            " attachments TEXT NOT NULL, email_id TEXT NOT NULL, lines BLOB NOT NULL, output TEXT NOT NULL,"
+            " PRIMARY KEY (scope, exact))"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS bands ("
+            " scope TEXT NOT NULL, band INTEGER NOT NULL, value INTEGER NOT NULL, exact TEXT NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS bands_lookup ON bands(scope, band, value)")
+
+    @staticmethod
+    def _bands(value):
+        width = SIMHASH_BITS // SIMHASH_BANDS
+        return [(i, value >> (i * width) & ((1 << width) - 1)) for i in range(SIMHASH_BANDS)]
+
+    def lookup(self, scope, fp):
+        """Return ``("exact", match)``, ``("near", match)`` or ``(None, None)``.
+
+        ``match`` has ``email_id``, ``output``, ``distance`` and ``lines`` of the earlier email.
+        """
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT email_id, output, lines FROM emails WHERE scope = ? AND exact = ?", (scope, fp.exact)
+            ).fetchone()
+            if row is not None:
+                return "exact", self._match(row, 0)
+
+            candidates = set()
+            for band, value in self._bands(fp.simhash):
+                candidates.update(r[0] for r in self.conn.execute(
+                    "SELECT exact FROM bands WHERE scope = ? AND band = ? AND value = ?", (scope, band, value)
+                ))
+            best = None
+            for exact in candidates:
+                row = self.conn.execute(
+                    "SELECT email_id, output, lines, simhash, sender, attachments FROM emails"
+                    " WHERE scope = ? AND exact = ?", (scope, exact)
+                ).fetchone()
+                if row is None or row[4] != fp.sender or row[5] != fp.attachments:
+                    continue
+                distance = hamming(int(row[3]), fp.simhash)
+                if distance <= self.max_distance and (best is None or distance < best[1]):
+                    best = (row, distance)
+        if best is None:
+            return None, None
+        return "near", self._match(best[0], best[1])
+
+    @staticmethod
+    def _match(row, distance):
+        return {
+            "email_id": row[0],
+            "output": row[1],
+            "lines": json.loads(zlib.decompress(row[2])),
+            "distance": distance,
+        }
+
+    def add(self, scope, fp, email_id, output):
+        lines = zlib.compress(json.dumps(fp.lines).encode("utf-8"))
+        with self.lock:
+            inserted = self.conn.execute(
+                "INSERT OR IGNORE INTO emails (scope, exact, simhash, sender, attachments, email_id, lines, output)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (scope, fp.exact, str(fp.simhash), fp.sender, fp.attachments, email_id, lines, output),
+            ).rowcount
+            if inserted:
+                self.conn.executemany(
+                    "INSERT INTO bands (scope, band, value, exact) VALUES (?, ?, ?, ?)",
+                    [(scope, band, value, fp.exact) for band, value in self._bands(fp.simhash)],
+                )
+
+    def stats(self):
+        with self.lock:
+            return {"entries": self.conn.execute("SELECT COUNT(*) FROM emails").fetchone()[0]}
@@ -1,125 +1,146 @@
 import os
 import email
-import tempfile
-import pytesseract
-from bs4 import BeautifulSoup
+import hashlib
 from email import policy
 from email.parser import BytesParser
 from email.utils import getaddresses
-from PyPDF2 import PdfReader
-from docx import Document
-from openpyxl import load_workbook
-from PIL import Image
 from io import BytesIO
 
-def parse_eml_file(file):
+from cache import get_parse_caches, hash_key
+from extractors import EXTRACTION_WORKERS, extract_text, get_extractor, map_extraction
+from ingest import decode_part, part_text
+from ocr import ocr_image
+from parsed_email import ParsedEmail
+from telemetry import stage
+
+# Bump whenever parse_eml_file output changes so stale cache entries are ignored.
+PARSER_VERSION = "6"
+
+def _extract_job(job, parallel_ocr=True):
+    kind, filename, content_type, payload = job
+    if kind == "attachment":
+        return extract_text_from_known_types(filename, payload, parallel_ocr=parallel_ocr, content_type=content_type)
+    if kind == "raw":
+        return payload.decode("utf-8", errors="ignore")
+    return extract_text_from_image(payload)
+
+def _run_extraction_job(job):
+    # Already inside a worker, so OCR pages sequentially rather than nesting pools.
+    return _extract_job(job, parallel_ocr=False)
+
+def run_extraction_jobs(jobs):
+    """Run attachment/image jobs, fanning out to the process pool when it pays off.
+
+    Results come back in job order so the summaries are deterministic.
+    """
+    if EXTRACTION_WORKERS <= 1 or len(jobs) <= 1:
+        return [_extract_job(job) for job in jobs]
+    return map_extraction(_run_extraction_job, jobs)
+
+def parse_eml_file(file, decode_unknown=False):
+    """Parse an .eml file object into a ParsedEmail.
+
+    Only headers and MIME structure are handled here; HTML→text and attachment/OCR
+    extraction are deferred until those fields are read. With ``decode_unknown``,
+    attachments without a registered extractor are included as decoded text.
+    """
     msg = BytesParser(policy=policy.default).parse(file)
 
-    parsed = {
-        "from_address": "",
-        "to_address": "",
-        "subject": msg.get("Subject", ""),
-        "date": msg.get("Date", ""),
-        "text": "",
-        "html": "",
-        "attachments": [],
-        "embedded_images": [],
-        "attachment_text_summary": "",
-        "embedded_image_text": ""
-    }
-
     from_emails = getaddresses([msg.get("From", "")])
     to_emails = getaddresses([msg.get("To", "")])
-    parsed["from_address"] = from_emails[0][1] if from_emails else ""
-    parsed["to_address"] = to_emails[0][1] if to_emails else ""
-
-    attachment_texts = []
-    image_ocr_texts = []
+    text = ""
+    html = ""
+    attachments = []
+    embedded_images = []
+    jobs = []
 
     for part in msg.walk():
         content_type = part.get_content_type()
         content_disposition = part.get_content_disposition()
         filename = part.get_filename()
 
-        if content_type == "text/plain" and not parsed["text"]:
-            parsed["text"] = part.get_content().strip()
-        elif content_type == "text/html" and not parsed["html"]:
-            html = part.get_content()
-            parsed["html"] = html
-            if not parsed["text"]:
-                soup = BeautifulSoup(html, "html5lib")
-                parsed["text"] = soup.get_text().strip()
+        if content_type == "text/plain" and not text and not html:
+            text = part_text(part).strip()
+        elif content_type == "text/html" and not html:
+            html = part_text(part)
         elif content_disposition == "attachment" and filename:
             print(f"📎 Found attachment: {filename} ({content_type})")
-            payload = part.get_payload(decode=True)
-            parsed["attachments"].append({"filename": filename, "content_type": content_type})
-            text = extract_text_from_known_types(filename, payload)
-            if text:
-                attachment_texts.append(f"[{filename}]\n{text}")
+            payload = decode_part(part, filename)
+            attachments.append({"filename": filename, "content_type": content_type})
+            if payload:
+                kind = "raw" if decode_unknown and get_extractor(filename, content_type) is None else "attachment"
+                jobs.append((kind, filename, content_type, payload))
         elif content_type.startswith("image/") and content_disposition != "attachment":
-            payload = part.get_payload(decode=True)
-            parsed["embedded_images"].append(content_type)
-            ocr_text = extract_text_from_image(payload)
-            if ocr_text:
-                image_ocr_texts.append(ocr_text)
+            payload = decode_part(part)
+            embedded_images.append(content_type)
+            if payload:
+                jobs.append(("image", None, content_type, payload))
+
+    parsed = ParsedEmail(
+        from_address=from_emails[0][1] if from_emails else "",
+        to_address=to_emails[0][1] if to_emails else "",
+        subject=msg.get("Subject", ""),
+        date=msg.get("Date", ""),
+        text=text,
+        html=html,
+        attachments=attachments,
+        embedded_images=embedded_images,
+        jobs=jobs,
+    )
+
+    print(f"✅ From: {parsed.from_address}")
+    print(f"✅ To: {parsed.to_address}")
 
-    parsed["attachment_text_summary"] = "\n\n".join(attachment_texts)
-    parsed["embedded_image_text"] = "\n\n".join(image_ocr_texts)
+    return parsed
 
-    print(f"✅ From: {parsed['from_address']}")
-    print(f"✅ To: {parsed['to_address']}")
+def parser_cache_config():
+    return {
+        "version": PARSER_VERSION,
+        "ocr": bool(os.getenv("TESSERACT_CMD")),
+    }
 
+def parse_eml_file_cached(file, source="upload"):
+    """parse_eml_file memoized on the SHA-256 of the raw bytes plus parser config.
+
+    Only real parses (cache misses) record a ``parse`` stage, tagged with ``source``.
+    """
+    if hasattr(file, "getvalue"):
+        data = file.getvalue()
+    else:
+        file.seek(0)
+        data = file.read()
+    key = hash_key("parse_eml_file", hashlib.sha256(data).hexdigest(), parser_cache_config())
+
+    memory_cache, disk_cache = get_parse_caches()
+    parsed = memory_cache.get(key)
+    if parsed is not None:
+        return parsed
+    if disk_cache is not None:
+        cached = disk_cache.get(key)
+        if cached is not None:
+            print("⚡ Parsed email loaded from disk cache")
+            parsed = ParsedEmail.from_dict(cached)
+            memory_cache.set(key, parsed)
+            return parsed
+
+    with stage("parse", source=source) as event:
+        parsed = parse_eml_file(BytesIO(data))
+        event["footprint_bytes"] = parsed.footprint()["total"]
+    memory_cache.set(key, parsed)
+    if disk_cache is not None:
+        # Serializing would force HTML→text and extraction now; store the entry once
+        # something has needed those fields anyway.
+        parsed.on_complete(lambda email_data: _store_parsed(disk_cache, key, email_data))
     return parsed
 
-def extract_text_from_known_types(filename, payload):
-    import subprocess
-    ext = os.path.splitext(filename)[1].lower()
+def _store_parsed(disk_cache, key, parsed):
     try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=ext) as tmp:
-            tmp.write(payload)
-            tmp.flush()
-            print(f"🔍 Attempting to extract from: {filename}")
-            
-            if ext == ".pdf":
-                reader = PdfReader(tmp.name)
-                extracted = "\n".join(page.extract_text() or "" for page in reader.pages)
-
-                if extracted.strip():
-                    print(f"✅ Extracted text from PDF: {filename}")
-                    return extracted
-                else:
-                    print(f"⚠️ No text in PDF. Trying OCR fallback: {filename}")
-                    from pdf2image import convert_from_path
-                    images = convert_from_path(tmp.name)
-                    return "\n".join(pytesseract.image_to_string(img) for img in images)
-
-            elif ext == ".docx":
-                return "\n".join(p.text for p in Document(tmp.name).paragraphs)
-
-            elif ext == ".xlsx":
-                wb = load_workbook(tmp.name, read_only=True)
-                return "\n".join(
-                    str(cell.value)
-                    for sheet in wb
-                    for row in sheet.iter_rows()
-                    for cell in row if cell.value
-                )
-
-            elif ext in [".txt", ".csv"]:
-                return open(tmp.name, "r", encoding="utf-8", errors="ignore").read()
+        disk_cache.set(key, parsed.to_dict(compact=True))
     except Exception as e:
-        print(f"⚠️ Could not extract text from {filename}: {e}")
-    return ""
+        print(f"⚠️ Could not write parsed email to disk cache: {e}")
 
-def extract_text_from_image(image_bytes):
-    tess_cmd = os.getenv("TESSERACT_CMD")
-    if not tess_cmd:
-        print("⚠️ Warning: TESSERACT_CMD not set — OCR will not work")
-        return ""
+def extract_text_from_known_types(filename, payload, parallel_ocr=True, content_type=None):
+    return extract_text(filename, payload, content_type=content_type, parallel_ocr=parallel_ocr)
 
-    try:
-        pytesseract.pytesseract.tesseract_cmd = tess_cmd
-        return pytesseract.image_to_string(Image.open(BytesIO(image_bytes)))
-    except Exception as e:
-        print(f"⚠️ OCR failed: {e}")
-        return ""
+def extract_text_from_image(image_bytes):
+    return ocr_image(image_bytes)
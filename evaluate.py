@@ -0,0 +1,215 @@
+import os
+import json
+import time
+import hashlib
+import argparse
+import threading
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+
+from cache import CACHE_DIR, DiskCache, hash_key
+from email_parser import PARSER_VERSION, parse_eml_file_cached
+from llm import build_email_prompt, query_claude, resolve_model_id
+from prompt_builder import split_prompt_template, DEFAULT_COMPACTION, DEFAULT_TOKEN_BUDGET
+from json_extract import extract_json
+from telemetry import stage
+
+DEFAULT_WORKERS = int(os.getenv("EVAL_WORKERS", "8"))
+# Bump when the shape of a cached result changes.
+EVAL_RESULT_VERSION = "2"
+
+_eval_cache = None
+_eval_cache_lock = threading.Lock()
+
+
+def get_eval_cache():
+    global _eval_cache
+    with _eval_cache_lock:
+        if _eval_cache is None:
+            _eval_cache = DiskCache(
+                os.getenv("EVAL_CACHE_PATH", os.path.join(CACHE_DIR, "eval_results.sqlite")),
+                max_bytes=int(float(os.getenv("EVAL_CACHE_MAX_MB", "256")) * 1024 * 1024),
+            )
+        return _eval_cache
+
+
+def load_golden_set(folder):
+    """Pair every `<name>.eml` with its expected `<name>.json` in ``folder``."""
+    cases = []
+    for name in sorted(os.listdir(folder)):
+        if not name.lower().endswith(".eml"):
+            continue
+        expected_path = os.path.join(folder, os.path.splitext(name)[0] + ".json")
+        if not os.path.exists(expected_path):
+            print(f"⚠️ No expected JSON for {name}, skipping")
+            continue
+        with open(os.path.join(folder, name), "rb") as f:
+            raw = f.read()
+        with open(expected_path, "r", encoding="utf-8") as f:
+            expected = json.load(f)
+        cases.append({"id": name, "raw": raw, "sha256": hashlib.sha256(raw).hexdigest(), "expected": expected})
+    return cases
+
+
+def normalize_value(value):
+    if isinstance(value, bool) or value is None:
+        return value
+    if isinstance(value, (int, float)):
+        return round(float(value), 2)
+    if isinstance(value, str):
+        stripped = value.strip()
+        if stripped.lower() in ("", "null", "none", "n/a"):
+            return None
+        try:
+            return round(float(stripped.replace(",", "").lstrip("$")), 2)
+        except ValueError:
+            return " ".join(stripped.lower().split())
+    return value
+
+
+def flatten_fields(obj, prefix=""):
+    """Flatten JSON into (path, normalized value) pairs; list items share a `[]` path so order is ignored."""
+    pairs = []
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            pairs.extend(flatten_fields(value, f"{prefix}.{key}" if prefix else key))
+    elif isinstance(obj, list):
+        for item in obj:
+            pairs.extend(flatten_fields(item, f"{prefix}[]"))
+    else:
+        value = normalize_value(obj)
+        if value is not None:
+            pairs.append((prefix, json.dumps(value)))
+    return pairs
+
+
+def score(predicted, expected):
+    predicted_pairs = flatten_fields(predicted) if predicted is not None else []
+    expected_pairs = flatten_fields(expected)
+    remaining = list(expected_pairs)
+    true_positives = 0
+    for pair in predicted_pairs:
+        if pair in remaining:
+            remaining.remove(pair)
+            true_positives += 1
+    missed_fields = sorted({path for path, _ in remaining})
+    return {
+        "true_positives": true_positives,
+        "predicted_fields": len(predicted_pairs),
+        "expected_fields": len(expected_pairs),
+        "exact_match": predicted is not None and sorted(predicted_pairs) == sorted(expected_pairs),
+        "missed_fields": missed_fields,
+    }
+
+
+def evaluate_case(case, prompt_template, model_id, use_cache=True, token_budget=None, compact=None):
+    """Score one golden email; a parse or extraction failure becomes an error row instead of raising."""
+    token_budget = DEFAULT_TOKEN_BUDGET if token_budget is None else token_budget
+    compact = DEFAULT_COMPACTION if compact is None else compact
+    template_hash = hashlib.sha256(prompt_template.encode("utf-8")).hexdigest()
+    key = hash_key(
+        "eval", EVAL_RESULT_VERSION, template_hash, case["sha256"], model_id, PARSER_VERSION, token_budget, compact
+    )
+    cache = get_eval_cache() if use_cache else None
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            return {**cached, "id": case["id"], "cached": True}
+
+    try:
+        with stage("eval_case", model_id=model_id) as event:
+            email_data = parse_eml_file_cached(BytesIO(case["raw"]), source="eval")
+            prompt_prefix, prompt = split_prompt_template(
+                prompt_template, build_email_prompt(email_data, token_budget=token_budget, compact=compact)
+            )
+            output = query_claude(prompt, model_id=model_id, use_cache=use_cache, prefix=prompt_prefix)["extracted_data"]
+            predicted = extract_json(output)
+            result = {"output": output, "predicted": predicted, **score(predicted, case["expected"])}
+            event["exact_match"] = result["exact_match"]
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        print(f"❌ Evaluation failed for {case['id']}: {error}")
+        return {"output": None, "predicted": None, **score(None, case["expected"]),
+                "error": error, "id": case["id"], "cached": False}
+
+    if cache is not None and not output.startswith("[LLM Error"):
+        cache.set(key, result)
+    return {**result, "id": case["id"], "cached": False}
+
+
+def summarize(results):
+    tp = sum(r["true_positives"] for r in results)
+    predicted = sum(r["predicted_fields"] for r in results)
+    expected = sum(r["expected_fields"] for r in results)
+    precision = tp / predicted if predicted else 0.0
+    recall = tp / expected if expected else 0.0
+    missed = {}
+    for r in results:
+        for field in r["missed_fields"]:
+            missed[field] = missed.get(field, 0) + 1
+    return {
+        "emails": len(results),
+        "precision": round(precision, 4),
+        "recall": round(recall, 4),
+        "f1": round(2 * precision * recall / (precision + recall), 4) if precision + recall else 0.0,
+        "exact_match": round(sum(r["exact_match"] for r in results) / len(results), 4) if results else 0.0,
+        "cached": sum(r["cached"] for r in results),
+        "errors": sum("error" in r for r in results),
+        "most_missed_fields": sorted(missed.items(), key=lambda kv: -kv[1])[:10],
+    }
+
+
+def evaluate_prompt(cases, prompt_template, model_id=None, workers=DEFAULT_WORKERS, use_cache=True,
+                    token_budget=None, compact=None):
+    """Run one prompt over the golden set; only (prompt, email, model, budget) combinations not seen before hit the model.
+
+    ``token_budget`` and ``compact`` shape the email section exactly as they do for the Extract button.
+    """
+    model_id = resolve_model_id(model_id)[0]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(
+            lambda case: evaluate_case(case, prompt_template, model_id, use_cache, token_budget, compact), cases
+        ))
+    summary = summarize(results)
+    summary["model_id"] = model_id
+    summary["elapsed_sec"] = round(time.perf_counter() - started, 2)
+    return {"summary": summary, "results": results}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score extraction prompts against a labeled golden set.")
+    parser.add_argument("golden_dir", help="Folder of <name>.eml files with matching <name>.json expected output")
+    parser.add_argument("--prompt-file", action="append", required=True, help="Prompt template; repeat to compare")
+    parser.add_argument("--model", default=None)
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument("--token-budget", type=int, default=None, help="Max estimated tokens for the email section")
+    parser.add_argument("--compact", action="store_true", default=None,
+                        help="Strip quoted replies, signatures, boilerplate and repeated lines")
+    parser.add_argument("--no-cache", action="store_true", help="Re-run every email even if unchanged")
+    parser.add_argument("--output", default=None, help="Write the full per-email report as JSON")
+    args = parser.parse_args(argv)
+
+    cases = load_golden_set(args.golden_dir)
+    print(f"📂 {len(cases)} labeled emails in {args.golden_dir}")
+
+    report = {}
+    for path in args.prompt_file:
+        with open(path, "r", encoding="utf-8") as f:
+            template = f.read()
+        report[path] = evaluate_prompt(
+            cases, template, args.model, args.workers, use_cache=not args.no_cache,
+            token_budget=args.token_budget, compact=args.compact,
+        )
+        s = report[path]["summary"]
+        print(f"🎯 {path}: P={s['precision']:.3f} R={s['recall']:.3f} F1={s['f1']:.3f} "
+              f"exact={s['exact_match']:.3f} ({s['cached']}/{s['emails']} cached, {s['errors']} errors, {s['elapsed_sec']}s)")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,178 @@
+import os
+import hashlib
+import threading
+import multiprocessing
+from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from ocr import OCR_PDF_DPI, OCR_PDF_MAX_PAGES, ocr_pdf_page
+
+DEFAULT_MAX_BYTES = int(float(os.getenv("EXTRACTOR_MAX_MB", "25")) * 1024 * 1024)
+PDF_MAX_PAGES = int(os.getenv("PDF_MAX_PAGES", "200"))
+XLSX_MAX_ROWS = int(os.getenv("XLSX_MAX_ROWS", "50000"))
+# Text beyond this never fits a prompt, so extractors stop reading pages/rows once they reach it.
+EXTRACTOR_MAX_CHARS = int(os.getenv("EXTRACTOR_MAX_CHARS", "400000"))
+
+EXTRACTION_WORKERS = int(os.getenv("EMAIL_PARSER_WORKERS", str(os.cpu_count() or 1)))
+# The app, batch runner and UI jobs are multithreaded, so workers must not be forked from them.
+EXTRACTION_START_METHOD = os.getenv(
+    "EMAIL_PARSER_START_METHOD",
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn",
+)
+
+_extraction_pool = None
+_extraction_pool_lock = threading.Lock()
+
+def get_extraction_pool():
+    """Shared process pool for attachment/OCR work; None when running single-process."""
+    global _extraction_pool
+    if EXTRACTION_WORKERS <= 1:
+        return None
+    with _extraction_pool_lock:
+        if _extraction_pool is None:
+            _extraction_pool = ProcessPoolExecutor(
+                max_workers=EXTRACTION_WORKERS, mp_context=multiprocessing.get_context(EXTRACTION_START_METHOD),
+            )
+        return _extraction_pool
+
+def reset_extraction_pool(pool):
+    """Drop ``pool`` (if it is still the shared one) so the next call starts a fresh pool."""
+    global _extraction_pool
+    with _extraction_pool_lock:
+        if _extraction_pool is pool:
+            _extraction_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def map_extraction(func, *iterables):
+    """``map`` over the extraction pool, in-process when there is none.
+
+    A crashed worker (e.g. killed for memory on a huge PDF) breaks the whole pool; it is
+    replaced for later calls and this batch is redone in-process.
+    """
+    pool = get_extraction_pool()
+    if pool is not None:
+        try:
+            return list(pool.map(func, *iterables))
+        except BrokenProcessPool:
+            print("⚠️ Extraction worker crashed; restarting the pool and extracting in-process")
+            reset_extraction_pool(pool)
+    return list(map(func, *iterables))
+
+
+class Extractor:
+    """A registered text extractor plus the limits applied to it."""
+
+    def __init__(self, name, func, max_bytes=DEFAULT_MAX_BYTES, max_pages=None):
+        self.name = name
+        self.func = func
+        self.max_bytes = max_bytes
+        self.max_pages = max_pages
+
+    def __call__(self, data, parallel_ocr=True):
+        return self.func(data, self, parallel_ocr=parallel_ocr)
+
+
+EXTRACTORS_BY_EXTENSION = {}
+EXTRACTORS_BY_MIME_TYPE = {}
+
+def register_extractor(name, extensions=(), mime_types=(), max_bytes=DEFAULT_MAX_BYTES, max_pages=None):
+    """Decorator registering ``func(data, extractor, parallel_ocr)`` for the given types.
+
+    ``data`` is the raw attachment payload (bytes); ``max_pages`` is interpreted per type
+    (PDF pages, spreadsheet rows, ...).
+    """
+    def decorator(func):
+        extractor = Extractor(name, func, max_bytes=max_bytes, max_pages=max_pages)
+        for ext in extensions:
+            EXTRACTORS_BY_EXTENSION[ext.lower()] = extractor
+        for mime_type in mime_types:
+            EXTRACTORS_BY_MIME_TYPE[mime_type.lower()] = extractor
+        return func
+    return decorator
+
+def get_extractor(filename=None, content_type=None):
+    ext = os.path.splitext(filename or "")[1].lower()
+    return EXTRACTORS_BY_EXTENSION.get(ext) or EXTRACTORS_BY_MIME_TYPE.get((content_type or "").lower())
+
+def extract_text(filename, payload, content_type=None, parallel_ocr=True):
+    """Extract text from an in-memory attachment; returns "" when unsupported or on failure."""
+    extractor = get_extractor(filename, content_type)
+    if extractor is None or not payload:
+        return ""
+    if len(payload) > extractor.max_bytes:
+        print(f"⚠️ Skipping {filename}: {len(payload)} bytes exceeds {extractor.name} limit of {extractor.max_bytes}")
+        return ""
+    try:
+        print(f"🔍 Attempting to extract from: {filename}")
+        return extractor(payload, parallel_ocr=parallel_ocr) or ""
+    except Exception as e:
+        print(f"⚠️ Could not extract text from {filename}: {e}")
+        return ""
+
+
+def join_limited(pieces, max_chars=EXTRACTOR_MAX_CHARS, sep="\n"):
+    """Join an iterator of strings, consuming no more of it than needed for ``max_chars``."""
+    out = []
+    total = 0
+    for piece in pieces:
+        out.append(piece)
+        total += len(piece) + len(sep)
+        if total >= max_chars:
+            break
+    return sep.join(out)[:max_chars]
+
+def ocr_pdf(data, page_count, parallel=True):
+    """OCR the first OCR_PDF_MAX_PAGES pages at OCR_PDF_DPI; pages already OCRed come from the cache."""
+    page_count = min(page_count, OCR_PDF_MAX_PAGES)
+    pages = range(1, page_count + 1)
+    digest = hashlib.sha256(data).hexdigest()
+    if not parallel or page_count <= 1:
+        return "\n".join(ocr_pdf_page(data, page, OCR_PDF_DPI, digest) for page in pages)
+    return "\n".join(map_extraction(
+        ocr_pdf_page, [data] * page_count, pages, [OCR_PDF_DPI] * page_count, [digest] * page_count
+    ))
+
+@register_extractor("pdf", extensions=[".pdf"], mime_types=["application/pdf"], max_pages=PDF_MAX_PAGES)
+def extract_pdf(data, extractor, parallel_ocr=True):
+    from PyPDF2 import PdfReader
+    reader = PdfReader(BytesIO(data))
+    pages = reader.pages[:extractor.max_pages] if extractor.max_pages else reader.pages
+    extracted = join_limited(page.extract_text() or "" for page in pages)
+    if extracted.strip():
+        return extracted
+
+    print("⚠️ No text in PDF. Trying OCR fallback")
+    return ocr_pdf(data, len(pages), parallel=parallel_ocr)
+
+@register_extractor(
+    "docx",
+    extensions=[".docx"],
+    mime_types=["application/vnd.openxmlformats-officedocument.wordprocessingml.document"],
+)
+def extract_docx(data, extractor, parallel_ocr=True):
+    from docx import Document
+    return "\n".join(p.text for p in Document(BytesIO(data)).paragraphs)
+
+@register_extractor(
+    "xlsx",
+    extensions=[".xlsx"],
+    mime_types=["application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"],
+    max_pages=XLSX_MAX_ROWS,
+)
+def extract_xlsx(data, extractor, parallel_ocr=True):
+    from openpyxl import load_workbook
+    wb = load_workbook(BytesIO(data), read_only=True)
+    try:
+        return join_limited(
+            str(cell.value)
+            for sheet in wb
+            for row in sheet.iter_rows(max_row=extractor.max_pages)
+            for cell in row if cell.value
+        )
+    finally:
+        wb.close()
+
+@register_extractor("text", extensions=[".txt", ".csv"], mime_types=["text/plain", "text/csv"])
+def extract_plain_text(data, extractor, parallel_ocr=True):
+    return bytes(data).decode("utf-8", errors="ignore")
@@ -0,0 +1,140 @@
+import os
+import re
+import base64
+import quopri
+import mailbox
+from email import policy
+from email.parser import BytesHeaderParser
+
+MAX_MESSAGE_BYTES = int(float(os.getenv("INGEST_MAX_MESSAGE_MB", "100")) * 1024 * 1024)
+MAX_PART_BYTES = int(float(os.getenv("MIME_PART_MAX_MB", "25")) * 1024 * 1024)
+MAX_TEXT_CHARS = int(os.getenv("MIME_TEXT_MAX_CHARS", "500000"))
+
+
+def iter_messages(source, max_message_bytes=MAX_MESSAGE_BYTES):
+    """Yield (email_id, raw bytes) one message at a time from a folder of .eml files, a Maildir or an mbox.
+
+    Only the current message is held in memory; messages larger than ``max_message_bytes``
+    are skipped. IDs are stable across runs so an interrupted batch can be resumed.
+    """
+    if os.path.isdir(source) and all(os.path.isdir(os.path.join(source, d)) for d in ("cur", "new")):
+        box = mailbox.Maildir(source, factory=None, create=False)
+        for key in sorted(box.keys()):
+            with box.get_file(key) as f:
+                f.seek(0, os.SEEK_END)
+                size = f.tell()
+            if size > max_message_bytes:
+                print(f"⚠️ Skipping maildir:{key}: larger than {max_message_bytes} bytes")
+                continue
+            yield f"maildir:{key}", box.get_bytes(key)
+    elif os.path.isdir(source):
+        for root, _, files in sorted(os.walk(source)):
+            for name in sorted(files):
+                if not name.lower().endswith(".eml"):
+                    continue
+                path = os.path.join(root, name)
+                email_id = os.path.relpath(path, source)
+                if os.path.getsize(path) > max_message_bytes:
+                    print(f"⚠️ Skipping {email_id}: larger than {max_message_bytes} bytes")
+                    continue
+                with open(path, "rb") as f:
+                    yield email_id, f.read()
+    else:
+        base = os.path.basename(source)
+        for index, raw in iter_mbox(source, max_message_bytes):
+            yield f"{base}#{index}", raw
+
+
+def iter_mbox(path, max_message_bytes=MAX_MESSAGE_BYTES):
+    """Stream an mbox file line by line, yielding (index, message bytes without the From_ line).
+
+    Unlike ``mailbox.mbox`` nothing is indexed up front, so multi-GB exports start at once.
+    Indexes match ``mailbox.mbox`` keys. Oversized messages are skipped without buffering them.
+    """
+    index = -1
+    lines = []
+    size = 0
+    oversized = False
+
+    def flush():
+        if index < 0:
+            return None
+        if oversized:
+            print(f"⚠️ Skipping {os.path.basename(path)}#{index}: larger than {max_message_bytes} bytes")
+            return None
+        raw = b"".join(lines)
+        # The blank line before the next From_ line belongs to the separator.
+        return raw[:-1] if raw.endswith(b"\n\n") else raw
+
+    with open(path, "rb") as f:
+        for line in f:
+            if line.startswith(b"From "):
+                raw = flush()
+                if raw is not None:
+                    yield index, raw
+                index += 1
+                lines, size, oversized = [], 0, False
+                continue
+            if oversized:
+                continue
+            size += len(line)
+            if size > max_message_bytes:
+                oversized, lines = True, []
+                continue
+            lines.append(line)
+    raw = flush()
+    if raw is not None:
+        yield index, raw
+
+
+def read_headers(raw_bytes):
+    """Parse only the header block; the body is never decoded."""
+    ends = [i for i in (raw_bytes.find(b"\n\n"), raw_bytes.find(b"\r\n\r\n")) if i >= 0]
+    head = raw_bytes[:min(ends) + 1] if ends else raw_bytes
+    return BytesHeaderParser(policy=policy.default).parsebytes(head)
+
+
+def encoded_size(part):
+    """Approximate decoded size of a leaf MIME part from its still-encoded payload."""
+    payload = part.get_payload()
+    if not isinstance(payload, (str, bytes)):
+        return 0
+    if part.get("Content-Transfer-Encoding", "").strip().lower() == "base64":
+        return len(payload) * 3 // 4
+    return len(payload)
+
+
+def decode_part(part, label=None, max_bytes=MAX_PART_BYTES):
+    """``part.get_payload(decode=True)`` unless the part would decode to more than ``max_bytes``."""
+    size = encoded_size(part)
+    if size > max_bytes:
+        print(f"⚠️ Skipping {label or part.get_content_type()}: ~{size} bytes exceeds part limit of {max_bytes}")
+        return None
+    return part.get_payload(decode=True)
+
+
+def part_text(part, max_chars=MAX_TEXT_CHARS):
+    """Decoded text of a text/* part, truncated to ``max_chars``.
+
+    Oversized parts are decoded only as far as the limit needs, never whole.
+    """
+    max_encoded = max_chars * 4
+    if encoded_size(part) <= max_encoded:
+        return part.get_content()[:max_chars]
+    print(f"⚠️ Truncating oversized {part.get_content_type()} body part to {max_chars} chars")
+    head = part.get_payload()[:max_encoded]
+    encoding = part.get("Content-Transfer-Encoding", "").strip().lower()
+    if encoding == "base64":
+        head = "".join(head.split())
+        data = base64.b64decode(head[:len(head) // 4 * 4])
+    elif encoding == "quoted-printable":
+        # Drop an escape sequence cut in half by the slice.
+        data = quopri.decodestring(re.sub(r"=[0-9A-Fa-f]?$", "", head).encode("ascii", "ignore"))
+    else:
+        # 7bit/8bit payloads come back already decoded with the part's charset.
+        return head[:max_chars]
+    try:
+        text = data.decode(part.get_content_charset() or "utf-8", errors="replace")
+    except LookupError:
+        text = data.decode("utf-8", errors="replace")
+    return text[:max_chars]
@@ -0,0 +1,169 @@
+import re
+import json
+
+TRAILING_COMMA = re.compile(r",(\s*[}\]])")
+QUOTED_NULLS = {"null", "None", "NULL"}
+
+
+def repair_json(text):
+    """Fix the syntax mistakes LLMs commonly make: trailing commas and missing closers."""
+    text = close_truncated(text)
+    # Trailing commas can only be removed once the closers exist.
+    return TRAILING_COMMA.sub(r"\1", text)
+
+
+def unquote_nulls(value):
+    """Turn "null" strings into real nulls, recursively."""
+    if isinstance(value, dict):
+        return {k: unquote_nulls(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [unquote_nulls(v) for v in value]
+    if isinstance(value, str) and value.strip() in QUOTED_NULLS:
+        return None
+    return value
+
+
+def close_truncated(text):
+    """Close a generation cut off mid-object, rewound to its last complete value.
+
+    A dangling key, a partial string or number and a trailing comma are dropped, then the
+    open brackets are closed.
+    """
+    stack = []
+    in_string = False
+    escape = False
+    expect_key = False
+    is_key = False
+    # End of the last complete value (or opener), and the closers needed there.
+    safe, closers = None, None
+    for i, ch in enumerate(text):
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+                if not is_key:
+                    safe, closers = i + 1, list(stack)
+        elif ch == '"':
+            in_string, is_key = True, expect_key
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+            expect_key = ch == "{"
+            safe, closers = i + 1, list(stack)
+        elif ch in "}]" and stack:
+            stack.pop()
+            safe, closers = i + 1, list(stack)
+        elif ch == ",":
+            # Whatever precedes a comma is complete, including numbers and literals.
+            safe, closers = i, list(stack)
+            expect_key = bool(stack) and stack[-1] == "}"
+        elif ch == ":":
+            expect_key = False
+    if not stack and not in_string:
+        return text
+    if safe is None:
+        return text
+    return text[:safe] + "".join(reversed(closers))
+
+
+def _loads(span, lenient):
+    try:
+        value = json.loads(span)
+    except ValueError:
+        if not lenient:
+            return None, False
+        try:
+            value = json.loads(repair_json(span))
+        except ValueError:
+            return None, False
+    return (unquote_nulls(value) if lenient else value), True
+
+
+class JSONStreamExtractor:
+    """Incrementally locate the first top-level JSON object in streamed text.
+
+    Feed chunks as they arrive; ``feed`` returns True as soon as a top-level value of type
+    ``root`` (any type if None) closes and decodes, after which the caller can stop
+    consuming the stream. Candidates that do not decode (e.g. braces in prose) are skipped
+    and scanning continues; a value of another type, such as a ``[1]`` in prose, is kept
+    and only returned by ``finish`` if nothing better follows.
+    """
+
+    def __init__(self, lenient=True, root=dict):
+        self.lenient = lenient
+        self.root = root
+        self.buffer = []
+        self.pos = 0
+        self.start = None
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.done = False
+        self.result = None
+        self.fallback = None
+        # Length of the fed text up to the end of the value, once found.
+        self.end = None
+
+    def feed(self, chunk):
+        if self.done:
+            return True
+        self.buffer.append(chunk)
+        text = "".join(self.buffer) if len(self.buffer) > 1 else chunk
+        self.buffer = [text]
+        i = self.pos
+        while i < len(text):
+            ch = text[i]
+            if self.start is None:
+                if ch in "{[":
+                    self.start, self.depth = i, 1
+            elif self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == '"':
+                self.in_string = True
+            elif ch in "{[":
+                self.depth += 1
+            elif ch in "}]":
+                self.depth -= 1
+                if self.depth == 0:
+                    value, ok = _loads(text[self.start:i + 1], self.lenient)
+                    if ok and (self.root is None or isinstance(value, self.root)):
+                        self.pos = self.end = i + 1
+                        self.done, self.result = True, value
+                        return True
+                    if ok:
+                        if self.fallback is None:
+                            self.fallback = value
+                        self.start = None
+                    else:
+                        # Not JSON after all; resume scanning right after the failed opener.
+                        i, self.start, self.in_string, self.escape = self.start, None, False, False
+            i += 1
+        self.pos = i
+        return False
+
+    def finish(self):
+        """Called at end of stream; salvages a truncated object when lenient, else the fallback."""
+        if self.done:
+            return self.result
+        if self.start is not None and self.lenient:
+            value, ok = _loads("".join(self.buffer)[self.start:], True)
+            if ok and (self.fallback is None or self.root is None or isinstance(value, self.root)):
+                self.done, self.result = True, value
+                return self.result
+        if self.fallback is not None:
+            self.done, self.result = True, self.fallback
+        return self.result
+
+
+def extract_json(text, lenient=True, root=dict):
+    """Return the first JSON object embedded in ``text``, else the first array (or None)."""
+    extractor = JSONStreamExtractor(lenient=lenient, root=root)
+    extractor.feed(text or "")
+    return extractor.result if extractor.done else extractor.finish()
@@ -1,9 +1,18 @@
 import os
 import json
-import boto3
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from cache import get_response_cache, hash_key, response_cache_enabled
+from prompt_builder import build_budgeted_prompt, estimate_tokens, DEFAULT_COMPACTION, DEFAULT_TOKEN_BUDGET
+from telemetry import classify_error, logger, record_event, stage
+from transport import acall_with_retries, call_with_retries, create_bedrock_client, stream_with_retries
 
-bedrock = boto3.client("bedrock-runtime", region_name=os.getenv("AWS_REGION", "us-east-1"))
 ANTHROPIC_VERSION = "bedrock-2023-05-31"
+EXTRACTION_TOOL_NAME = "record_extraction"
+# Output-token limit of every request; answers that reach it come back with stop_reason "max_tokens".
+MAX_OUTPUT_TOKENS = 4096
 
 CLAUDE_MODELS = [
     "anthropic.claude-3-haiku-20240307-v1:0",
@@ -13,90 +22,422 @@ LLAMA_MODELS = [
     "meta.llama3-3-70b-instruct-v1:0"
 ]
 
+# On-demand USD per 1K tokens (input, output), us-east-1.
+MODEL_PRICING = {
+    "anthropic.claude-3-haiku-20240307-v1:0": (0.00025, 0.00125),
+    "anthropic.claude-3-5-haiku-20241022-v1:0": (0.0008, 0.004),
+    "meta.llama3-3-70b-instruct-v1:0": (0.00072, 0.00072),
+}
+
+# Bedrock prompt caching: models that accept cache_control blocks, and the smallest prefix
+# worth marking (shorter prefixes are rejected by the API / never cached).
+PROMPT_CACHE_MODELS = set(filter(None, os.getenv(
+    "PROMPT_CACHE_MODELS", "anthropic.claude-3-5-haiku-20241022-v1:0"
+).split(",")))
+PROMPT_CACHE_MIN_TOKENS = int(os.getenv("PROMPT_CACHE_MIN_TOKENS", "2048"))
+PROMPT_CACHE_ENABLED = os.getenv("PROMPT_CACHE_DISABLED", "").lower() not in ("1", "true", "yes")
+# Relative to the input price: cache writes cost 25% more, cache reads 90% less.
+PROMPT_CACHE_WRITE_MULTIPLIER = 1.25
+PROMPT_CACHE_READ_MULTIPLIER = 0.1
+
 INFERENCE_PROFILE_ARN_MAP = {
     "anthropic.claude-3-5-haiku-20241022-v1:0": os.getenv("BEDROCK_INFERENCE_PROFILE_35"),
     "meta.llama3-3-70b-instruct-v1:0": os.getenv("BEDROCK_INFERENCE_PROFILE_LLAMA3")
 }
 
+_bedrock_client = None
+_bedrock_client_lock = threading.Lock()
+
+def get_bedrock_client():
+    """Create the pooled bedrock-runtime client (see transport.create_bedrock_client) on first use.
+
+    boto3 import and credential lookup are slow, so this is deferred until a call is made.
+    """
+    global _bedrock_client
+    if _bedrock_client is None:
+        with _bedrock_client_lock:
+            if _bedrock_client is None:
+                _bedrock_client = create_bedrock_client()
+    return _bedrock_client
+
+def __getattr__(name):
+    # Keep `llm.bedrock` working for existing callers without creating the client at import time.
+    if name == "bedrock":
+        return get_bedrock_client()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 def get_available_models():
     return CLAUDE_MODELS + LLAMA_MODELS
 
-def build_email_prompt(email_data: dict) -> str:
-    prompt = f"""=== EMAIL METADATA ===
-From: {email_data.get("from_address", "[missing]")}
-To: {email_data.get("to_address", "[missing]")}
-Subject: {email_data.get("subject", "")}
-Date: {email_data.get("date", "")}
-
-=== EMAIL BODY ===
-{email_data.get("text", "").strip()}
-
-=== ATTACHMENT CONTENT ===
-{email_data.get("attachment_text_summary", "").strip()}
-
-=== EMBEDDED IMAGE TEXT (OCR) ===
-{email_data.get("embedded_image_text", "").strip()}
-"""
-    print("\n========== DEBUG: FULL LLM PROMPT BEGIN ==========")
-    print(prompt)
-    print("=========== DEBUG: FULL LLM PROMPT END ============\n")
+def build_email_prompt(email_data: dict, token_budget: int = None, compact: bool = None) -> str:
+    with stage("prompt_build") as event:
+        prompt, report = build_budgeted_prompt(
+            email_data,
+            token_budget=DEFAULT_TOKEN_BUDGET if token_budget is None else token_budget,
+            compact=DEFAULT_COMPACTION if compact is None else compact,
+        )
+        event["prompt_tokens_est"] = report["total"]["final_tokens"]
+        event["dropped_tokens_est"] = report["total"]["dropped_tokens"]
+    logger.debug("Full LLM prompt:\n%s", prompt)
     return prompt
 
-def query_claude(prompt: str, model_id: str = None):
+def resolve_model_id(model_id: str = None):
     model_id = model_id or os.getenv("BEDROCK_MODEL_ID", CLAUDE_MODELS[0])
     profile_arn = INFERENCE_PROFILE_ARN_MAP.get(model_id)
-    effective_model_id = profile_arn or model_id
+    return model_id, profile_arn or model_id
 
-    print("\n================ Sending Prompt to Bedrock ================\n")
-    print(prompt[:1000] + ("\n... [truncated]" if len(prompt) > 1000 else ""))
-    print(f"\n🔍 Requested Model ID: {model_id}")
-    print(f"🧠 Effective Model/ARN Used: {effective_model_id}")
-    print("===========================================================\n")
+def use_prompt_cache(model_id: str, prefix: str):
+    return bool(prefix) and PROMPT_CACHE_ENABLED and model_id in PROMPT_CACHE_MODELS \
+        and estimate_tokens(prefix) >= PROMPT_CACHE_MIN_TOKENS
 
-    try:
-        if model_id in LLAMA_MODELS:
-            with open("llama_debug_prompt.txt", "w") as f:
-                f.write(prompt)
-            body = {
-                "prompt": f"[INST] {prompt} [/INST]",
-                "max_gen_len": 4096,
-                "temperature": 0,
-                "top_p": 0.9
-            }
-
-        elif model_id in CLAUDE_MODELS:
-            body = {
-                "anthropic_version": ANTHROPIC_VERSION,
-                "messages": [{"role": "user", "content": prompt}],
-                "max_tokens": 4096,
-                "temperature": 0,
-                "top_p": 0.9
-            }
-
-        else:
-            return {"extracted_data": f"[Unsupported model: {model_id}]"}
-
-        response = bedrock.invoke_model(
-            modelId=effective_model_id,
-            body=json.dumps(body),
-            contentType="application/json",
-            accept="application/json"
-        )
+def build_request_body(prompt: str, model_id: str, schema: dict = None, prefix: str = None):
+    """Model-specific request body.
+
+    With ``schema``, Claude is forced to answer through a single tool whose input schema is
+    the JSON Schema; Llama has no tool use on Bedrock, so the schema is appended to the prompt.
+    ``prefix`` is the part of the prompt shared across emails (instructions, few-shot
+    examples). On models with prompt caching it is sent as its own content block with a
+    cache checkpoint; otherwise it is simply prepended to ``prompt``.
+    """
+    if prefix and not use_prompt_cache(model_id, prefix):
+        prompt, prefix = prefix + prompt, None
+    if model_id in LLAMA_MODELS:
+        if schema is not None:
+            prompt += "\n\nReturn only a JSON object that validates against this JSON Schema:\n" + json.dumps(schema)
+        return {
+            "prompt": f"[INST] {prompt} [/INST]",
+            "max_gen_len": MAX_OUTPUT_TOKENS,
+            "temperature": 0,
+            "top_p": 0.9
+        }
+    if model_id in CLAUDE_MODELS:
+        content = prompt
+        if prefix:
+            content = [
+                {"type": "text", "text": prefix, "cache_control": {"type": "ephemeral"}},
+                {"type": "text", "text": prompt},
+            ]
+        body = {
+            "anthropic_version": ANTHROPIC_VERSION,
+            "messages": [{"role": "user", "content": content}],
+            "max_tokens": MAX_OUTPUT_TOKENS,
+            "temperature": 0,
+            "top_p": 0.9
+        }
+        if schema is not None:
+            body["tools"] = [{
+                "name": EXTRACTION_TOOL_NAME,
+                "description": "Record the data extracted from the email.",
+                "input_schema": schema,
+            }]
+            body["tool_choice"] = {"type": "tool", "name": EXTRACTION_TOOL_NAME}
+        return body
+    return None
+
+USAGE_HEADERS = {
+    "input_tokens": "x-amzn-bedrock-input-token-count",
+    "output_tokens": "x-amzn-bedrock-output-token-count",
+    "cache_read_tokens": "x-amzn-bedrock-cache-read-input-token-count",
+    "cache_write_tokens": "x-amzn-bedrock-cache-write-input-token-count",
+}
+
+def parse_usage(model_id: str, parsed: dict, headers: dict = None):
+    """Token counts from the response body, falling back to Bedrock's headers.
+
+    ``input_tokens`` excludes prompt-cache reads/writes, which are reported separately.
+    """
+    if model_id in CLAUDE_MODELS:
+        usage = parsed.get("usage") or {}
+        counts = {
+            "input_tokens": usage.get("input_tokens"),
+            "output_tokens": usage.get("output_tokens"),
+            "cache_read_tokens": usage.get("cache_read_input_tokens"),
+            "cache_write_tokens": usage.get("cache_creation_input_tokens"),
+        }
+    else:
+        counts = {
+            "input_tokens": parsed.get("prompt_token_count"),
+            "output_tokens": parsed.get("generation_token_count"),
+            "cache_read_tokens": None,
+            "cache_write_tokens": None,
+        }
+    headers = headers or {}
+    for key, header in USAGE_HEADERS.items():
+        if counts[key] is None and header in headers:
+            counts[key] = int(headers[header])
+    return {key: value or 0 for key, value in counts.items()}
+
+def estimate_cost(model_id: str, usage: dict):
+    input_price, output_price = MODEL_PRICING.get(model_id, (0.0, 0.0))
+    input_cost = (
+        usage.get("input_tokens", 0)
+        + usage.get("cache_write_tokens", 0) * PROMPT_CACHE_WRITE_MULTIPLIER
+        + usage.get("cache_read_tokens", 0) * PROMPT_CACHE_READ_MULTIPLIER
+    ) / 1000 * input_price
+    return input_cost + usage.get("output_tokens", 0) / 1000 * output_price
+
+def parse_response_text(model_id: str, parsed: dict):
+    if model_id in CLAUDE_MODELS:
+        # A forced tool call comes back as a tool_use block; its input is the extracted JSON.
+        for block in parsed["content"]:
+            if block.get("type") == "tool_use":
+                return json.dumps(block.get("input", {}))
+        return parsed["content"][0].get("text", "").strip()
+    if model_id in LLAMA_MODELS:
+        return parsed.get("generation", "").strip()
+    return "[ERROR] Unexpected model response format"
+
+def parse_stop_reason(model_id: str, parsed: dict):
+    """Why generation ended; Llama's "length" is reported as "max_tokens" like Claude's."""
+    reason = parsed.get("stop_reason")
+    return "max_tokens" if model_id in LLAMA_MODELS and reason == "length" else reason
+
+def _invoke_model(effective_model_id: str, serialized_body: str):
+    response = get_bedrock_client().invoke_model(
+        modelId=effective_model_id,
+        body=serialized_body,
+        contentType="application/json",
+        accept="application/json"
+    )
+    # Read inside the retried call so a timeout while reading the body is retried too.
+    parsed = json.loads(response["body"].read())
+    return parsed, response.get("ResponseMetadata", {}).get("HTTPHeaders", {})
+
+def _prepare_call(prompt: str, model_id: str, use_cache: bool, schema: dict = None, prefix: str = None):
+    body = build_request_body(prompt, model_id, schema, prefix)
+    if body is None:
+        return None, None, None
+    serialized_body = json.dumps(body)
+    cache = get_response_cache() if use_cache and response_cache_enabled() else None
+    return serialized_body, cache, hash_key(resolve_model_id(model_id)[1], serialized_body, ANTHROPIC_VERSION)
+
+def _finish_call(model_id: str, parsed: dict, headers: dict, cache, cache_key: str, event: dict):
+    text_response = parse_response_text(model_id, parsed)
+    usage = parse_usage(model_id, parsed, headers)
+    event.update(usage)
+    event["cached"] = False
+    logger.debug("Model %s response:\n%s", model_id, text_response)
 
-        response_body = response["body"].read()
-        parsed = json.loads(response_body)
+    result = {"extracted_data": text_response, "usage": usage, "stop_reason": parse_stop_reason(model_id, parsed)}
+    if cache is not None:
+        cache.set(cache_key, result)
+    return result
 
-        if model_id in CLAUDE_MODELS:
-            text_response = parsed["content"][0].get("text", "").strip()
-        elif model_id in LLAMA_MODELS:
-            text_response = parsed.get("generation", "").strip()
-        else:
-            text_response = "[ERROR] Unexpected model response format"
+def _call_failed(model_id: str, e: Exception, event: dict):
+    event["status"] = "error"
+    event["error_type"] = classify_error(e)
+    event["error"] = f"{type(e).__name__}: {e}"
+    logger.error("❌ Bedrock call failed for model %s: %s - %s", model_id, type(e).__name__, e)
+    return {"extracted_data": f"[LLM Error: {type(e).__name__}] {e}"}
 
-        print("✅ Model responded successfully.\n")
-        print(text_response[:1000])
-        return {"extracted_data": text_response}
+def query_claude(prompt: str, model_id: str = None, use_cache: bool = True, schema: dict = None,
+                 prefix: str = None):
+    """Single model call; the prompt sent is ``prefix + prompt``.
 
+    With ``schema``, ``extracted_data`` is the tool-use JSON; ``prefix`` is the shared,
+    prompt-cacheable part of the prompt (see build_request_body). ``stop_reason`` is
+    "max_tokens" when the answer was cut off at MAX_OUTPUT_TOKENS.
+    """
+    model_id, effective_model_id = resolve_model_id(model_id)
+    logger.debug("Sending prompt to %s (effective %s):\n%s%s", model_id, effective_model_id, prefix or "", prompt)
+
+    with stage("model_call", model_id=model_id, streaming=False, structured=schema is not None) as event:
+        try:
+            serialized_body, cache, cache_key = _prepare_call(prompt, model_id, use_cache, schema, prefix)
+            if serialized_body is None:
+                event["status"] = "error"
+                event["error_type"] = "validation"
+                return {"extracted_data": f"[Unsupported model: {model_id}]"}
+
+            if cache is not None:
+                cached = cache.get(cache_key)
+                if cached is not None:
+                    logger.info("⚡ Cache hit for model %s", model_id)
+                    event["cached"] = True
+                    return {**cached, "cached": True}
+
+            parsed, headers = call_with_retries(
+                lambda: _invoke_model(effective_model_id, serialized_body), model_id, event
+            )
+            return _finish_call(model_id, parsed, headers, cache, cache_key, event)
+
+        except Exception as e:
+            return _call_failed(model_id, e, event)
+
+async def aquery_claude(prompt: str, model_id: str = None, use_cache: bool = True, prefix: str = None):
+    """asyncio-native query_claude: same request, cache and result shape.
+
+    Concurrency limits and backoff sleeps are awaited on the event loop, so thousands of
+    pending calls cost no threads; only in-flight HTTP requests occupy worker threads.
+    """
+    model_id, effective_model_id = resolve_model_id(model_id)
+
+    with stage("model_call", model_id=model_id, streaming=False, asynchronous=True) as event:
+        try:
+            serialized_body, cache, cache_key = _prepare_call(prompt, model_id, use_cache, prefix=prefix)
+            if serialized_body is None:
+                event["status"] = "error"
+                event["error_type"] = "validation"
+                return {"extracted_data": f"[Unsupported model: {model_id}]"}
+
+            if cache is not None:
+                cached = cache.get(cache_key)
+                if cached is not None:
+                    event["cached"] = True
+                    return {**cached, "cached": True}
+
+            parsed, headers = await acall_with_retries(
+                lambda: _invoke_model(effective_model_id, serialized_body), model_id, event
+            )
+            return _finish_call(model_id, parsed, headers, cache, cache_key, event)
+
+        except Exception as e:
+            return _call_failed(model_id, e, event)
+
+def query_all_models(prompt: str, model_ids: list = None, use_cache: bool = True, prefix: str = None):
+    """Send the same prompt to several models concurrently.
+
+    Returns one row per model with the output, wall-clock latency, token usage and estimated cost.
+    """
+    model_ids = model_ids or get_available_models()
+
+    def run(model_id):
+        started = time.perf_counter()
+        result = query_claude(prompt, model_id=model_id, use_cache=use_cache, prefix=prefix)
+        usage = result.get("usage") or {"input_tokens": 0, "output_tokens": 0}
+        return {
+            "model_id": model_id,
+            "extracted_data": result["extracted_data"],
+            "latency_sec": round(time.perf_counter() - started, 3),
+            "input_tokens": usage["input_tokens"],
+            "output_tokens": usage["output_tokens"],
+            "cache_read_tokens": usage.get("cache_read_tokens", 0),
+            "cache_write_tokens": usage.get("cache_write_tokens", 0),
+            "cost_usd": 0.0 if result.get("cached") else round(estimate_cost(model_id, usage), 6),
+        }
+
+    with ThreadPoolExecutor(max_workers=len(model_ids)) as pool:
+        return list(pool.map(run, model_ids))
+
+def query_claude_stream(prompt: str, model_id: str = None, use_cache: bool = True, stats: dict = None,
+                        prefix: str = None, stop=None):
+    """Yield the model's answer incrementally via invoke_model_with_response_stream.
+
+    If ``stats`` is given it is filled with ``ttft_sec``, ``total_sec``, ``cached`` and token usage.
+    Closing the generator early (e.g. ``break``) cancels the generation and caches nothing.
+    ``stop(chunk)`` is called with each piece of text and returns None to continue, or the
+    length of the complete answer so far: the output is cut there, the generation cancelled,
+    and the answer cached with the usage seen up to that point.
+    """
+    model_id, effective_model_id = resolve_model_id(model_id)
+    stats = stats if stats is not None else {}
+    stats.update({"model_id": model_id, "ttft_sec": None, "total_sec": None, "cached": False})
+    event = {"stage": "model_call", "model_id": model_id, "streaming": True}
+    started = time.perf_counter()
+
+    body = build_request_body(prompt, model_id, prefix=prefix)
+    if body is None:
+        yield f"[Unsupported model: {model_id}]"
+        return
+
+    serialized_body = json.dumps(body)
+    cache = get_response_cache() if use_cache and response_cache_enabled() else None
+    cache_key = hash_key(effective_model_id, serialized_body, ANTHROPIC_VERSION)
+    if cache is not None:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            logger.info("⚡ Cache hit for model %s", model_id)
+            stats.update({"cached": True, "ttft_sec": time.perf_counter() - started})
+            text = cached["extracted_data"]
+            end = stop(text) if stop is not None else None
+            yield text if end is None else text[:end]
+            stats["total_sec"] = time.perf_counter() - started
+            record_event({**event, "status": "ok", "cached": True, "duration_ms": round(stats["total_sec"] * 1000, 2)})
+            return
+
+    logger.debug("Streaming prompt to %s (effective %s):\n%s%s", model_id, effective_model_id, prefix or "", prompt)
+    pieces = []
+    events = None
+    completed = False
+    stopped = False
+    try:
+        events = stream_with_retries(
+            lambda: get_bedrock_client().invoke_model_with_response_stream(
+                modelId=effective_model_id,
+                body=serialized_body,
+                contentType="application/json",
+                accept="application/json"
+            )["body"],
+            model_id,
+            event,
+            # Once text has been yielded a retry would repeat it, so only retry before that.
+            delivered=lambda: bool(pieces),
+        )
+        for stream_event in events:
+            chunk = stream_event.get("chunk")
+            if not chunk:
+                continue
+            payload = json.loads(chunk["bytes"])
+            metrics = payload.get("amazon-bedrock-invocationMetrics")
+            if metrics:
+                stats["input_tokens"] = metrics.get("inputTokenCount", 0)
+                stats["output_tokens"] = metrics.get("outputTokenCount", 0)
+                stats.setdefault("cache_read_tokens", metrics.get("cacheReadInputTokenCount", 0))
+                stats.setdefault("cache_write_tokens", metrics.get("cacheWriteInputTokenCount", 0))
+            if payload.get("type") == "message_start":
+                start_usage = payload.get("message", {}).get("usage", {})
+                stats["input_tokens"] = start_usage.get("input_tokens", 0)
+                stats["cache_read_tokens"] = start_usage.get("cache_read_input_tokens", 0)
+                stats["cache_write_tokens"] = start_usage.get("cache_creation_input_tokens", 0)
+            if payload.get("type") == "message_delta" and "output_tokens" in payload.get("usage", {}):
+                stats["output_tokens"] = payload["usage"]["output_tokens"]
+            if payload.get("prompt_token_count") is not None:
+                stats["input_tokens"] = payload["prompt_token_count"]
+            if payload.get("generation_token_count") is not None:
+                stats["output_tokens"] = payload["generation_token_count"]
+            if model_id in CLAUDE_MODELS:
+                text = payload.get("delta", {}).get("text", "") if payload.get("type") == "content_block_delta" else ""
+            else:
+                text = payload.get("generation") or ""
+            if not text:
+                continue
+            if stats["ttft_sec"] is None:
+                stats["ttft_sec"] = time.perf_counter() - started
+            end = stop(text) if stop is not None else None
+            if end is not None:
+                text = text[:max(0, end - sum(len(piece) for piece in pieces))]
+            pieces.append(text)
+            yield text
+            if end is not None:
+                logger.info("⏹️ Answer complete for %s, stopping generation", model_id)
+                stopped = True
+                break
+        if stopped:
+            # The final usage metrics never arrive after a cancel; estimate the output kept.
+            stats.setdefault("output_tokens", estimate_tokens("".join(pieces)))
+            event["stopped_early"] = True
+        completed = True
+        event["status"] = "ok"
     except Exception as e:
-        print(f"❌ Bedrock call failed for model {model_id}: {type(e).__name__} - {e}")
-        return {"extracted_data": f"[LLM Error: {type(e).__name__}] {e}"}
+        event.update({"status": "error", "error_type": classify_error(e), "error": f"{type(e).__name__}: {e}"})
+        logger.error("❌ Bedrock stream failed for model %s: %s - %s", model_id, type(e).__name__, e)
+        yield f"[LLM Error: {type(e).__name__}] {e}"
+    finally:
+        if events is not None:
+            events.close()
+        stats["total_sec"] = time.perf_counter() - started
+        event.setdefault("status", "cancelled")
+        record_event({
+            **event,
+            "cached": False,
+            "ttft_ms": round(stats["ttft_sec"] * 1000, 2) if stats["ttft_sec"] is not None else None,
+            "duration_ms": round(stats["total_sec"] * 1000, 2),
+            "input_tokens": stats.get("input_tokens"),
+            "output_tokens": stats.get("output_tokens"),
+            "cache_read_tokens": stats.get("cache_read_tokens"),
+            "cache_write_tokens": stats.get("cache_write_tokens"),
+        })
+
+    if cache is not None and completed:
+        usage = {key: stats.get(key, 0) for key in USAGE_HEADERS}
+        cache.set(cache_key, {"extracted_data": "".join(pieces).strip(), "usage": usage})
@@ -0,0 +1,120 @@
+import os
+import hashlib
+from io import BytesIO
+
+from cache import get_ocr_cache, hash_key
+
+# Images below these limits are spacers, tracking pixels, bullets or icons: never worth OCR.
+OCR_MIN_IMAGE_BYTES = int(os.getenv("OCR_MIN_IMAGE_BYTES", "2048"))
+OCR_MIN_DIMENSION = int(os.getenv("OCR_MIN_DIMENSION", "32"))
+OCR_MIN_PIXELS = int(os.getenv("OCR_MIN_PIXELS", "10000"))
+# Re-encoded copies of the same image (e.g. a logo re-compressed by a mail gateway) share a
+# perceptual hash; enable to serve them from the cache too.
+# Only applied to images up to OCR_PERCEPTUAL_MAX_PIXELS: large scans of different documents
+# from the same template can share a coarse hash.
+OCR_PERCEPTUAL_HASH = os.getenv("OCR_PERCEPTUAL_HASH", "").lower() in ("1", "true", "yes")
+OCR_PERCEPTUAL_MAX_PIXELS = int(os.getenv("OCR_PERCEPTUAL_MAX_PIXELS", "250000"))
+# Optional file of SHA-256 hashes (one per line) of images that should never be OCRed.
+OCR_SKIP_LIST = os.getenv("OCR_SKIP_LIST")
+OCR_PDF_DPI = int(os.getenv("OCR_PDF_DPI", "150"))
+OCR_PDF_MAX_PAGES = int(os.getenv("OCR_PDF_MAX_PAGES", "20"))
+
+_skip_hashes = None
+
+
+def skip_hashes():
+    global _skip_hashes
+    if _skip_hashes is None:
+        _skip_hashes = set()
+        if OCR_SKIP_LIST and os.path.exists(OCR_SKIP_LIST):
+            with open(OCR_SKIP_LIST, "r", encoding="utf-8") as f:
+                _skip_hashes = {line.split("#")[0].strip().lower() for line in f} - {""}
+    return _skip_hashes
+
+
+def tesseract(require_cmd=True):
+    """pytesseract configured with TESSERACT_CMD; None when it is required but not set."""
+    tess_cmd = os.getenv("TESSERACT_CMD")
+    if not tess_cmd and require_cmd:
+        print("⚠️ Warning: TESSERACT_CMD not set — OCR will not work")
+        return None
+    import pytesseract
+    if tess_cmd:
+        pytesseract.pytesseract.tesseract_cmd = tess_cmd
+    return pytesseract
+
+
+def difference_hash(image, size=8):
+    """64-bit dHash: stable across re-encoding, resizing and small compression artifacts."""
+    from PIL import Image
+    pixels = list(image.convert("L").resize((size + 1, size), Image.LANCZOS).getdata())
+    bits = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            bits = (bits << 1) | (left > pixels[row * (size + 1) + col + 1])
+    return f"{bits:016x}"
+
+
+def is_decorative(image):
+    width, height = image.size
+    return min(width, height) < OCR_MIN_DIMENSION or width * height < OCR_MIN_PIXELS
+
+
+def ocr_image(image_bytes):
+    """OCR one image, served from the content-hash cache whenever the same pixels were seen before."""
+    if not image_bytes or len(image_bytes) < OCR_MIN_IMAGE_BYTES:
+        return ""
+    digest = hashlib.sha256(image_bytes).hexdigest()
+    if digest in skip_hashes():
+        return ""
+    cache = get_ocr_cache()
+    key = hash_key("ocr_image", digest)
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+    try:
+        from PIL import Image
+        image = Image.open(BytesIO(image_bytes))
+        if is_decorative(image):
+            text = ""
+        else:
+            perceptual_key = None
+            if OCR_PERCEPTUAL_HASH and image.size[0] * image.size[1] <= OCR_PERCEPTUAL_MAX_PIXELS:
+                perceptual_key = hash_key("ocr_image_dhash", difference_hash(image))
+            text = cache.get(perceptual_key) if cache is not None and perceptual_key else None
+            if text is None:
+                pytesseract = tesseract()
+                if pytesseract is None:
+                    return ""
+                text = pytesseract.image_to_string(image)
+                if cache is not None and perceptual_key:
+                    cache.set(perceptual_key, text)
+    except Exception as e:
+        print(f"⚠️ OCR failed: {e}")
+        return ""
+
+    # Empty results are cached too, so decorative images are only ever inspected once.
+    if cache is not None:
+        cache.set(key, text)
+    return text
+
+
+def ocr_pdf_page(data, page_number, dpi=OCR_PDF_DPI, digest=None):
+    """Rasterize and OCR a single PDF page, cached per (document, page, dpi)."""
+    cache = get_ocr_cache()
+    key = hash_key("ocr_pdf_page", digest or hashlib.sha256(data).hexdigest(), page_number, dpi)
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+    pytesseract = tesseract(require_cmd=False)
+    from pdf2image import convert_from_bytes
+    images = convert_from_bytes(data, dpi=dpi, first_page=page_number, last_page=page_number, grayscale=True)
+    text = "\n".join(pytesseract.image_to_string(img) for img in images)
+    if cache is not None:
+        cache.set(key, text)
+    return text
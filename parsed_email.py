@@ -0,0 +1,184 @@
+import sys
+import zlib
+import base64
+import hashlib
+from collections.abc import Mapping
+
+
+class ParsedEmail(Mapping):
+    """A parsed email with lazily computed derived fields.
+
+    HTML is kept zlib-compressed, the HTML→text conversion runs on first access to
+    ``text``, and attachment/OCR extraction runs (all jobs at once, so they still fan out
+    to the process pool) on first access to ``attachment_text_summary`` or
+    ``embedded_image_text``; the decoded payloads are dropped afterwards.
+
+    It is read-only and dict-compatible (``email["text"]``, ``.get()``, ``.keys()``), so
+    callers written against the old parser dicts keep working.
+    """
+
+    FIELDS = (
+        "from_address", "to_address", "subject", "date", "text", "html",
+        "attachments", "embedded_images", "attachment_text_summary", "embedded_image_text",
+    )
+
+    __slots__ = (
+        "from_address", "to_address", "subject", "date", "attachments", "embedded_images",
+        "_text", "_html_z", "_jobs", "_attachment_text_summary", "_embedded_image_text", "prompt_memo",
+        "payload_digests", "_on_complete",
+    )
+
+    def __init__(self, from_address="", to_address="", subject="", date="", text="", html="",
+                 attachments=None, embedded_images=None, jobs=None,
+                 attachment_text_summary="", embedded_image_text="", payload_digests=None):
+        self.from_address = from_address
+        self.to_address = to_address
+        self.subject = subject
+        self.date = date
+        self.attachments = attachments or []
+        self.embedded_images = embedded_images or []
+        self._html_z = zlib.compress(html.encode("utf-8")) if html else b""
+        # None means "derive from HTML on first access".
+        self._text = text if text or not html else None
+        self._jobs = jobs or None
+        # SHA-256 of each attachment/image payload: identifies attachment content without extracting it.
+        self.payload_digests = payload_digests if payload_digests is not None else [
+            hashlib.sha256(job[3]).hexdigest() for job in jobs or ()
+        ]
+        self._attachment_text_summary = attachment_text_summary
+        self._embedded_image_text = embedded_image_text
+        # build_budgeted_prompt results keyed by (token_budget, compact); saves work on reruns.
+        self.prompt_memo = {}
+        self._on_complete = None
+
+    @property
+    def html(self):
+        return zlib.decompress(self._html_z).decode("utf-8") if self._html_z else ""
+
+    @property
+    def text(self):
+        if self._text is None:
+            from bs4 import BeautifulSoup
+            self._text = BeautifulSoup(self.html, "html5lib").get_text().strip()
+            self._check_complete()
+        return self._text
+
+    @property
+    def attachment_text_summary(self):
+        self._run_extraction()
+        return self._attachment_text_summary
+
+    @property
+    def embedded_image_text(self):
+        self._run_extraction()
+        return self._embedded_image_text
+
+    @property
+    def extraction_pending(self):
+        return self._jobs is not None
+
+    def _run_extraction(self):
+        jobs = self._jobs
+        if jobs is None:
+            return
+        from email_parser import run_extraction_jobs
+
+        attachment_texts = []
+        image_ocr_texts = []
+        for (kind, filename, _, _), text in zip(jobs, run_extraction_jobs(jobs)):
+            if not text:
+                continue
+            if kind == "image":
+                image_ocr_texts.append(text)
+            else:
+                attachment_texts.append(f"[{filename}]\n{text}")
+        self._attachment_text_summary = "\n\n".join(attachment_texts)
+        self._embedded_image_text = "\n\n".join(image_ocr_texts)
+        self._jobs = None
+        self._check_complete()
+
+    def on_complete(self, callback):
+        """Call ``callback(self)`` once every lazy field has been computed (now, if they already are)."""
+        self._on_complete = callback
+        self._check_complete()
+
+    def _check_complete(self):
+        callback = self._on_complete
+        if callback is None or self._text is None or self._jobs is not None:
+            return
+        self._on_complete = None
+        callback(self)
+
+    def materialize(self):
+        """Compute every lazy field now (e.g. before handing the object to another thread)."""
+        self._run_extraction()
+        return self.text
+
+    # Mapping protocol
+    def __getitem__(self, key):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __iter__(self):
+        return iter(self.FIELDS)
+
+    def __len__(self):
+        return len(self.FIELDS)
+
+    def __repr__(self):
+        return f"ParsedEmail(from={self.from_address!r}, subject={self.subject!r}, attachments={len(self.attachments)})"
+
+    def to_dict(self, compact=False):
+        """Plain JSON-safe dict with every field computed; ``compact`` stores HTML compressed."""
+        data = {
+            "from_address": self.from_address,
+            "to_address": self.to_address,
+            "subject": self.subject,
+            "date": self.date,
+            "text": self.text,
+            "attachments": self.attachments,
+            "embedded_images": self.embedded_images,
+            "attachment_text_summary": self.attachment_text_summary,
+            "embedded_image_text": self.embedded_image_text,
+            "payload_digests": self.payload_digests,
+        }
+        if compact:
+            data["html_z"] = base64.b64encode(self._html_z).decode("ascii")
+        else:
+            data["html"] = self.html
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        email_data = cls(
+            from_address=data.get("from_address", ""),
+            to_address=data.get("to_address", ""),
+            subject=data.get("subject", ""),
+            date=data.get("date", ""),
+            text=data.get("text", ""),
+            html=data.get("html", ""),
+            attachments=data.get("attachments"),
+            embedded_images=data.get("embedded_images"),
+            attachment_text_summary=data.get("attachment_text_summary", ""),
+            embedded_image_text=data.get("embedded_image_text", ""),
+            payload_digests=data.get("payload_digests"),
+        )
+        if "html_z" in data:
+            email_data._html_z = base64.b64decode(data["html_z"])
+        return email_data
+
+    def footprint(self):
+        """Approximate bytes held per field, including payloads still waiting for extraction."""
+        sizes = {
+            "headers": sum(sys.getsizeof(v) for v in (self.from_address, self.to_address, self.subject, self.date)),
+            "text": sys.getsizeof(self._text) if self._text is not None else 0,
+            "html_compressed": sys.getsizeof(self._html_z),
+            "attachments": sys.getsizeof(self._attachment_text_summary)
+            + sum(sys.getsizeof(a.get("filename") or "") for a in self.attachments),
+            "embedded_image_text": sys.getsizeof(self._embedded_image_text),
+            "pending_payloads": sum(len(job[3]) for job in self._jobs or ()),
+            "prompt_memo": sum(sys.getsizeof(prompt) for prompt, _ in self.prompt_memo.values()),
+        }
+        sizes["total"] = sum(sizes.values()) + sys.getsizeof(self)
+        return sizes
@@ -0,0 +1,242 @@
+import os
+import re
+
+# Rough chars-per-token for English/business text on Claude and Llama tokenizers.
+CHARS_PER_TOKEN = 4
+
+# Sections are truncated from the highest number down; metadata is never truncated.
+SECTION_PRIORITY = {"metadata": 0, "body": 1, "attachment": 2, "ocr": 3}
+MIN_SECTION_TOKENS = 64
+DEDUPE_MIN_LINE_LENGTH = 25
+
+DEFAULT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "0")) or None
+DEFAULT_COMPACTION = os.getenv("PROMPT_COMPACTION", "").lower() in ("1", "true", "yes")
+
+# A mail client's attribution line ("On <date>, <sender> wrote:") carries a date, a time or
+# an address; a body sentence that merely starts with "On" and ends in "wrote:" does not.
+MONTH = r"(Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)[a-z]*\.?"
+ATTRIBUTION_SHAPE = (
+    rf"(\d{{1,4}}[/.-]\d{{1,2}}[/.-]\d{{1,4}}|\d{{1,2}}:\d{{2}}|\b{MONTH} \d{{1,2}}\b|\b\d{{1,2}} {MONTH}|"
+    r"[\w.+-]+@[\w-]+\.[\w.-]+)"
+)
+QUOTED_REPLY_MARKERS = [
+    re.compile(r"^-{2,}\s*Original Message\s*-{2,}\s*$", re.IGNORECASE),
+    re.compile(rf"^On (?=.{{0,200}}{ATTRIBUTION_SHAPE}).{{5,200}}wrote:\s*$", re.IGNORECASE),
+]
+# Outlook separates the quoted message with a line of underscores, but only a From:/Sent:
+# block right after it makes it a reply marker rather than a plain separator.
+UNDERSCORE_SEPARATOR = re.compile(r"^_{10,}\s*$")
+REPLY_HEADER = re.compile(r"^(From|Sent):\s", re.IGNORECASE)
+FORWARD_MARKER = re.compile(r"^-{2,}\s*Forwarded message\s*-{2,}\s*$", re.IGNORECASE)
+FORWARD_HEADER = re.compile(r"^(From|Sent|Date|To|Cc|Subject):\s", re.IGNORECASE)
+SIGNATURE_MARKER = re.compile(r"^(--|__)\s*$")
+FOOTER_PATTERNS = re.compile(
+    r"(confidential|intended (solely )?for the (use of the )?(addressee|recipient)|"
+    r"privileged|unsubscribe|do not reply to this (e-?mail|message)|"
+    r"if you (have )?received this (e-?mail|message) in error)",
+    re.IGNORECASE,
+)
+SENTENCE_BREAK = re.compile(r"(?<=[.!?])\s+")
+ATTACHMENT_HEADER = re.compile(r"(?m)^\[[^\]\n]+\]$")
+EMAIL_PLACEHOLDER = "{email_data}"
+
+
+def estimate_tokens(text):
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN if text else 0
+
+
+def strip_quoted_replies(text):
+    """Drop the quoted reply chain and forwarded-message header blocks."""
+    kept = []
+    in_forward_header = False
+    lines = text.splitlines()
+    for i, line in enumerate(lines):
+        stripped = line.strip()
+        if any(marker.match(stripped) for marker in QUOTED_REPLY_MARKERS):
+            break
+        if UNDERSCORE_SEPARATOR.match(stripped):
+            following = next((l.strip() for l in lines[i + 1:] if l.strip()), "")
+            if REPLY_HEADER.match(following):
+                break
+        if stripped.startswith(">"):
+            continue
+        if FORWARD_MARKER.match(stripped):
+            in_forward_header = True
+            continue
+        if in_forward_header:
+            if FORWARD_HEADER.match(stripped):
+                continue
+            if not stripped:
+                in_forward_header = False
+                continue
+            in_forward_header = False
+        kept.append(line)
+    return "\n".join(kept)
+
+
+def strip_footer_lines(lines):
+    """Drop legal/unsubscribe boilerplate lines from the end of the email.
+
+    Only the trailing run of such lines goes, and a line that also carries content keeps
+    its other sentences; the scan stops at the first line with anything else on it.
+    """
+    end = len(lines)
+    while end and (not lines[end - 1].strip() or FOOTER_PATTERNS.search(lines[end - 1])):
+        line = lines[end - 1]
+        end -= 1
+        if not line.strip():
+            continue
+        rest = " ".join(s for s in SENTENCE_BREAK.split(line.strip()) if not FOOTER_PATTERNS.search(s))
+        if rest:
+            return lines[:end] + [rest]
+    return lines[:end]
+
+
+def strip_signature_and_footer(text):
+    """Cut at a `-- ` signature separator and drop trailing legal/unsubscribe boilerplate."""
+    lines = text.splitlines()
+    for i, line in enumerate(lines):
+        if SIGNATURE_MARKER.match(line.rstrip()):
+            lines = lines[:i]
+            break
+    return "\n".join(strip_footer_lines(lines))
+
+
+def dedupe_lines(text):
+    """Remove repeated long lines (page headers/footers, repeated OCR banners).
+
+    Short lines are kept even when repeated since they are often legitimate table rows.
+    """
+    seen = set()
+    kept = []
+    for line in text.splitlines():
+        key = " ".join(line.split()).lower()
+        if len(key) >= DEDUPE_MIN_LINE_LENGTH:
+            if key in seen:
+                continue
+            seen.add(key)
+        kept.append(line)
+    return "\n".join(kept)
+
+
+def compact_text(text, is_body=False):
+    if is_body:
+        text = strip_quoted_replies(text)
+        text = strip_signature_and_footer(text)
+    text = dedupe_lines(text)
+    return re.sub(r"\n{3,}", "\n\n", text).strip()
+
+
+def truncate_to_tokens(text, max_tokens):
+    """Cut ``text`` to ``max_tokens``, counting the truncation marker it ends with."""
+    tokens = estimate_tokens(text)
+    if tokens <= max_tokens:
+        return text
+    marker = f"\n[... truncated ~{tokens - max_tokens} tokens]"
+    return text[:max(0, max_tokens * CHARS_PER_TOKEN - len(marker))].rstrip() + marker
+
+
+def split_attachments(summary):
+    """Split attachment_text_summary back into per-attachment blocks (each starts with `[filename]`)."""
+    starts = [m.start() for m in ATTACHMENT_HEADER.finditer(summary)]
+    if not starts or starts[0] != 0:
+        starts = [0] + starts
+    return [summary[a:b].strip() for a, b in zip(starts, starts[1:] + [len(summary)]) if summary[a:b].strip()]
+
+
+def split_prompt_template(template, email_section):
+    """Fill ``{email_data}`` and return ``(prefix, rest)`` with ``prefix + rest`` the full prompt.
+
+    ``prefix`` is everything before the first placeholder, i.e. the instructions and examples
+    that are identical for every email, so it can be sent as a prompt-cache checkpoint.
+    """
+    prefix, placeholder, tail = template.partition(EMAIL_PLACEHOLDER)
+    if not placeholder:
+        return "", template
+    return prefix, email_section + tail.replace(EMAIL_PLACEHOLDER, email_section)
+
+
+def render_prompt(metadata, body, attachments, ocr):
+    attachment_text = "\n\n".join(attachments)
+    return f"""{metadata}
+
+=== EMAIL BODY ===
+{body}
+
+=== ATTACHMENT CONTENT ===
+{attachment_text}
+
+=== EMBEDDED IMAGE TEXT (OCR) ===
+{ocr}
+"""
+
+
+def build_budgeted_prompt(email_data, token_budget=DEFAULT_TOKEN_BUDGET, compact=DEFAULT_COMPACTION):
+    """Assemble the email section of a prompt within ``token_budget`` tokens.
+
+    Returns ``(prompt, report)`` where ``report`` maps each section to its original,
+    compacted and final token counts plus the tokens dropped. Results are memoized on
+    ``email_data.prompt_memo`` when present (ParsedEmail), so Streamlit reruns are free.
+    """
+    memo = getattr(email_data, "prompt_memo", None)
+    if memo is not None and (token_budget, compact) in memo:
+        return memo[(token_budget, compact)]
+
+    metadata = f"""=== EMAIL METADATA ===
+From: {email_data.get("from_address", "[missing]")}
+To: {email_data.get("to_address", "[missing]")}
+Subject: {email_data.get("subject", "")}
+Date: {email_data.get("date", "")}"""
+
+    attachment_summary = email_data.get("attachment_text_summary", "").strip()
+    sections = [("metadata", "metadata", metadata)]
+    sections.append(("body", "body", email_data.get("text", "").strip()))
+    for i, block in enumerate(split_attachments(attachment_summary)):
+        sections.append((f"attachment[{i}]", "attachment", block))
+    sections.append(("ocr", "ocr", email_data.get("embedded_image_text", "").strip()))
+
+    report = {}
+    texts = {}
+    for name, kind, text in sections:
+        original = estimate_tokens(text)
+        if compact and kind != "metadata":
+            text = compact_text(text, is_body=(kind == "body"))
+        texts[name] = text
+        report[name] = {"original_tokens": original, "compacted_tokens": estimate_tokens(text)}
+
+    if token_budget:
+        # The template plus the blank lines between attachments.
+        template_overhead = estimate_tokens(render_prompt("", "", [""] * sum(kind == "attachment" for _, kind, _ in sections), ""))
+        over = sum(estimate_tokens(t) for t in texts.values()) + template_overhead - token_budget
+        # Lowest priority (OCR, then the last attachments, then the body) loses tokens first.
+        truncation_order = sorted(
+            (s for s in sections if s[1] != "metadata"),
+            key=lambda s: (SECTION_PRIORITY[s[1]], sections.index(s)),
+            reverse=True,
+        )
+        for name, _, _ in truncation_order:
+            if over <= 0:
+                break
+            current = estimate_tokens(texts[name])
+            keep = max(MIN_SECTION_TOKENS, current - over) if current > MIN_SECTION_TOKENS else current
+            if keep < current:
+                texts[name] = truncate_to_tokens(texts[name], keep)
+                over -= current - keep
+
+    for name, entry in report.items():
+        entry["final_tokens"] = estimate_tokens(texts[name])
+        entry["dropped_tokens"] = max(0, entry["original_tokens"] - entry["final_tokens"])
+
+    attachments = [texts[name] for name, kind, _ in sections if kind == "attachment"]
+    if attachments == [text for _, kind, text in sections if kind == "attachment"]:
+        attachments = [attachment_summary]  # untouched: keep the original spacing exactly
+    prompt = render_prompt(texts["metadata"], texts["body"], attachments, texts["ocr"])
+    report["total"] = {
+        "original_tokens": sum(e["original_tokens"] for e in report.values()),
+        "final_tokens": estimate_tokens(prompt),
+        "budget": token_budget,
+    }
+    report["total"]["dropped_tokens"] = max(0, report["total"]["original_tokens"] - report["total"]["final_tokens"])
+    if memo is not None:
+        memo[(token_budget, compact)] = (prompt, report)
+    return prompt, report
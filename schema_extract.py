@@ -0,0 +1,251 @@
+import os
+import re
+import json
+
+from json_extract import extract_json
+from llm import query_claude, resolve_model_id
+from telemetry import logger, stage
+
+SCHEMA_MAX_REPAIRS = int(os.getenv("SCHEMA_MAX_REPAIRS", "2"))
+
+PATH_TOKEN = re.compile(r"([^.\[\]]+)|\[(\d+)\]")
+NOT_ALLOWED = "field not allowed by schema"
+
+JSON_TYPES = {
+    "object": dict,
+    "array": list,
+    "string": str,
+    "integer": int,
+    "number": (int, float),
+    "boolean": bool,
+    "null": type(None),
+}
+
+
+def load_schema(text):
+    """Parse a JSON Schema from text; returns None for blank input."""
+    if not text or not text.strip():
+        return None
+    schema = json.loads(text)
+    if not isinstance(schema, dict) or schema.get("type", "object") != "object":
+        raise ValueError("Extraction schema must be a JSON Schema with type 'object'")
+    return schema
+
+
+def _type_matches(value, type_name):
+    expected = JSON_TYPES.get(type_name)
+    if expected is None:
+        return True
+    # bool is an int subclass; JSON Schema keeps them apart.
+    if isinstance(value, bool) and type_name in ("integer", "number"):
+        return False
+    if type_name == "integer" and isinstance(value, float):
+        return value.is_integer()
+    return isinstance(value, expected)
+
+
+def validate(value, schema, path=""):
+    """Check ``value`` against the common JSON Schema keywords; returns a list of {path, message}.
+
+    Covers type, enum, required, properties, additionalProperties=false, items and
+    minimum/maximum — the subset used by extraction schemas.
+    """
+    errors = []
+    types = schema.get("type")
+    if types is not None:
+        types = types if isinstance(types, list) else [types]
+        if not any(_type_matches(value, t) for t in types):
+            return [{"path": path, "message": f"expected {' or '.join(types)}, got {type(value).__name__}"}]
+    if "enum" in schema and value not in schema["enum"]:
+        errors.append({"path": path, "message": f"must be one of {schema['enum']}"})
+
+    if isinstance(value, dict):
+        properties = schema.get("properties", {})
+        for name in schema.get("required", []):
+            if name not in value:
+                errors.append({"path": _join(path, name), "message": "missing required field"})
+        for name, item in value.items():
+            if name in properties:
+                errors.extend(validate(item, properties[name], _join(path, name)))
+            elif schema.get("additionalProperties") is False:
+                errors.append({"path": _join(path, name), "message": NOT_ALLOWED})
+    elif isinstance(value, list) and isinstance(schema.get("items"), dict):
+        for i, item in enumerate(value):
+            errors.extend(validate(item, schema["items"], f"{path}[{i}]"))
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        if "minimum" in schema and value < schema["minimum"]:
+            errors.append({"path": path, "message": f"must be >= {schema['minimum']}"})
+        if "maximum" in schema and value > schema["maximum"]:
+            errors.append({"path": path, "message": f"must be <= {schema['maximum']}"})
+    return errors
+
+
+def _join(path, name):
+    return f"{path}.{name}" if path else name
+
+
+def coerce(value, schema):
+    """Fix the mistakes that need no model call: quoted nulls, numbers/booleans sent as strings and vice versa."""
+    types = schema.get("type")
+    types = types if isinstance(types, list) else [types] if types else []
+    if isinstance(value, dict):
+        properties = schema.get("properties", {})
+        return {k: coerce(v, properties[k]) if k in properties else v for k, v in value.items()}
+    if isinstance(value, list):
+        items = schema.get("items")
+        return [coerce(v, items) for v in value] if isinstance(items, dict) else value
+    if isinstance(value, (int, float)) and not isinstance(value, bool) and types == ["string"]:
+        return str(value)
+    if not isinstance(value, str) or "string" in types:
+        return value
+    stripped = value.strip()
+    if "null" in types and stripped in ("", "null", "None", "NULL", "N/A"):
+        return None
+    if "boolean" in types and stripped.lower() in ("true", "false"):
+        return stripped.lower() == "true"
+    if "integer" in types or "number" in types:
+        try:
+            number = float(stripped.replace(",", "").lstrip("$"))
+        except ValueError:
+            return value
+        if "integer" in types and number.is_integer():
+            return int(number)
+        if "number" in types:
+            return number
+    return value
+
+
+def parse_path(path):
+    """``"invoices[0].amount"`` -> ``["invoices", 0, "amount"]``."""
+    return [int(index) if index else name for name, index in PATH_TOKEN.findall(path)]
+
+
+def _walk(data, tokens):
+    for token in tokens:
+        try:
+            data = data[token]
+        except (KeyError, IndexError, TypeError):
+            return None
+    return data
+
+
+def value_at(data, path):
+    return _walk(data, parse_path(path))
+
+
+def set_value_at(data, path, value):
+    tokens = parse_path(path)
+    parent = _walk(data, tokens[:-1])
+    if isinstance(parent, dict) or (isinstance(parent, list) and isinstance(tokens[-1], int) and tokens[-1] < len(parent)):
+        parent[tokens[-1]] = value
+
+
+def schema_at(schema, path):
+    for token in parse_path(path):
+        schema = schema.get("items", {}) if isinstance(token, int) else schema.get("properties", {}).get(token, {})
+    return schema
+
+
+def drop_disallowed(data, errors):
+    """Remove fields the schema forbids; no model call needed. Returns the remaining errors."""
+    remaining = []
+    for error in errors:
+        tokens = parse_path(error["path"])
+        if error["message"] != NOT_ALLOWED or not tokens:
+            remaining.append(error)
+            continue
+        parent = _walk(data, tokens[:-1])
+        if isinstance(parent, dict):
+            parent.pop(tokens[-1], None)
+    return remaining
+
+
+def build_repair_prompt(data, errors, schema):
+    """A short prompt covering only the invalid values, by path, not the whole email.
+
+    Returns ``(prompt, paths)``; the answer maps ``f1``, ``f2``, ... to the corrected value
+    at each path, since paths like ``invoices[0].amount`` are not valid property names.
+    """
+    paths = list(dict.fromkeys(e["path"] for e in errors if e["path"]))
+    lines = []
+    for i, path in enumerate(paths, 1):
+        problems = "; ".join(e["message"] for e in errors if e["path"] == path)
+        lines.append(
+            f"- f{i}: {path} = {json.dumps(value_at(data, path))} ({problems}); "
+            f"schema: {json.dumps(schema_at(schema, path))}"
+        )
+    return (
+        "A previous extraction produced values that do not match their JSON Schema.\n"
+        "Return a JSON object with the corrected value for each key below. Keep the information "
+        "the same, fix only the format; use null for values that cannot be determined.\n\n"
+        + "\n".join(lines)
+    ), paths
+
+
+def _repair_schema(schema, paths):
+    return {
+        "type": "object",
+        "properties": {f"f{i}": schema_at(schema, path) for i, path in enumerate(paths, 1)},
+        "required": [f"f{i}" for i in range(1, len(paths) + 1)],
+    }
+
+
+def extract_with_schema(prompt, schema, model_id=None, use_cache=True, max_repairs=SCHEMA_MAX_REPAIRS, prefix=None):
+    """Extract through tool use, validate against ``schema`` and repair only what failed.
+
+    Returns ``{"data", "errors", "repairs", "usage", "cached"}``; ``errors`` is empty when
+    the final data validates.
+    """
+    model_id = resolve_model_id(model_id)[0]
+    usage = {"input_tokens": 0, "output_tokens": 0}
+
+    def call(text, call_schema, call_prefix=None, use=use_cache):
+        result = query_claude(text, model_id=model_id, use_cache=use, schema=call_schema, prefix=call_prefix)
+        for key, count in (result.get("usage") or {}).items():
+            usage[key] = usage.get(key, 0) + count
+        return result
+
+    with stage("schema_extract", model_id=model_id) as event:
+        result = call(prompt, schema, prefix)
+        output = result["extracted_data"]
+        if output.startswith(("[LLM Error", "[Unsupported model")):
+            event["status"] = "error"
+            return {"data": None, "errors": [{"path": "", "message": output}], "repairs": 0,
+                    "usage": usage, "cached": False}
+
+        data = coerce(extract_json(output), schema)
+        if not isinstance(data, dict):
+            # Nothing usable came back; a repair prompt has nothing to work from.
+            event["status"] = "error"
+            event["error_type"] = "invalid_json"
+            return {"data": None, "errors": [{"path": "", "message": "no JSON object in model output"}],
+                    "repairs": 0, "usage": usage, "cached": bool(result.get("cached"))}
+
+        errors = drop_disallowed(data, validate(data, schema))
+        repairs = 0
+        while errors and repairs < max_repairs:
+            repair_prompt, paths = build_repair_prompt(data, errors, schema)
+            if not paths:
+                break
+            repairs += 1
+            logger.info("🩹 Repairing %d value(s) for model %s: %s", len(paths), model_id, ", ".join(paths))
+            # After a failed round the prompt is often identical; a cached answer would fail again.
+            fixed = extract_json(call(
+                repair_prompt, _repair_schema(schema, paths), use=use_cache and repairs == 1
+            )["extracted_data"])
+            if not isinstance(fixed, dict):
+                continue
+            for i, path in enumerate(paths, 1):
+                if f"f{i}" in fixed:
+                    set_value_at(data, path, fixed[f"f{i}"])
+            data = coerce(data, schema)
+            errors = drop_disallowed(data, validate(data, schema))
+
+        event.update(usage)
+        event["repairs"] = repairs
+        event["invalid_fields"] = len(errors)
+        if errors:
+            event["status"] = "error"
+            event["error_type"] = "schema_validation"
+        return {"data": data, "errors": errors, "repairs": repairs, "usage": usage,
+                "cached": bool(result.get("cached")) and repairs == 0}
@@ -0,0 +1,312 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+from cache import CACHE_DIR
+from json_extract import extract_json
+
+TEMPLATE_STORE_PATH = os.getenv("TEMPLATE_STORE_PATH", os.path.join(CACHE_DIR, "templates.sqlite"))
+# Validated model outputs needed before rules are learned for a layout.
+TEMPLATE_MIN_EXAMPLES = int(os.getenv("TEMPLATE_MIN_EXAMPLES", "5"))
+TEMPLATE_MAX_EXAMPLES = int(os.getenv("TEMPLATE_MAX_EXAMPLES", "20"))
+# Fraction of rule-served emails still sent to the model to check the rules.
+TEMPLATE_VERIFY_RATE = float(os.getenv("TEMPLATE_VERIFY_RATE", "0.05"))
+
+DIGITS = re.compile(r"\d+")
+ESCAPED_DIGITS = re.compile(r"(?:\\?\d)+")
+NUMBER_CHARS = re.compile(r"[^\d.\-]")
+
+
+def sender_domain(address):
+    return address.rsplit("@", 1)[-1].lower() if address else ""
+
+
+def layout_key(scope, email_data):
+    """Sender domain plus the subject with digits masked: one key per notification type."""
+    subject = DIGITS.sub("9", " ".join(str(email_data.get("subject", "")).split()))
+    return hashlib.sha256(json.dumps([scope, sender_domain(email_data.get("from_address", "")), subject]).encode("utf-8")).hexdigest()
+
+
+def flatten(value, path=()):
+    """``[(path, leaf)]`` for nested dicts; None if the output contains lists.
+
+    List items vary in number and position from email to email, so there is no single
+    anchored rule per field; such layouts are marked unlearnable (see TemplateStore).
+    """
+    if isinstance(value, dict):
+        leaves = []
+        for key, item in value.items():
+            sub = flatten(item, path + (key,))
+            if sub is None:
+                return None
+            leaves.extend(sub)
+        return leaves
+    if isinstance(value, list):
+        return None
+    return [(path, value)]
+
+
+def unflatten(leaves):
+    result = {}
+    for path, value in leaves:
+        node = result
+        for key in path[:-1]:
+            node = node.setdefault(key, {})
+        node[path[-1]] = value
+    return result
+
+
+def anchor_pattern(text):
+    """Literal anchor text with whitespace relaxed and digit runs generalized."""
+    escaped = r"\s+".join(re.escape(word) for word in text.split())
+    return ESCAPED_DIGITS.sub(r"\\d+", escaped)
+
+
+def value_forms(value):
+    if isinstance(value, bool):
+        return []
+    if isinstance(value, int):
+        return [f"{value:,}", str(value)]
+    if isinstance(value, float):
+        return [f"{value:,.2f}", f"{value:.2f}", str(value)]
+    return [value] if isinstance(value, str) and value.strip() else []
+
+
+def convert(raw, like):
+    """Turn captured text into the same type as the example value."""
+    if isinstance(like, str):
+        return raw.strip()
+    number = NUMBER_CHARS.sub("", raw)
+    return int(number) if isinstance(like, int) else float(number)
+
+
+def candidate_rules(text, value):
+    """Regex rules that capture ``value`` in ``text``, most specific first."""
+    rules = []
+    lines = text.splitlines()
+    for form in value_forms(value):
+        capture = r"(\S+)" if not any(ch.isspace() for ch in form) else r"(.+?)"
+        for number, line in enumerate(lines):
+            start = line.find(form)
+            if start < 0:
+                continue
+            prefix = line[:start].split()
+            suffix = line[start + len(form):].split()
+            end = rf"(?=\s*{re.escape(suffix[0])})" if suffix else r"\s*$"
+            if prefix:
+                for size in (len(prefix), 4, 3, 2, 1):
+                    anchor = " ".join(prefix[-size:])
+                    if size <= len(prefix) and any(ch.isalpha() for ch in anchor):
+                        head = r"^\s*" if size == len(prefix) else ""
+                        rules.append(head + anchor_pattern(anchor) + r"\s*" + capture + end)
+            else:
+                label = next((l.strip() for l in reversed(lines[:number]) if l.strip()), "")
+                if any(ch.isalpha() for ch in label):
+                    rules.append(r"^\s*" + anchor_pattern(label) + r"\s*\n(?:\s*\n)*\s*" + capture + end)
+    return list(dict.fromkeys(rules))
+
+
+def apply_rule(rule, text, like):
+    match = re.search(rule, text, re.MULTILINE)
+    if match is None:
+        raise LookupError(rule)
+    return convert(match.group(1), like)
+
+
+def same_value(a, b):
+    if isinstance(a, float) or isinstance(b, float):
+        return isinstance(a, (int, float)) and isinstance(b, (int, float)) and abs(a - b) < 1e-9
+    return a == b
+
+
+def learn_rules(examples):
+    """Learn one rule per output field that reproduces every example, or None.
+
+    ``examples`` is a list of ``(text, output_dict)``. A field with the same non-null value
+    in every example becomes a constant (null may just mean "not in these emails yet");
+    any field without a rule that holds for all examples makes the whole layout unlearnable.
+    """
+    flattened = [flatten(output) for _, output in examples]
+    if any(leaves is None for leaves in flattened):
+        return None
+    paths = [path for path, _ in flattened[0]]
+    if not paths or any([path for path, _ in leaves] != paths for leaves in flattened):
+        return None
+
+    fields = []
+    first_text = examples[0][0]
+    for index, path in enumerate(paths):
+        values = [leaves[index][1] for leaves in flattened]
+        chosen = None
+        for rule in candidate_rules(first_text, values[0]):
+            try:
+                if all(same_value(apply_rule(rule, text, value), value) for (text, _), value in zip(examples, values)):
+                    chosen = {"path": list(path), "rule": rule, "type": type(values[0]).__name__}
+                    break
+            except (LookupError, ValueError, re.error):
+                continue
+        if chosen is None and values[0] is not None and all(same_value(v, values[0]) for v in values):
+            chosen = {"path": list(path), "constant": values[0]}
+        if chosen is None:
+            return None
+        fields.append(chosen)
+    return fields
+
+
+TYPE_SAMPLES = {"str": "", "int": 0, "float": 0.0}
+
+
+def apply_rules(fields, text):
+    """Extract with learned rules; raises LookupError/ValueError when the layout drifted."""
+    leaves = []
+    for field in fields:
+        if "constant" in field:
+            value = field["constant"]
+        else:
+            value = apply_rule(field["rule"], text, TYPE_SAMPLES[field["type"]])
+        leaves.append((tuple(field["path"]), value))
+    return unflatten(leaves)
+
+
+def should_verify(email_id, rate=TEMPLATE_VERIFY_RATE):
+    """Deterministic sampling, so a rerun verifies the same emails."""
+    return int(hashlib.sha256(str(email_id).encode("utf-8")).hexdigest()[:8], 16) / 0x100000000 < rate
+
+
+class TemplateStore:
+    """Validated model outputs and the rules learned from them, per sender layout.
+
+    Backed by SQLite and safe to share between threads. Rules for a layout are dropped,
+    together with its examples, as soon as they fail to apply or disagree with the model.
+    Layouts whose outputs contain lists, or that still have no rules after ``max_examples``
+    examples, are recorded as unlearnable and no longer collect examples.
+    """
+
+    def __init__(self, path=TEMPLATE_STORE_PATH, min_examples=TEMPLATE_MIN_EXAMPLES,
+                 max_examples=TEMPLATE_MAX_EXAMPLES):
+        self.min_examples = min_examples
+        self.max_examples = max_examples
+        self.lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS examples ("
+            " layout TEXT NOT NULL, email_id TEXT NOT NULL, text TEXT NOT NULL, output TEXT NOT NULL,"
+            " created REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS examples_layout ON examples(layout, created)")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS rules ("
+            " layout TEXT PRIMARY KEY, fields TEXT NOT NULL, served INTEGER NOT NULL DEFAULT 0,"
+            " verified INTEGER NOT NULL DEFAULT 0, created REAL NOT NULL)"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS unlearnable (layout TEXT PRIMARY KEY, reason TEXT NOT NULL, created REAL NOT NULL)"
+        )
+        self._rules = {}  # layout -> fields, so the hot path never touches SQLite
+        for layout, fields in self.conn.execute("SELECT layout, fields FROM rules"):
+            self._rules[layout] = json.loads(fields)
+        self._unlearnable = {layout for (layout,) in self.conn.execute("SELECT layout FROM unlearnable")}
+
+    def extract(self, layout, text):
+        """Rule-based extraction for a known layout; None when there are no rules or they no longer match."""
+        fields = self._rules.get(layout)
+        if fields is None:
+            return None
+        try:
+            data = apply_rules(fields, text)
+        except (LookupError, ValueError):
+            print(f"⚠️ Template drift for layout {layout[:12]} — falling back to the model")
+            self.forget(layout)
+            return None
+        with self.lock:
+            self.conn.execute("UPDATE rules SET served = served + 1 WHERE layout = ?", (layout,))
+        return data
+
+    def needs_check(self, layout):
+        """Rules with constant fields are checked against the model on every email: a constant
+        only reflects the examples seen so far and would otherwise go stale silently."""
+        return any("constant" in field for field in self._rules.get(layout, ()))
+
+    def check(self, layout, rule_output, model_output):
+        """Compare a sampled rule result with the model's answer; drop the rules on disagreement."""
+        data = extract_json(model_output)
+        if not isinstance(data, dict):
+            return None  # nothing to compare against
+        if data == rule_output:
+            with self.lock:
+                self.conn.execute("UPDATE rules SET verified = verified + 1 WHERE layout = ?", (layout,))
+            return True
+        print(f"⚠️ Template for layout {layout[:12]} disagreed with the model — relearning")
+        self.forget(layout)
+        return False
+
+    def forget(self, layout):
+        with self.lock:
+            self._rules.pop(layout, None)
+            self.conn.execute("DELETE FROM rules WHERE layout = ?", (layout,))
+            self.conn.execute("DELETE FROM examples WHERE layout = ?", (layout,))
+
+    def mark_unlearnable(self, layout, reason):
+        with self.lock:
+            self._unlearnable.add(layout)
+            self.conn.execute(
+                "INSERT OR REPLACE INTO unlearnable (layout, reason, created) VALUES (?, ?, ?)",
+                (layout, reason, time.time()),
+            )
+            self.conn.execute("DELETE FROM examples WHERE layout = ?", (layout,))
+        print(f"🚫 Layout {layout[:12]} is not learnable ({reason}) — no longer collecting examples")
+
+    def add_example(self, layout, email_id, text, output):
+        """Record a validated model output and (re)learn rules once enough examples exist."""
+        data = extract_json(output)
+        if not isinstance(data, dict) or layout in self._rules or layout in self._unlearnable:
+            return False
+        if flatten(data) is None:
+            self.mark_unlearnable(layout, "output contains lists")
+            return False
+        with self.lock:
+            self.conn.execute(
+                "INSERT INTO examples (layout, email_id, text, output, created) VALUES (?, ?, ?, ?, ?)",
+                (layout, email_id, text, json.dumps(data), time.time()),
+            )
+            rows = self.conn.execute(
+                "SELECT text, output FROM examples WHERE layout = ? ORDER BY created DESC LIMIT ?",
+                (layout, self.max_examples),
+            ).fetchall()
+            self.conn.execute(
+                "DELETE FROM examples WHERE layout = ? AND rowid NOT IN"
+                " (SELECT rowid FROM examples WHERE layout = ? ORDER BY created DESC LIMIT ?)",
+                (layout, layout, self.max_examples),
+            )
+        if len(rows) < self.min_examples:
+            return False
+        fields = learn_rules([(text, json.loads(output)) for text, output in rows])
+        if fields is None:
+            if len(rows) >= self.max_examples:
+                self.mark_unlearnable(layout, f"no rules after {len(rows)} examples")
+            return False
+        with self.lock:
+            self._rules[layout] = fields
+            self.conn.execute(
+                "INSERT OR REPLACE INTO rules (layout, fields, created) VALUES (?, ?, ?)",
+                (layout, json.dumps(fields), time.time()),
+            )
+        print(f"🧩 Learned extraction template for layout {layout[:12]} from {len(rows)} examples")
+        return True
+
+    def stats(self):
+        with self.lock:
+            return [
+                {"layout": layout, "fields": len(json.loads(fields)), "served": served, "verified": verified}
+                for layout, fields, served, verified in self.conn.execute(
+                    "SELECT layout, fields, served, verified FROM rules"
+                )
+            ]
@@ -0,0 +1,143 @@
+import os
+import json
+import time
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler
+
+TRACE_LOG_PATH = os.getenv("TRACE_LOG_PATH", os.path.join("logs", "trace.jsonl"))
+TRACE_LOG_MAX_MB = float(os.getenv("TRACE_LOG_MAX_MB", "20"))
+TRACE_LOG_BACKUPS = int(os.getenv("TRACE_LOG_BACKUPS", "5"))
+TRACE_ENABLED = os.getenv("TRACE_DISABLED", "").lower() not in ("1", "true", "yes")
+
+# Debug prompt/response dumps only show up with LOG_LEVEL=DEBUG.
+logger = logging.getLogger("llm_app")
+if not logger.handlers:
+    _console = logging.StreamHandler()
+    _console.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+    logger.addHandler(_console)
+    logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+    logger.propagate = False
+
+_trace_logger = None
+_trace_lock = threading.Lock()
+_recent_events = deque(maxlen=int(os.getenv("METRICS_WINDOW", "2000")))
+
+
+def _get_trace_logger():
+    global _trace_logger
+    with _trace_lock:
+        if _trace_logger is None:
+            directory = os.path.dirname(TRACE_LOG_PATH)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            handler = RotatingFileHandler(
+                TRACE_LOG_PATH,
+                maxBytes=int(TRACE_LOG_MAX_MB * 1024 * 1024),
+                backupCount=TRACE_LOG_BACKUPS,
+                encoding="utf-8",
+            )
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            _trace_logger = logging.getLogger("llm_app.trace")
+            _trace_logger.addHandler(handler)
+            _trace_logger.setLevel(logging.INFO)
+            _trace_logger.propagate = False
+        return _trace_logger
+
+
+def classify_error(exc):
+    """Map an exception to a small, stable taxonomy used for retries and dashboards."""
+    code = ""
+    response = getattr(exc, "response", None)
+    if isinstance(response, dict):
+        code = response.get("Error", {}).get("Code", "")
+        # Errors raised inside an event stream use lower camel case ("throttlingException").
+        code = code[:1].upper() + code[1:]
+    name = type(exc).__name__
+    if code in ("ThrottlingException", "TooManyRequestsException", "ServiceQuotaExceededException") \
+            or name == "ThrottlingException":
+        return "throttled"
+    if code == "ModelNotReadyException":
+        return "model_not_ready"
+    if code in ("ModelTimeoutException",) or "Timeout" in name:
+        return "timeout"
+    if code in ("AccessDeniedException", "UnrecognizedClientException", "ExpiredTokenException") \
+            or name in ("NoCredentialsError", "PartialCredentialsError"):
+        return "auth"
+    if code in ("ValidationException", "ResourceNotFoundException"):
+        return "validation"
+    if code in ("InternalServerException", "ServiceUnavailableException", "ModelErrorException",
+                "ModelStreamErrorException"):
+        return "service"
+    if name in ("EndpointConnectionError", "ConnectionClosedError", "ConnectionError") or isinstance(exc, OSError):
+        return "network"
+    return "unknown"
+
+
+def record_event(event):
+    event.setdefault("ts", time.time())
+    _recent_events.append(event)
+    if TRACE_ENABLED:
+        _get_trace_logger().info(json.dumps(event, default=str))
+
+
+@contextmanager
+def stage(name, **fields):
+    """Time a pipeline stage and emit one trace event.
+
+    The yielded dict can be filled with extra fields (token usage, cache hits, ...)
+    before the block exits.
+    """
+    event = {"stage": name, **fields}
+    started = time.perf_counter()
+    try:
+        yield event
+        event.setdefault("status", "ok")
+    except Exception as e:
+        event["status"] = "error"
+        event["error_type"] = classify_error(e)
+        event["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        event["duration_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        record_event(event)
+
+
+def recent_events(stage_name=None):
+    return [e for e in list(_recent_events) if stage_name is None or e["stage"] == stage_name]
+
+
+def clear_recent_events():
+    _recent_events.clear()
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def metrics_summary():
+    """Per-stage count, error count, p50/p95 latency and token totals (incl. prompt-cache) over recent events."""
+    by_stage = {}
+    for event in list(_recent_events):
+        by_stage.setdefault(event["stage"], []).append(event)
+
+    summary = []
+    for name, events in sorted(by_stage.items()):
+        durations = sorted(e["duration_ms"] for e in events if "duration_ms" in e)
+        summary.append({
+            "stage": name,
+            "count": len(events),
+            "errors": sum(1 for e in events if e.get("status") == "error"),
+            "p50_ms": _percentile(durations, 50),
+            "p95_ms": _percentile(durations, 95),
+            "input_tokens": sum(e.get("input_tokens") or 0 for e in events),
+            "output_tokens": sum(e.get("output_tokens") or 0 for e in events),
+            "cache_read_tokens": sum(e.get("cache_read_tokens") or 0 for e in events),
+            "cache_write_tokens": sum(e.get("cache_write_tokens") or 0 for e in events),
+        })
+    return summary
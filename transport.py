@@ -0,0 +1,168 @@
+import os
+import time
+import random
+import threading
+
+from telemetry import classify_error, logger
+
+MAX_POOL_CONNECTIONS = int(os.getenv("BEDROCK_MAX_POOL_CONNECTIONS", "50"))
+CONNECT_TIMEOUT = float(os.getenv("BEDROCK_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.getenv("BEDROCK_READ_TIMEOUT", "120"))
+# Total attempts botocore makes per request. Retrying is left to call_with_retries, which
+# records each attempt and backs off outside the model's concurrency slot; any botocore
+# retries above 1 multiply with MAX_RETRIES.
+BOTOCORE_MAX_ATTEMPTS = int(os.getenv("BEDROCK_BOTOCORE_MAX_ATTEMPTS", "1"))
+
+MAX_RETRIES = int(os.getenv("BEDROCK_MAX_RETRIES", "6"))
+BACKOFF_BASE = float(os.getenv("BEDROCK_BACKOFF_BASE", "0.5"))
+BACKOFF_CAP = float(os.getenv("BEDROCK_BACKOFF_CAP", "20"))
+RETRYABLE_ERRORS = {"throttled", "timeout", "service", "model_not_ready", "network"}
+
+DEFAULT_MODEL_CONCURRENCY = int(os.getenv("BEDROCK_MODEL_CONCURRENCY", "8"))
+# Per-model overrides, e.g. BEDROCK_MODEL_CONCURRENCY_MAP="meta.llama3-3-70b-instruct-v1:0=4,..."
+MODEL_CONCURRENCY = {
+    key.strip(): int(value)
+    for key, value in (
+        item.rsplit("=", 1) for item in os.getenv("BEDROCK_MODEL_CONCURRENCY_MAP", "").split(",") if "=" in item
+    )
+}
+
+
+def create_bedrock_client():
+    import boto3
+    from botocore.config import Config
+
+    config = Config(
+        max_pool_connections=MAX_POOL_CONNECTIONS,
+        connect_timeout=CONNECT_TIMEOUT,
+        read_timeout=READ_TIMEOUT,
+        retries={"total_max_attempts": BOTOCORE_MAX_ATTEMPTS, "mode": "standard"},
+    )
+    return boto3.client(
+        "bedrock-runtime",
+        region_name=os.getenv("AWS_REGION", "us-east-1"),
+        # Point at a local stand-in (benchmarks/fake_bedrock.py) for offline load tests.
+        endpoint_url=os.getenv("BEDROCK_ENDPOINT_URL") or None,
+        config=config,
+    )
+
+
+def backoff_delay(attempt):
+    """Full-jitter exponential backoff for the given (1-based) retry attempt."""
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * (2 ** (attempt - 1))))
+
+
+_model_semaphores = {}
+_model_semaphores_lock = threading.Lock()
+
+
+def get_model_semaphore(model_id):
+    with _model_semaphores_lock:
+        if model_id not in _model_semaphores:
+            limit = MODEL_CONCURRENCY.get(model_id, DEFAULT_MODEL_CONCURRENCY)
+            _model_semaphores[model_id] = threading.BoundedSemaphore(limit)
+        return _model_semaphores[model_id]
+
+
+def call_with_retries(call, model_id, event=None):
+    """Run ``call()`` under the model's concurrency limit, retrying transient failures.
+
+    Throttling, timeouts and 5xx-style errors back off with jitter; validation and auth
+    errors are raised immediately. ``event`` (a telemetry dict) receives ``attempts``.
+    """
+    semaphore = get_model_semaphore(model_id)
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            with semaphore:
+                result = call()
+            if event is not None:
+                event["attempts"] = attempt
+            return result
+        except Exception as e:
+            category = classify_error(e)
+            if event is not None:
+                event["attempts"] = attempt
+                event.setdefault("retry_errors", []).append(category)
+            if category not in RETRYABLE_ERRORS or attempt > MAX_RETRIES:
+                raise
+            delay = backoff_delay(attempt)
+            logger.warning("🔁 %s on %s (attempt %d), retrying in %.2fs", category, model_id, attempt, delay)
+            time.sleep(delay)
+
+
+def stream_with_retries(open_stream, model_id, event=None, delivered=None):
+    """Yield the events of ``open_stream()`` while holding one of the model's concurrency slots.
+
+    The slot is held until the stream is exhausted or this generator is closed, and closing
+    it closes the stream. Transient errors, including throttling reported mid-stream, are
+    retried like call_with_retries until ``delivered()`` says output has reached the caller.
+    """
+    semaphore = get_model_semaphore(model_id)
+    attempt = 0
+    while True:
+        attempt += 1
+        stream = None
+        try:
+            with semaphore:
+                stream = open_stream()
+                if event is not None:
+                    event["attempts"] = attempt
+                for item in stream:
+                    yield item
+                return
+        except Exception as e:
+            category = classify_error(e)
+            if event is not None:
+                event["attempts"] = attempt
+                event.setdefault("retry_errors", []).append(category)
+            if category not in RETRYABLE_ERRORS or attempt > MAX_RETRIES or (delivered is not None and delivered()):
+                raise
+            delay = backoff_delay(attempt)
+            logger.warning("🔁 %s on %s stream (attempt %d), retrying in %.2fs", category, model_id, attempt, delay)
+            time.sleep(delay)
+        finally:
+            if stream is not None and hasattr(stream, "close"):
+                stream.close()
+
+
+_async_semaphores = {}
+
+
+def get_async_model_semaphore(model_id):
+    import asyncio
+    # asyncio primitives are bound to one event loop, so key them by loop as well.
+    key = (id(asyncio.get_running_loop()), model_id)
+    if key not in _async_semaphores:
+        _async_semaphores[key] = asyncio.Semaphore(MODEL_CONCURRENCY.get(model_id, DEFAULT_MODEL_CONCURRENCY))
+    return _async_semaphores[key]
+
+
+async def acall_with_retries(call, model_id, event=None):
+    """Async counterpart of call_with_retries.
+
+    Waiting (concurrency slots and backoff) happens on the event loop; the blocking
+    botocore request itself runs in the default thread pool.
+    """
+    import asyncio
+    semaphore = get_async_model_semaphore(model_id)
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            async with semaphore:
+                result = await asyncio.to_thread(call)
+            if event is not None:
+                event["attempts"] = attempt
+            return result
+        except Exception as e:
+            category = classify_error(e)
+            if event is not None:
+                event["attempts"] = attempt
+                event.setdefault("retry_errors", []).append(category)
+            if category not in RETRYABLE_ERRORS or attempt > MAX_RETRIES:
+                raise
+            delay = backoff_delay(attempt)
+            logger.warning("🔁 %s on %s (attempt %d), retrying in %.2fs", category, model_id, attempt, delay)
+            await asyncio.sleep(delay)
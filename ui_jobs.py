@@ -0,0 +1,120 @@
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from telemetry import logger
+
+UI_JOB_WORKERS = int(os.getenv("UI_JOB_WORKERS", "4"))
+# How often the page re-renders while a job is running.
+UI_JOB_POLL_INTERVAL = float(os.getenv("UI_JOB_POLL_INTERVAL", "0.3"))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_job_executor():
+    """Process-wide pool shared by every UI session; threads are reused across reruns."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=UI_JOB_WORKERS, thread_name_prefix="ui-job")
+        return _executor
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    """One background model call. The worker writes ``text``/``stats``; the page only reads them."""
+
+    def __init__(self, key, label):
+        self.key = key
+        self.label = label
+        self.text = ""
+        self.stats = {}
+        self.status = "running"
+        self.result = None
+        self.error = None
+        self.started = time.perf_counter()
+        self.finished = None
+        self.cancel_event = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    @property
+    def running(self):
+        return self.status == "running"
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def elapsed(self):
+        return (self.finished or time.perf_counter()) - self.started
+
+
+class JobManager:
+    """Background jobs for one Streamlit session, keyed by the panel they fill.
+
+    Workers never touch ``st.session_state``: everything they need is passed in, and
+    finished jobs are handed back to the script run by ``collect()``. ``then`` chains a
+    follow-up job from a worker thread, registered before the first job reports done so
+    the page keeps polling across the hand-off.
+    """
+
+    def __init__(self):
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def submit(self, key, label, fn, *args, then=None):
+        """Run ``fn(job, *args)`` in the background, replacing (and cancelling) any job for ``key``."""
+        job = Job(key, label)
+        with self.lock:
+            previous = self.jobs.get(key)
+            if previous is not None and previous.running:
+                previous.cancel()
+            self.jobs[key] = job
+
+        def run():
+            try:
+                result = fn(job, *args)
+                if job.cancelled:
+                    raise JobCancelled()
+                if then is not None:
+                    then(result)
+                job.result = result
+                job.status = "done"
+            except JobCancelled:
+                job.status = "cancelled"
+            except Exception as e:
+                logger.warning("⚠️ Background job %s failed: %s", key, e)
+                job.error = f"{type(e).__name__}: {e}"
+                job.status = "error"
+            finally:
+                job.finished = time.perf_counter()
+
+        get_job_executor().submit(run)
+        return job
+
+    def get(self, key):
+        return self.jobs.get(key)
+
+    def active(self):
+        """True while any job is running or finished but not yet collected."""
+        return bool(self.jobs)
+
+    def cancel_all(self):
+        for job in list(self.jobs.values()):
+            job.cancel()
+
+    def collect(self):
+        """Remove and return jobs that have finished since the last call."""
+        with self.lock:
+            finished = [job for job in self.jobs.values() if not job.running]
+            for job in finished:
+                if self.jobs.get(job.key) is job:
+                    del self.jobs[job.key]
+        return finished
@@ -1,5 +1,3 @@
-import bleach
-
 def sanitize_html(html: str) -> str:
     """
     Clean HTML content by removing unwanted tags and attributes.
@@ -11,6 +9,7 @@ def sanitize_html(html: str) -> str:
     Returns:
         str: Cleaned, safe HTML
     """
+    import bleach
     return bleach.clean(
         html,
         tags=["p", "br", "ul", "li", "strong", "em", "b", "i", "a", "div"],
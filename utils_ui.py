@@ -1,9 +1,26 @@
-import streamlit as st
-import re
+import os
 import json
-from llm import query_claude, get_available_models, build_email_prompt
+import time
+from collections.abc import Mapping
+import streamlit as st
+from llm import query_claude_stream, query_all_models, get_available_models, build_email_prompt
+from prompt_builder import build_budgeted_prompt, split_prompt_template, DEFAULT_COMPACTION, DEFAULT_TOKEN_BUDGET
+from cache import get_response_cache, response_cache_enabled
+from telemetry import logger, metrics_summary, stage
+from evaluate import evaluate_prompt, load_golden_set
+from json_extract import JSONStreamExtractor, extract_json
+from schema_extract import extract_with_schema, load_schema
+from chunked_extract import build_chunk_prompts, extract_chunks, needs_chunking
+from ui_jobs import UI_JOB_POLL_INTERVAL, JobCancelled, JobManager
 
 PANEL_HEIGHT = 800
+STREAM_MAX_CHARS = int(os.getenv("STREAM_MAX_CHARS", "40000"))
+# Background job key (also the panel's key_prefix) -> session_state field holding its result.
+PANEL_STATE_KEYS = {
+    "llm_extracted": "extracted_data",
+    "improved_prompt": "improved_prompt",
+    "prompt_comparison": "comparison",
+}
 PANEL_STYLE = """
     height: {height}px;
     overflow-y: auto;
@@ -21,16 +38,20 @@ PANEL_STYLE = """
 """
 
 def format_json_nicely(content):
-    try:
-        match = re.search(r"({.*}|\[.*\])", content, re.DOTALL)
-        if not match:
-            raise ValueError("No valid JSON found in Claude output.")
-        json_string = match.group(1)
-        parsed = json.loads(json_string)
+    """Pretty-print the JSON in ``content``; runs on every render, so it records nothing."""
+    parsed = extract_json(content)
+    return content if parsed is None else json.dumps(parsed, indent=2)
+
+def postprocess_json(content):
+    """Pull the JSON out of a finished model output, once, recording the json_postprocess stage."""
+    with stage("json_postprocess") as event:
+        parsed = extract_json(content)
+        if parsed is None:
+            event["status"] = "error"
+            event["error_type"] = "invalid_json"
+            logger.warning("⚠️ JSON formatting failed: no valid JSON found in model output")
+            return content
         return json.dumps(parsed, indent=2)
-    except Exception as e:
-        print(f"⚠️ JSON formatting failed: {e}")
-        return content
 
 def clean_improved_prompt(text):
     lines = text.strip().splitlines()
@@ -62,6 +83,240 @@ def render_readonly_panel(title, content, key_prefix, height, is_json=False, htm
             unsafe_allow_html=True,
         )
 
+def build_extraction_prompt(user_prompt, email_data, token_budget=None, compact=None):
+    """Return ``(prefix, prompt)``: the shared, prompt-cacheable instructions and the per-email rest."""
+    if isinstance(email_data, Mapping):
+        return split_prompt_template(
+            user_prompt,
+            build_email_prompt(email_data, token_budget=token_budget, compact=compact)
+        )
+    return "", user_prompt
+
+def build_improvement_prompt(user_prompt, email_data):
+    email_snippet = email_data.get("text", "")[:5000] if isinstance(email_data, Mapping) else ""
+    sample_output = json.dumps({
+        "to_email": "carla.wells@sunbeltrentals.com",
+        "from_email": "notifications@paymode.com",
+        "received_date": "2025-05-14T00:00:00",
+        "payment_card_last4": "0906",
+        "payment_buyer_name": "Scranton Manufacturing Co Inc",
+        "payment_buyer_vendor_id": None,
+        "payment_merchant_reference_number": None,
+        "payment_amount": 7435.21,
+        "payment_order_notes": None,
+        "payment_merchant_name": None,
+        "payment_card_number": None,
+        "card_expiration_date": None,
+        "token_key": "Scranton Manufacturing Co_0906",
+        "invoices": [
+            {
+                "invoice_number": "3955",
+                "account_number": None,
+                "invoice_date": "2024-12-10",
+                "invoice_amount": "84.05"
+            }
+        ]
+    }, indent=2)
+
+    return f"""
+You are a prompt optimization expert.
+
+Rewrite the user's extraction prompt into a clean, scalable, few-shot natural language prompt.
+
+Requirements:
+- Clear and user-friendly
+- Economical in terms of token usage
+- Flexible and reusable across different email formats
+- Natural language (not JSON or code)
+- Includes one natural-language example output
+
+Return **only** the rewritten prompt body — no email data or formatting instructions.
+
+## Original Prompt
+{user_prompt}
+
+## Email Snippet
+{email_snippet}
+
+## Example Output
+{sample_output}
+"""
+
+def finalize_improved_prompt(model_output):
+    improved_body = clean_improved_prompt(model_output)
+    return improved_body.strip() + "\n\n" + \
+        "Do not include any explanations, notes, or other text outside the JSON object.\n" \
+        "Format numbers as actual numbers (not strings) where appropriate.\n" \
+        "Use null (not \"null\" in quotes) for missing values.\n" \
+        "If any field is missing, set it to null.\n" \
+        "Exclude any summary fields like \"invoice_amount\" at the root level — only return it inside individual invoices.\n\n" \
+        "Email Data:\n{email_data}"
+
+def build_comparison_prompt(user_prompt, improved_prompt):
+    return f"""
+Compare the following two prompts.
+
+Step 1: Create a markdown table comparing:
+- Clarity
+- Completeness
+- Flexibility
+- Reusability
+- Economic value
+- Ease of Understanding
+
+Step 2: Add 2–3 sentences explaining which is better and why. Be specific about the differences.
+
+Return only markdown.
+
+## Prompt A (User Prompt)
+{user_prompt}
+
+## Prompt B (Improved Prompt)
+{improved_prompt}
+"""
+
+def comparison_to_html(markdown):
+    if not markdown.startswith("|"):
+        return markdown
+    try:
+        rows = [row.strip() for row in markdown.strip().splitlines() if row.strip()]
+        header = rows[0].split("|")[1:-1]
+        body = rows[2:]
+        table_html = "<table><tr>" + "".join(f"<th>{h.strip()}</th>" for h in header) + "</tr>"
+        for row in body:
+            cols = row.split("|")[1:-1]
+            table_html += "<tr>" + "".join(f"<td>{c.strip()}</td>" for c in cols) + "</tr>"
+        table_html += "</table>"
+        markdown_tail = "\n\n".join(markdown.split("\n\n")[1:])
+        return table_html + f"<br><br>{markdown_tail.strip()}"
+    except Exception as e:
+        print("⚠️ Table conversion failed:", str(e))
+        return markdown
+
+def stream_job(job, prompt, model_id, use_cache, stop_after_json=False, prefix=None):
+    """Background worker: stream a model call into ``job.text`` and return the full text.
+
+    With ``stop_after_json`` the generation is cancelled as soon as the first top-level
+    JSON value is complete, so trailing commentary is never generated; the answer up to
+    the end of the JSON is still cached. Cancelling the job closes the stream as well.
+    """
+    stop = None
+    if stop_after_json:
+        json_extractor = JSONStreamExtractor()
+        stop = lambda chunk: json_extractor.end if json_extractor.feed(chunk) else None  # noqa: E731
+    for chunk in query_claude_stream(
+        prompt,
+        model_id=model_id,
+        use_cache=use_cache,
+        stats=job.stats,
+        prefix=prefix,
+        stop=stop,
+    ):
+        if job.cancelled:
+            logger.info("⏹️ %s cancelled", job.key)
+            raise JobCancelled()
+        job.text += chunk
+        if len(job.text) > STREAM_MAX_CHARS:
+            logger.info("⏹️ Stopping runaway generation for %s at %d chars", job.key, len(job.text))
+            break
+    return job.text.strip()
+
+def extraction_job(job, prompt, model_id, use_cache, prefix=None):
+    return postprocess_json(stream_job(job, prompt, model_id, use_cache, stop_after_json=True, prefix=prefix))
+
+def schema_extraction_job(job, prompt, schema, model_id, use_cache, prefix=None):
+    """Background worker: tool-use extraction validated against ``schema``; returns JSON text."""
+    started = time.perf_counter()
+    result = extract_with_schema(prompt, schema, model_id=model_id, use_cache=use_cache, prefix=prefix)
+    job.stats.update({
+        "cached": result["cached"],
+        "total_sec": time.perf_counter() - started,
+        "ttft_sec": None,
+        "repairs": result["repairs"],
+        "cache_read_tokens": result["usage"].get("cache_read_tokens", 0),
+        "cache_write_tokens": result["usage"].get("cache_write_tokens", 0),
+        "schema_errors": [f"{e['path']}: {e['message']}" for e in result["errors"]],
+    })
+    if result["data"] is None:
+        return result["errors"][0]["message"]
+    return json.dumps(result["data"])
+
+def chunked_extraction_job(job, chunk_prompts, model_id, use_cache, schema=None):
+    """Background worker: map-reduce extraction over long attachments; returns merged JSON text."""
+    result = extract_chunks(chunk_prompts, model_id=model_id, use_cache=use_cache, schema=schema)
+    job.stats.update({
+        "total_sec": result["elapsed_sec"],
+        "ttft_sec": None,
+        "chunks": result["chunks"],
+        "cache_read_tokens": result["usage"].get("cache_read_tokens", 0),
+        "cache_write_tokens": result["usage"].get("cache_write_tokens", 0),
+        "conflicts": [f"{c['path']}: {c['values']} → kept {c['chosen']!r}" for c in result["conflicts"]],
+        "schema_errors": [f"{e['path']}: {e['message']}" for e in result["errors"]],
+    })
+    if result["data"] is None:
+        return result["errors"][0]["message"]
+    return json.dumps(result["data"])
+
+def improvement_job(job, prompt, model_id, use_cache):
+    return finalize_improved_prompt(stream_job(job, prompt, model_id, use_cache))
+
+def comparison_job(job, prompt, model_id, use_cache):
+    return comparison_to_html(stream_job(job, prompt, model_id, use_cache))
+
+def get_job_manager():
+    if "jobs" not in st.session_state:
+        st.session_state.jobs = JobManager()
+    return st.session_state.jobs
+
+def apply_finished_jobs(jobs):
+    """Move results of finished background jobs into the panels' session state."""
+    for job in jobs.collect():
+        if job.status == "done":
+            st.session_state[PANEL_STATE_KEYS[job.key]] = job.result
+            st.session_state.call_stats[job.key] = job.stats
+        elif job.status == "error":
+            st.error(f"❌ {job.label} failed: {job.error}")
+        elif job.status == "cancelled":
+            st.info(f"⏹️ {job.label} cancelled")
+
+def render_job_panel(slot, title, key_prefix, jobs, **panel_options):
+    """Render a panel from session state, or the partial output and controls of its running job."""
+    job = jobs.get(key_prefix)
+    with slot.container():
+        if job is not None and job.running:
+            render_readonly_panel(title, job.text, key_prefix, PANEL_HEIGHT)
+            status = "cancelling…" if job.cancelled else f"{len(job.text)} chars"
+            st.caption(f"⏳ {job.label} · {job.elapsed():.1f}s · {status}")
+            if st.button("⏹️ Cancel", key=f"cancel_{key_prefix}"):
+                job.cancel()
+        else:
+            render_readonly_panel(title, st.session_state[PANEL_STATE_KEYS[key_prefix]], key_prefix, PANEL_HEIGHT, **panel_options)
+            render_call_stats(key_prefix)
+
+def render_call_stats(key_prefix):
+    stats = st.session_state.get("call_stats", {}).get(key_prefix)
+    if not stats or stats.get("total_sec") is None:
+        return
+    if stats.get("cached"):
+        st.caption(f"⚡ cached · {stats['total_sec']:.2f}s")
+    else:
+        ttft = stats.get("ttft_sec")
+        ttft_text = f"{ttft:.2f}s" if ttft is not None else "n/a"
+        st.caption(f"⏱️ first token {ttft_text} · total {stats['total_sec']:.2f}s")
+    if stats.get("cache_read_tokens") or stats.get("cache_write_tokens"):
+        st.caption(
+            f"🗂️ prompt cache: {stats.get('cache_read_tokens') or 0} read · "
+            f"{stats.get('cache_write_tokens') or 0} written"
+        )
+    if stats.get("chunks"):
+        st.caption(f"🧩 merged from {stats['chunks']} chunks")
+    for conflict in stats.get("conflicts", []):
+        st.warning(f"Conflict: {conflict}")
+    if stats.get("repairs"):
+        st.caption(f"🩹 {stats['repairs']} repair call(s)")
+    for error in stats.get("schema_errors", []):
+        st.warning(f"Schema: {error}")
+
 def render_app_ui():
     st.markdown("""
     <style>
@@ -95,6 +350,30 @@ def render_app_ui():
     model_options = get_available_models()
     st.session_state.selected_model = st.selectbox("Select LLM model:", options=model_options, index=0)
 
+    if response_cache_enabled():
+        st.session_state.use_cache = st.checkbox("⚡ Reuse cached model responses", value=True)
+        cache_stats = get_response_cache().stats()
+        st.caption(
+            f"Response cache: {cache_stats['entries']} entries, "
+            f"{cache_stats['hits']} hits / {cache_stats['misses']} misses this session"
+        )
+    else:
+        st.session_state.use_cache = False
+
+    budget_col, compact_col = st.columns(2)
+    with budget_col:
+        st.session_state.token_budget = st.number_input(
+            "Email token budget (0 = unlimited)", min_value=0, value=DEFAULT_TOKEN_BUDGET or 0, step=500
+        )
+    with compact_col:
+        st.session_state.compact_prompt = st.checkbox(
+            "✂️ Strip quoted replies, signatures and boilerplate", value=DEFAULT_COMPACTION
+        )
+        st.session_state.chunk_long = st.checkbox(
+            "🧩 Extract long attachments in concurrent chunks", value=True,
+            help="Split very long attachment text into overlapping chunks and merge the results",
+        )
+
     st.session_state.user_prompt = st.text_area(
         "Paste your prompt below (use `{email_data}` as placeholder):",
         value=st.session_state.user_prompt,
@@ -102,138 +381,29 @@ def render_app_ui():
         key="user_prompt_text_area"
     )
 
-    col1, col2, col3, col4 = st.columns(4)
-
-    with col1:
-        if st.button("🧠 Extract with LLM"):
-            st.session_state.extracted_data = ""
-            st.session_state.improved_prompt = ""
-            st.session_state.comparison = ""
-
-            if isinstance(st.session_state.email_data, dict):
-                full_prompt = st.session_state.user_prompt.replace(
-                    "{email_data}",
-                    build_email_prompt(st.session_state.email_data)
-                )
-            else:
-                full_prompt = st.session_state.user_prompt
+    st.session_state.schema_text = st.text_area(
+        "Optional JSON Schema for the output (enables validated tool-use extraction):",
+        value=st.session_state.get("schema_text", ""),
+        height=120,
+        key="schema_text_area"
+    )
+    try:
+        extraction_schema = load_schema(st.session_state.schema_text)
+    except ValueError as e:
+        st.error(f"❌ Invalid JSON Schema: {e}")
+        extraction_schema = None
 
-            result = query_claude(full_prompt, model_id=st.session_state.selected_model)
-            st.session_state.extracted_data = result["extracted_data"]
+    col1, col2, col3, col4, col5 = st.columns(5)
 
+    with col1:
+        extract_clicked = st.button("🧠 Extract with LLM")
     with col2:
-        if st.button("✨ Suggest Better Prompt"):
-            st.session_state.improved_prompt = ""
-            st.session_state.comparison = ""
-
-            email_snippet = st.session_state.email_data.get("text", "")[:5000] if isinstance(st.session_state.email_data, dict) else ""
-            sample_output = json.dumps({
-                "to_email": "carla.wells@sunbeltrentals.com",
-                "from_email": "notifications@paymode.com",
-                "received_date": "2025-05-14T00:00:00",
-                "payment_card_last4": "0906",
-                "payment_buyer_name": "Scranton Manufacturing Co Inc",
-                "payment_buyer_vendor_id": None,
-                "payment_merchant_reference_number": None,
-                "payment_amount": 7435.21,
-                "payment_order_notes": None,
-                "payment_merchant_name": None,
-                "payment_card_number": None,
-                "card_expiration_date": None,
-                "token_key": "Scranton Manufacturing Co_0906",
-                "invoices": [
-                    {
-                        "invoice_number": "3955",
-                        "account_number": None,
-                        "invoice_date": "2024-12-10",
-                        "invoice_amount": "84.05"
-                    }
-                ]
-            }, indent=2)
-
-            improvement_prompt = f"""
-You are a prompt optimization expert.
-
-Rewrite the user's extraction prompt into a clean, scalable, few-shot natural language prompt.
-
-Requirements:
-- Clear and user-friendly
-- Economical in terms of token usage
-- Flexible and reusable across different email formats
-- Natural language (not JSON or code)
-- Includes one natural-language example output
-
-Return **only** the rewritten prompt body — no email data or formatting instructions.
-
-## Original Prompt
-{st.session_state.user_prompt}
-
-## Email Snippet
-{email_snippet}
-
-## Example Output
-{sample_output}
-"""
-            result = query_claude(improvement_prompt, model_id=st.session_state.selected_model)
-            improved_body = clean_improved_prompt(result["extracted_data"])
-
-            final_prompt = improved_body.strip() + "\n\n" + \
-                "Do not include any explanations, notes, or other text outside the JSON object.\n" \
-                "Format numbers as actual numbers (not strings) where appropriate.\n" \
-                "Use null (not \"null\" in quotes) for missing values.\n" \
-                "If any field is missing, set it to null.\n" \
-                "Exclude any summary fields like \"invoice_amount\" at the root level — only return it inside individual invoices.\n\n" \
-                "Email Data:\n{email_data}"
-
-            st.session_state.improved_prompt = final_prompt
-
+        suggest_clicked = st.button("✨ Suggest Better Prompt")
     with col3:
-        if st.button("📝 Compare Prompts"):
-            st.session_state.comparison = ""
-
-            comparison_prompt = f"""
-Compare the following two prompts.
-
-Step 1: Create a markdown table comparing:
-- Clarity
-- Completeness
-- Flexibility
-- Reusability
-- Economic value
-- Ease of Understanding
-
-Step 2: Add 2–3 sentences explaining which is better and why. Be specific about the differences.
-
-Return only markdown.
-
-## Prompt A (User Prompt)
-{st.session_state.user_prompt}
-
-## Prompt B (Improved Prompt)
-{st.session_state.improved_prompt}
-"""
-            result = query_claude(comparison_prompt, model_id=st.session_state.selected_model)
-            markdown = result["extracted_data"]
-
-            if markdown.startswith("|"):
-                try:
-                    rows = [row.strip() for row in markdown.strip().splitlines() if row.strip()]
-                    header = rows[0].split("|")[1:-1]
-                    body = rows[2:]
-                    table_html = "<table><tr>" + "".join(f"<th>{h.strip()}</th>" for h in header) + "</tr>"
-                    for row in body:
-                        cols = row.split("|")[1:-1]
-                        table_html += "<tr>" + "".join(f"<td>{c.strip()}</td>" for c in cols) + "</tr>"
-                    table_html += "</table>"
-                    markdown_tail = "\n\n".join(markdown.split("\n\n")[1:])
-                    st.session_state.comparison = table_html + f"<br><br>{markdown_tail.strip()}"
-                except Exception as e:
-                    print("⚠️ Table conversion failed:", str(e))
-                    st.session_state.comparison = markdown
-            else:
-                st.session_state.comparison = markdown
-
+        compare_clicked = st.button("📝 Compare Prompts")
     with col4:
+        run_all_clicked = st.button("🚀 Run All", help="Extract and suggest concurrently, then compare")
+    with col5:
         if st.button("📋 Copy Improved Prompt"):
             st.session_state.copied = st.session_state.improved_prompt or "No improved prompt to copy"
             st.code(st.session_state.copied, language="text")
@@ -241,15 +411,169 @@ Return only markdown.
 
     st.markdown("---")
 
+    # Panels are laid out before any model call so job output can be rendered into them.
     colA, colB, colC, colD = st.columns(4, gap="small")
     with colA:
         preview_text = ""
-        if isinstance(st.session_state.email_data, dict):
-            preview_text = build_email_prompt(st.session_state.email_data)
+        if isinstance(st.session_state.email_data, Mapping):
+            preview_text, token_report = build_budgeted_prompt(
+                st.session_state.email_data,
+                token_budget=st.session_state.token_budget,
+                compact=st.session_state.compact_prompt,
+            )
+            total = token_report["total"]
+            st.caption(
+                f"~{total['final_tokens']} tokens sent · {total['dropped_tokens']} dropped of {total['original_tokens']}"
+            )
+            if hasattr(st.session_state.email_data, "footprint"):
+                st.caption(f"🧮 Parsed email in memory: {st.session_state.email_data.footprint()['total'] / 1024:.1f} KB")
         render_readonly_panel("📄 Email Preview", preview_text, "email_preview", PANEL_HEIGHT)
     with colB:
-        render_readonly_panel("📦 LLM Extracted Data", st.session_state.extracted_data, "llm_extracted", PANEL_HEIGHT, is_json=True)
+        extracted_slot = st.empty()
     with colC:
-        render_readonly_panel("🌟 Improved Prompt", st.session_state.improved_prompt, "improved_prompt", PANEL_HEIGHT)
+        improved_slot = st.empty()
     with colD:
-        render_readonly_panel("📑 Prompt Comparison", st.session_state.comparison, "prompt_comparison", PANEL_HEIGHT, html_mode=True)
+        comparison_slot = st.empty()
+
+    if "call_stats" not in st.session_state:
+        st.session_state.call_stats = {}
+
+    # Model calls run as background jobs: the script run only starts them, and the page
+    # re-renders every UI_JOB_POLL_INTERVAL until they finish. Prompts are built here,
+    # in the script thread, so the parsed email is never touched by a worker.
+    jobs = get_job_manager()
+    apply_finished_jobs(jobs)
+    model_id = st.session_state.selected_model
+    use_cache = st.session_state.use_cache
+
+    def start_comparison(improved_prompt, user_prompt=st.session_state.user_prompt):
+        jobs.submit(
+            "prompt_comparison", "Compare Prompts", comparison_job,
+            build_comparison_prompt(user_prompt, improved_prompt), model_id, use_cache,
+        )
+
+    if extract_clicked or run_all_clicked:
+        st.session_state.extracted_data = ""
+        st.session_state.call_stats.pop("llm_extracted", None)
+        if extract_clicked:
+            st.session_state.improved_prompt = ""
+            st.session_state.comparison = ""
+
+        prompt_prefix, email_prompt = build_extraction_prompt(
+            st.session_state.user_prompt,
+            st.session_state.email_data,
+            token_budget=st.session_state.token_budget,
+            compact=st.session_state.compact_prompt,
+        )
+        if st.session_state.chunk_long and isinstance(st.session_state.email_data, Mapping) \
+                and needs_chunking(st.session_state.email_data, compact=st.session_state.compact_prompt):
+            chunk_prompts = build_chunk_prompts(
+                st.session_state.email_data, st.session_state.user_prompt, compact=st.session_state.compact_prompt
+            )
+            jobs.submit(
+                "llm_extracted", f"Extract in {len(chunk_prompts)} chunks", chunked_extraction_job,
+                chunk_prompts, model_id, use_cache, extraction_schema,
+            )
+        elif extraction_schema is not None:
+            jobs.submit(
+                "llm_extracted", "Extract with schema", schema_extraction_job,
+                email_prompt, extraction_schema, model_id, use_cache, prompt_prefix,
+            )
+        else:
+            jobs.submit(
+                "llm_extracted", "Extract with LLM", extraction_job,
+                email_prompt, model_id, use_cache, prompt_prefix,
+            )
+
+    if suggest_clicked or run_all_clicked:
+        st.session_state.improved_prompt = ""
+        st.session_state.comparison = ""
+        st.session_state.call_stats.pop("improved_prompt", None)
+
+        improvement_prompt = build_improvement_prompt(st.session_state.user_prompt, st.session_state.email_data)
+        # Run All chains the comparison as soon as the improved prompt arrives.
+        jobs.submit(
+            "improved_prompt", "Suggest Better Prompt", improvement_job,
+            improvement_prompt, model_id, use_cache,
+            then=start_comparison if run_all_clicked else None,
+        )
+
+    if compare_clicked:
+        st.session_state.comparison = ""
+        st.session_state.call_stats.pop("prompt_comparison", None)
+        start_comparison(st.session_state.improved_prompt)
+
+    render_job_panel(extracted_slot, "📦 LLM Extracted Data", "llm_extracted", jobs, is_json=True)
+    render_job_panel(improved_slot, "🌟 Improved Prompt", "improved_prompt", jobs)
+    render_job_panel(comparison_slot, "📑 Prompt Comparison", "prompt_comparison", jobs, html_mode=True)
+
+    st.markdown("---")
+    st.markdown("### 🧮 Model Comparison")
+    if st.button("🧮 Run Extraction on All Models"):
+        prompt_prefix, email_prompt = build_extraction_prompt(
+            st.session_state.user_prompt,
+            st.session_state.email_data,
+            token_budget=st.session_state.token_budget,
+            compact=st.session_state.compact_prompt,
+        )
+        with st.spinner("Running all models concurrently..."):
+            model_runs = query_all_models(email_prompt, use_cache=st.session_state.use_cache, prefix=prompt_prefix)
+        for run in model_runs:
+            run["extracted_data"] = postprocess_json(run["extracted_data"])
+        st.session_state.model_runs = model_runs
+
+    model_runs = st.session_state.get("model_runs")
+    if model_runs:
+        st.dataframe(
+            [
+                {
+                    "Model": run["model_id"],
+                    "Latency (s)": run["latency_sec"],
+                    "Input tokens": run["input_tokens"],
+                    "Output tokens": run["output_tokens"],
+                    "Cache read tokens": run["cache_read_tokens"],
+                    "Cache write tokens": run["cache_write_tokens"],
+                    "Est. cost ($)": run["cost_usd"],
+                }
+                for run in model_runs
+            ],
+            use_container_width=True,
+        )
+        output_cols = st.columns(len(model_runs), gap="small")
+        for col, run in zip(output_cols, model_runs):
+            with col:
+                st.markdown(f"**{run['model_id']}**")
+                st.code(format_json_nicely(run["extracted_data"]), language="json")
+
+    with st.expander("🎯 Evaluate Prompts on a Golden Set"):
+        golden_dir = st.text_input("Folder with <name>.eml + <name>.json pairs", key="golden_dir")
+        if st.button("🎯 Run Evaluation") and golden_dir:
+            cases = load_golden_set(golden_dir)
+            prompts = {"User Prompt": st.session_state.user_prompt}
+            if st.session_state.improved_prompt:
+                prompts["Improved Prompt"] = st.session_state.improved_prompt
+            with st.spinner(f"Evaluating {len(prompts)} prompt(s) over {len(cases)} emails..."):
+                st.session_state.evaluation = {
+                    name: evaluate_prompt(
+                        cases, template, st.session_state.selected_model, use_cache=st.session_state.use_cache,
+                        token_budget=st.session_state.token_budget, compact=st.session_state.compact_prompt,
+                    )["summary"]
+                    for name, template in prompts.items()
+                }
+        if st.session_state.get("evaluation"):
+            st.dataframe(
+                [{"Prompt": name, **summary} for name, summary in st.session_state.evaluation.items()],
+                use_container_width=True,
+            )
+
+    with st.expander("📈 Metrics"):
+        summary = metrics_summary()
+        if summary:
+            st.dataframe(summary, use_container_width=True)
+        else:
+            st.caption("No calls recorded yet.")
+
+    # Keep polling while background jobs run; any click interrupts the sleep with a fresh run.
+    if jobs.active():
+        time.sleep(UI_JOB_POLL_INTERVAL)
+        st.rerun()